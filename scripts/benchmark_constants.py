@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+import argparse
+import io
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+from definition import *
+from make_pharo_bindings import generatePharoBindings
+from synthetic_api import makeSyntheticApi
+
+Modes = [
+    ('reflective', 'false'),
+    ('direct', 'true'),
+]
+
+# Loads only the constants pool, which does not depend on the other generated
+# classes, and initializes it again once it is loaded.
+LOAD_SCRIPT = \
+"""| definitions loadTime initializeTime |
+definitions := TonelParser parseString: '%(ClassFile)s' asFileReference contents.
+loadTime := [ MCPackageLoader installSnapshot: (MCSnapshot fromDefinitions: definitions) ] timeToRun.
+initializeTime := [ (Smalltalk at: #%(ClassName)s) initialize ] timeToRun.
+Stdio stdout
+	nextPutAll: '%(Mode)s'; tab;
+	nextPutAll: loadTime asMilliSeconds printString; tab;
+	nextPutAll: initializeTime asMilliSeconds printString; lf; flush.
+"""
+
+def generateSources(buildDirectory, enums, constants):
+    source = io.StringIO()
+    makeSyntheticApi(source, interfaces=0, methods=0, enums=enums, constants=constants, structs=0)
+    api = ApiDefinition.loadFromFileNamed(io.BytesIO(source.getvalue().encode()), streaming=True)
+    namespacePrefix = api.getBindingProperty('Pharo', 'namespacePrefix')
+    package = api.getBindingProperty('Pharo', 'package')
+    className = namespacePrefix + 'Constants'
+
+    scripts = []
+    for mode, directConstants in Modes:
+        outputDirectory = os.path.join(buildDirectory, mode)
+        os.makedirs(outputDirectory, exist_ok=True)
+        api.bindings['Pharo'].properties['directConstants'] = directConstants
+        generatePharoBindings(api, outputDirectory)
+
+        script = os.path.join(buildDirectory, mode + '.st')
+        with open(script, 'w') as f:
+            f.write(LOAD_SCRIPT % {
+                'ClassFile': os.path.abspath(os.path.join(outputDirectory, package, className + '.class.st')),
+                'ClassName': className,
+                'Mode': mode,
+            })
+        scripts.append(script)
+    return scripts
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-constants',
+        description='Measures the load and initialization time of a Pharo constants pool with and without directConstants.')
+    parser.add_argument('-enums', type=int, default=100, help='number of enums (default 100)')
+    parser.add_argument('-constants', type=int, default=100, help='number of constants per enum (default 100)')
+    parser.add_argument('-vm', default=os.environ.get('PHARO_VM'), help='Pharo virtual machine, $PHARO_VM by default')
+    parser.add_argument('-image', default=os.environ.get('PHARO_IMAGE'), help='Pharo image, $PHARO_IMAGE by default')
+    parser.add_argument('-keep', metavar='DIR', help='build in this directory and keep the generated files')
+    arguments = parser.parse_args()
+    if arguments.vm is None or arguments.image is None:
+        parser.error('a Pharo virtual machine and image are required')
+
+    if arguments.keep is not None:
+        buildDirectory = arguments.keep
+        temporaryDirectory = None
+    else:
+        temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-constants-')
+        buildDirectory = temporaryDirectory.name
+
+    try:
+        scripts = generateSources(buildDirectory, arguments.enums, arguments.constants)
+        print('%d constants' % (arguments.enums * arguments.constants))
+        print('mode\tload ms\tinitialize ms')
+        sys.stdout.flush()
+        # Each mode runs in a fresh image, without saving it.
+        for script in scripts:
+            subprocess.run([arguments.vm, '--headless', arguments.image, 'st', '--quit', script], check=True)
+    finally:
+        if temporaryDirectory is not None:
+            temporaryDirectory.cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+import argparse
+import io
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+from definition import *
+from make_headers import generateHeaders
+from make_headers_cpp import generateCppHeader
+from make_icdloader import generateIcdLoader
+from synthetic_api import makeSyntheticApi
+
+# A driver with a single object, whose methods only count the calls.
+DRIVER_SOURCE = \
+"""#include <SYNTH/synth.h>
+
+struct _synth_object_v0_0
+{
+    synth_icd_dispatch *dispatch;
+    long counter;
+};
+
+static synth_error addReference(synth_object_v0_0 *object)
+{
+    ++object->counter;
+    return SYNTH_OK;
+}
+
+static synth_icd_dispatch driverDispatch;
+static synth_object_v0_0 driverObject;
+
+extern "C" SYNTH_EXPORT synth_object_v0_0 *benchmarkCreateObject()
+{
+    driverDispatch.icd_interface_version = 10;
+    driverDispatch.synthAddReferenceObjectV00 = addReference;
+    driverObject.dispatch = &driverDispatch;
+    return &driverObject;
+}
+"""
+
+BENCHMARK_SOURCE = \
+"""#include <SYNTH/synth.hpp>
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+
+extern "C" synth_object_v0_0 *benchmarkCreateObject();
+
+template<typename F>
+static void measure(const char *name, long iterations, F function)
+{
+    auto startTime = std::chrono::steady_clock::now();
+    for(long i = 0; i < iterations; ++i)
+        function();
+    auto endTime = std::chrono::steady_clock::now();
+    double nanoseconds = std::chrono::duration<double, std::nano>(endTime - startTime).count();
+    printf("%-24s %8.3f ns/call\\n", name, nanoseconds / iterations);
+}
+
+int main(int argc, const char **argv)
+{
+    long iterations = atol(argv[1]);
+    synth_object_v0_0 *object = benchmarkCreateObject();
+    measure("exported entry point", iterations, [=]() { synthAddReferenceObjectV00(object); });
+    measure("direct dispatch", iterations, [=]() { synthDirectAddReferenceObjectV00(object); });
+    measure("C++ wrapper", iterations, [=]() { object->addReference(); });
+    return 0;
+}
+"""
+
+def generateSources(buildDirectory):
+    source = io.StringIO()
+    makeSyntheticApi(source, interfaces=1, methods=1, enums=0, structs=0)
+    api = ApiDefinition.loadFromFileNamed(io.BytesIO(source.getvalue().encode()), streaming=True)
+    api.bindings['C'].properties['directDispatch'] = 'true'
+
+    includeDirectory = os.path.join(buildDirectory, 'include', 'SYNTH')
+    os.makedirs(includeDirectory, exist_ok=True)
+    generateHeaders(api, includeDirectory)
+    generateCppHeader(api, includeDirectory)
+    generateIcdLoader(api, buildDirectory)
+
+    with open(os.path.join(buildDirectory, 'driver.cpp'), 'w') as f:
+        f.write(DRIVER_SOURCE)
+    with open(os.path.join(buildDirectory, 'benchmark.cpp'), 'w') as f:
+        f.write(BENCHMARK_SOURCE)
+
+def build(buildDirectory, compiler, flags):
+    # The entry points are in a shared library, so their calls go through the PLT like for a real loader.
+    includeFlag = '-I' + os.path.join(buildDirectory, 'include')
+    library = os.path.join(buildDirectory, 'libsynth.so')
+    program = os.path.join(buildDirectory, 'benchmark')
+    subprocess.run([compiler] + flags + [includeFlag, '-DSYNTH_BUILD', '-fPIC', '-shared', '-o', library,
+        os.path.join(buildDirectory, 'redirection.cpp'), os.path.join(buildDirectory, 'driver.cpp')], check=True)
+    subprocess.run([compiler] + flags + [includeFlag, '-o', program, os.path.join(buildDirectory, 'benchmark.cpp'),
+        '-L' + buildDirectory, '-lsynth', '-Wl,-rpath,' + buildDirectory], check=True)
+    return program
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-dispatch',
+        description='Measures the cost per call of the exported entry points against the direct dispatch table callers.')
+    parser.add_argument('-iterations', type=int, default=100000000, help='calls per measurement')
+    parser.add_argument('-compiler', default=os.environ.get('CXX', 'c++'), help='C++ compiler, $CXX or c++ by default')
+    parser.add_argument('-flags', default='-O2', help='compiler flags')
+    parser.add_argument('-keep', metavar='DIR', help='build in this directory and keep the generated files')
+    arguments = parser.parse_args()
+
+    if arguments.keep is not None:
+        buildDirectory = arguments.keep
+        temporaryDirectory = None
+    else:
+        temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-dispatch-')
+        buildDirectory = temporaryDirectory.name
+
+    try:
+        generateSources(buildDirectory)
+        program = build(buildDirectory, arguments.compiler, arguments.flags.split())
+        sys.stdout.flush()
+        subprocess.run([program, str(arguments.iterations)], check=True)
+    finally:
+        if temporaryDirectory is not None:
+            temporaryDirectory.cleanup()
+
+if __name__ == '__main__':
+    main()
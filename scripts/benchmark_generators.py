@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+import argparse
+import io
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from definition import *
+from generate_all import Backends
+from memory_report import countMethods
+from output_files import MemoryOutputTarget
+from synthetic_api import makeSyntheticApi, addSyntheticApiArguments, syntheticApiParameters
+
+# Parameters multiplied by each scale factor. The shape of every interface
+# stays the same, so the emission time should grow linearly with the scale.
+ScaledParameters = ['interfaces', 'enums', 'structs']
+
+# Growth exponent between two scales above which a phase is reported as super-linear.
+SuperLinearThreshold = 1.3
+
+def currentRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def outputPathFor(backendName):
+    if backendName == 'sysmel':
+        return 'out/bindings.sysmel'
+    return 'out/' + backendName
+
+def measure(function, repeat):
+    # Fastest of the untraced runs, and the peak memory of a separate traced run.
+    best = None
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    try:
+        function()
+        currentBytes, peakBytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peakBytes, result
+
+def benchmarkScale(parameters, scale, repeat, streaming):
+    scaledParameters = dict(parameters)
+    for name in ScaledParameters:
+        scaledParameters[name] = parameters[name] * scale
+
+    source = io.StringIO()
+    makeSyntheticApi(source, **scaledParameters)
+    sourceBytes = source.getvalue().encode()
+
+    parseTime, parsePeak, api = measure(lambda: ApiDefinition.loadFromFileNamed(io.BytesIO(sourceBytes)), repeat)
+    run = {
+        'scale': scale,
+        'parameters': scaledParameters,
+        'sourceBytes': len(sourceBytes),
+        'methods': countMethods(api),
+        'parse': {'seconds': parseTime, 'peakBytes': parsePeak},
+        'backends': {},
+    }
+    if streaming:
+        parseTime, parsePeak, streamedApi = measure(lambda: ApiDefinition.loadFromFileNamed(io.BytesIO(sourceBytes), streaming=True), repeat)
+        run['parseStreaming'] = {'seconds': parseTime, 'peakBytes': parsePeak}
+
+    for name, option, help, function in Backends:
+        def generate():
+            target = MemoryOutputTarget()
+            outputFiles = function(api, outputPathFor(name), target=target)
+            return target, outputFiles
+        elapsed, peakBytes, (target, outputFiles) = measure(generate, repeat)
+        run['backends'][name] = {
+            'seconds': elapsed,
+            'peakBytes': peakBytes,
+            'outputBytes': sum(len(target.files[path].encode()) for path in outputFiles.changedFiles),
+            'files': len(outputFiles.changedFiles),
+        }
+    return run
+
+# The phases of the loaders, with their keys in the results.
+ParsePhases = [('parse', 'parse'), ('parse streaming', 'parseStreaming')]
+
+def parsePhases(run):
+    return [phase for phase, key in ParsePhases if key in run]
+
+def phaseResult(run, phase):
+    for parsePhase, key in ParsePhases:
+        if phase == parsePhase:
+            return run[key]
+    return run['backends'][phase]
+
+def phaseSeconds(run, phase):
+    return phaseResult(run, phase)['seconds']
+
+def computeGrowth(runs):
+    # Largest exponent k of time ~ scale^k between consecutive scales.
+    if not runs:
+        return {}
+    phases = parsePhases(runs[0]) + [name for name, option, help, function in Backends]
+    growth = {}
+    for phase in phases:
+        exponents = []
+        for previous, current in zip(runs, runs[1:]):
+            ratio = phaseSeconds(current, phase) / phaseSeconds(previous, phase)
+            exponents.append(math.log(ratio) / math.log(current['scale'] / previous['scale']))
+        if exponents:
+            growth[phase] = max(exponents)
+    return growth
+
+def printRuns(runs, growth, out):
+    for run in runs:
+        out.write('scale %d: %d methods, %d source bytes\n' % (run['scale'], run['methods'], run['sourceBytes']))
+        out.write('  %-16s %10s %12s %12s\n' % ('phase', 'seconds', 'peak bytes', 'output bytes'))
+        for phase in parsePhases(run):
+            result = phaseResult(run, phase)
+            out.write('  %-16s %10.4f %12d %12s\n' % (phase, result['seconds'], result['peakBytes'], ''))
+        for name, result in run['backends'].items():
+            out.write('  %-16s %10.4f %12d %12d\n' % (name, result['seconds'], result['peakBytes'], result['outputBytes']))
+
+    if growth:
+        out.write('growth exponent (1.0 is linear)\n')
+        for phase, exponent in growth.items():
+            warning = '  super-linear' if exponent > SuperLinearThreshold else ''
+            out.write('  %-16s %6.2f%s\n' % (phase, exponent, warning))
+
+def printComparison(runs, baseline, out):
+    baselineRuns = dict((run['scale'], run) for run in baseline['runs'])
+    out.write('time relative to %s\n' % baseline.get('label'))
+    for run in runs:
+        baselineRun = baselineRuns.get(run['scale'])
+        if baselineRun is None:
+            continue
+        out.write('scale %d:\n' % run['scale'])
+        for phase in parsePhases(run) + list(run['backends'].keys()):
+            if phase not in parsePhases(baselineRun) + list(baselineRun['backends'].keys()):
+                continue
+            out.write('  %-16s %6.2fx\n' % (phase, phaseSeconds(run, phase) / phaseSeconds(baselineRun, phase)))
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-generators',
+        description='Runs every generator backend against synthetic API definitions of increasing size.')
+    addSyntheticApiArguments(parser)
+    parser.add_argument('-scales', default='1,2,4', help='comma separated multipliers of the interface, enum and struct counts')
+    parser.add_argument('-repeat', type=int, default=3, help='runs per measurement, the fastest one is reported')
+    parser.add_argument('-output', help='JSON file for the results')
+    parser.add_argument('-compare', metavar='JSON', help='results of a previous run to compare against')
+    parser.add_argument('-label', help='name of the results, the git revision by default')
+    parser.add_argument('-streaming', action='store_true', help='also measure the streaming loader')
+    arguments = parser.parse_args()
+
+    parameters = syntheticApiParameters(arguments)
+    scales = [int(scale) for scale in arguments.scales.split(',')]
+    runs = [benchmarkScale(parameters, scale, arguments.repeat, arguments.streaming) for scale in scales]
+    growth = computeGrowth(runs)
+    printRuns(runs, growth, sys.stdout)
+
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as f:
+            printComparison(runs, json.load(f), sys.stdout)
+
+    if arguments.output is not None:
+        results = {
+            'label': arguments.label or currentRevision(),
+            'python': platform.python_version(),
+            'repeat': arguments.repeat,
+            'runs': runs,
+            'growth': growth,
+        }
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=1)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+import argparse
+import io
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+from definition import *
+from make_headers import generateHeaders
+from make_implementation_stubs_cpp import generateImplementationHeader
+from synthetic_api import makeSyntheticApi
+
+# Object layouts, with their intrusiveObjects property and interface allocator.
+Modes = [
+    ('separate', 'false', 'heap'),
+    ('intrusive', 'true', 'heap'),
+    ('pool', 'true', 'pool'),
+]
+
+# Creates and releases objects one at a time and in batches, and calls a
+# virtual method through the references of many live objects.
+BENCHMARK_SOURCE = \
+"""#include "synth_impl.hpp"
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <vector>
+
+synth_icd_dispatch Synth::cppRefcountedDispatchTable;
+
+static long results;
+
+struct Object : Synth::object_v0_0
+{
+    long value = 0;
+
+    virtual synth_error method0() override
+    {
+        ++value;
+        return SYNTH_OK;
+    }
+};
+
+template<typename F>
+static void measure(const char *mode, const char *name, long operations, F function)
+{
+    auto startTime = std::chrono::steady_clock::now();
+    function();
+    auto endTime = std::chrono::steady_clock::now();
+    double nanoseconds = std::chrono::duration<double, std::nano>(endTime - startTime).count();
+    printf("%-10s %-20s %8.3f ns/op\\n", mode, name, nanoseconds / operations);
+}
+
+int main(int argc, const char **argv)
+{
+    long iterations = atol(argv[1]);
+    const char *mode = argv[2];
+    const long batchSize = 1024;
+    const long liveObjects = 65536;
+
+    measure(mode, "create and release", iterations, [=]() {
+        for(long i = 0; i < iterations; ++i)
+            results += Synth::makeObject<Object> ()->method0();
+    });
+
+    measure(mode, "batch churn", iterations / batchSize * batchSize, [=]() {
+        std::vector<Synth::object_v0_0_ref> objects;
+        objects.reserve(batchSize);
+        for(long i = 0; i < iterations / batchSize; ++i)
+        {
+            for(long j = 0; j < batchSize; ++j)
+                objects.push_back(Synth::makeObject<Object> ());
+            objects.clear();
+        }
+    });
+
+    std::vector<Synth::object_v0_0_ref> objects;
+    for(long i = 0; i < liveObjects; ++i)
+        objects.push_back(Synth::makeObject<Object> ());
+    measure(mode, "method call", iterations, [&]() {
+        for(long i = 0; i < iterations; ++i)
+            results += objects[i & (liveObjects - 1)]->method0();
+    });
+    return results != SYNTH_OK;
+}
+"""
+
+def generateSources(buildDirectory):
+    source = io.StringIO()
+    makeSyntheticApi(source, interfaces=1, methods=1, arguments=0, enums=0, constants=0, structs=0)
+    api = ApiDefinition.loadFromFileNamed(io.BytesIO(source.getvalue().encode()), streaming=True)
+    interface = list(api.versions.values())[0].interfaces[0]
+
+    sourceDirectories = []
+    for mode, intrusiveObjects, allocator in Modes:
+        outputDirectory = os.path.join(buildDirectory, mode)
+        os.makedirs(outputDirectory, exist_ok=True)
+        api.bindings['C++/Impl'].properties['intrusiveObjects'] = intrusiveObjects
+        interface.allocator = allocator
+        generateHeaders(api, outputDirectory)
+        generateImplementationHeader(api, outputDirectory)
+        with open(os.path.join(outputDirectory, 'benchmark.cpp'), 'w') as f:
+            f.write(BENCHMARK_SOURCE)
+        sourceDirectories.append((mode, outputDirectory))
+    return sourceDirectories
+
+def build(sourceDirectory, compiler, flags):
+    program = os.path.join(sourceDirectory, 'benchmark')
+    subprocess.run([compiler] + flags + ['-std=c++11', '-o', program, os.path.join(sourceDirectory, 'benchmark.cpp')], check=True)
+    return program
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-objects',
+        description='Measures the creation, release and method call costs of the C++ implementation objects with each layout.')
+    parser.add_argument('-iterations', type=int, default=10000000, help='operations per measurement')
+    parser.add_argument('-compiler', default=os.environ.get('CXX', 'c++'), help='C++ compiler, $CXX or c++ by default')
+    parser.add_argument('-flags', default='-O2', help='compiler flags')
+    parser.add_argument('-keep', metavar='DIR', help='build in this directory and keep the generated files')
+    arguments = parser.parse_args()
+
+    if arguments.keep is not None:
+        buildDirectory = arguments.keep
+        temporaryDirectory = None
+    else:
+        temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-objects-')
+        buildDirectory = temporaryDirectory.name
+
+    try:
+        programs = [(mode, build(sourceDirectory, arguments.compiler, arguments.flags.split()))
+            for mode, sourceDirectory in generateSources(buildDirectory)]
+        sys.stdout.flush()
+        for mode, program in programs:
+            subprocess.run([program, str(arguments.iterations), mode], check=True)
+    finally:
+        if temporaryDirectory is not None:
+            temporaryDirectory.cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+import argparse
+import io
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+from definition import *
+from make_headers import generateHeaders
+from make_implementation_stubs_cpp import generateImplementationHeader, generateDispatchInclude
+from synthetic_api import makeSyntheticApi
+
+# The threading attribute of the API in each build.
+Modes = ['multiple', 'single']
+
+# The dispatch functions of the implementation, with a function for creating an object.
+LIBRARY_SOURCE = \
+"""#include "synth_impl.hpp"
+#include "synth_impl_dispatch.inc"
+
+struct Object : Synth::object_v0_0
+{
+};
+
+extern "C" SYNTH_EXPORT synth_object_v0_0 *benchmarkCreateObject()
+{
+    return reinterpret_cast<synth_object_v0_0*> (Synth::makeObject<Object> ().disown());
+}
+"""
+
+BENCHMARK_SOURCE = \
+"""#include "synth.h"
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+
+extern "C" synth_object_v0_0 *benchmarkCreateObject();
+
+int main(int argc, const char **argv)
+{
+    long iterations = atol(argv[1]);
+    const char *mode = argv[2];
+    synth_object_v0_0 *object = benchmarkCreateObject();
+
+    auto startTime = std::chrono::steady_clock::now();
+    for(long i = 0; i < iterations; ++i)
+    {
+        synthAddReferenceObjectV00(object);
+        synthReleaseObjectV00(object);
+    }
+    auto endTime = std::chrono::steady_clock::now();
+    double nanoseconds = std::chrono::duration<double, std::nano>(endTime - startTime).count();
+    printf("%-10s %8.3f ns/pair %8.1f M pairs/s\\n", mode, nanoseconds / iterations, iterations * 1000.0 / nanoseconds);
+
+    synthReleaseObjectV00(object);
+    return 0;
+}
+"""
+
+def generateSources(buildDirectory):
+    source = io.StringIO()
+    makeSyntheticApi(source, interfaces=1, methods=0, enums=0, constants=0, structs=0)
+    api = ApiDefinition.loadFromFileNamed(io.BytesIO(source.getvalue().encode()), streaming=True)
+
+    sourceDirectories = []
+    for mode in Modes:
+        outputDirectory = os.path.join(buildDirectory, mode)
+        os.makedirs(outputDirectory, exist_ok=True)
+        api.threading = mode
+        generateHeaders(api, outputDirectory)
+        generateImplementationHeader(api, outputDirectory)
+        generateDispatchInclude(api, outputDirectory)
+        with open(os.path.join(outputDirectory, 'library.cpp'), 'w') as f:
+            f.write(LIBRARY_SOURCE)
+        with open(os.path.join(outputDirectory, 'benchmark.cpp'), 'w') as f:
+            f.write(BENCHMARK_SOURCE)
+        sourceDirectories.append((mode, outputDirectory))
+    return sourceDirectories
+
+def build(sourceDirectory, compiler, flags):
+    # The dispatch functions are in a shared library, so that each call crosses the C API like in a real driver.
+    library = os.path.join(sourceDirectory, 'libsynth.so')
+    program = os.path.join(sourceDirectory, 'benchmark')
+    subprocess.run([compiler] + flags + ['-std=c++11', '-DSYNTH_BUILD', '-fPIC', '-shared', '-o', library,
+        os.path.join(sourceDirectory, 'library.cpp')], check=True)
+    subprocess.run([compiler] + flags + ['-o', program, os.path.join(sourceDirectory, 'benchmark.cpp'),
+        '-L' + sourceDirectory, '-lsynth', '-Wl,-rpath,' + sourceDirectory], check=True)
+    return program
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-refcount',
+        description='Measures the addReference and release throughput of the C++ implementation objects with each threading.')
+    parser.add_argument('-iterations', type=int, default=100000000, help='retain and release pairs per measurement')
+    parser.add_argument('-compiler', default=os.environ.get('CXX', 'c++'), help='C++ compiler, $CXX or c++ by default')
+    parser.add_argument('-flags', default='-O2', help='compiler flags')
+    parser.add_argument('-keep', metavar='DIR', help='build in this directory and keep the generated files')
+    arguments = parser.parse_args()
+
+    if arguments.keep is not None:
+        buildDirectory = arguments.keep
+        temporaryDirectory = None
+    else:
+        temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-refcount-')
+        buildDirectory = temporaryDirectory.name
+
+    try:
+        programs = [(mode, build(sourceDirectory, arguments.compiler, arguments.flags.split()))
+            for mode, sourceDirectory in generateSources(buildDirectory)]
+        sys.stdout.flush()
+        for mode, program in programs:
+            subprocess.run([program, str(arguments.iterations), mode], check=True)
+    finally:
+        if temporaryDirectory is not None:
+            temporaryDirectory.cleanup()
+
+if __name__ == '__main__':
+    main()
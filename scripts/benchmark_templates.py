@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import argparse
+import io
+import os.path
+import time
+from string import Template
+
+from definition import *
+from output_files import MemoryOutputTarget
+from synthetic_api import makeSyntheticApi, addSyntheticApiArguments, syntheticApiParameters
+
+import emitter
+import make_headers
+import make_headers_cpp
+import make_icdloader
+import make_implementation_stubs_cpp
+import make_pharo_bindings
+import make_sysmel_bindings
+
+Backends = [
+    ('headers', make_headers.generateHeaders),
+    ('cpp-headers', make_headers_cpp.generateCppHeader),
+    ('icdloader', make_icdloader.generateIcdLoader),
+    ('impl-header', make_implementation_stubs_cpp.generateImplementationHeader),
+    ('impl-dispatch', make_implementation_stubs_cpp.generateDispatchInclude),
+    ('pharo', make_pharo_bindings.generatePharoBindings),
+    ('squeak', make_pharo_bindings.generateSqueakBindings),
+    ('sysmel', lambda api, outputDirectory, target: make_sysmel_bindings.generateSysmelBindings(api, os.path.join(outputDirectory, 'bindings.sysmel'), target)),
+]
+
+def processTextWithStringTemplate(self, text, **extraVariables):
+    # The expansion used before the compiled template cache.
+    t = Template(text)
+    return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
+
+TemplateEngines = [
+    ('string.Template', processTextWithStringTemplate),
+    ('compiled', emitter.Emitter.processText),
+]
+
+def runBackend(api, function):
+    # Each run uses a fresh in memory target, so that the manifest never skips the generation.
+    target = MemoryOutputTarget()
+    startTime = time.perf_counter()
+    outputFiles = function(api, 'out', target=target)
+    elapsed = time.perf_counter() - startTime
+    return elapsed, sum(target.files[path].count('\n') for path in outputFiles.changedFiles)
+
+def benchmarkEngine(api, processText, repeat):
+    emitter.Emitter.processText = processText
+    emitter.TemplateCache.clear()
+    results = {}
+    for name, function in Backends:
+        best = None
+        for i in range(repeat):
+            elapsed, lines = runBackend(api, function)
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = (best, lines)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark-templates',
+        description='Compares the emitted lines per second of every backend with string.Template and with the compiled templates.')
+    addSyntheticApiArguments(parser)
+    parser.add_argument('-repeat', type=int, default=3, help='runs per backend, the fastest one is reported')
+    arguments = parser.parse_args()
+
+    source = io.StringIO()
+    makeSyntheticApi(source, **syntheticApiParameters(arguments))
+    api = ApiDefinition.loadFromFileNamed(io.BytesIO(source.getvalue().encode()), streaming=True)
+
+    originalProcessText = emitter.Emitter.processText
+    try:
+        engineResults = [(engineName, benchmarkEngine(api, processText, arguments.repeat)) for engineName, processText in TemplateEngines]
+    finally:
+        emitter.Emitter.processText = originalProcessText
+
+    print('%-16s %10s %16s %16s %8s' % ('backend', 'lines', engineResults[0][0] + ' l/s', engineResults[1][0] + ' l/s', 'speedup'))
+    totals = [0.0, 0.0]
+    totalLines = 0
+    for name, function in Backends:
+        (baseTime, lines), (newTime, newLines) = engineResults[0][1][name], engineResults[1][1][name]
+        assert lines == newLines
+        totals[0] += baseTime
+        totals[1] += newTime
+        totalLines += lines
+        print('%-16s %10d %16.0f %16.0f %7.2fx' % (name, lines, lines / baseTime, lines / newTime, baseTime / newTime))
+    print('%-16s %10d %16.0f %16.0f %7.2fx' % ('total', totalLines, totalLines / totals[0], totalLines / totals[1], totals[0] / totals[1]))
+
+if __name__ == '__main__':
+    main()
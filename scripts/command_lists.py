@@ -0,0 +1,77 @@
+from definition import *
+
+# Every command starts with its 32 bits opcode and its 32 bits size in bytes,
+# followed by one 64 bits slot for each argument, the object included.
+# Integers are stored as 64 bits integers, floats and doubles in the first
+# bytes of their slot, and objects as their address.
+CommandHeaderSize = 8
+CommandArgumentSize = 8
+
+def hasCommandLists(api):
+    return api.getOptionalBindingProperty('C', 'commandLists', 'false') == 'true'
+
+def getCommandArgumentKind(index, typeString):
+    # The kind of slot of an argument, or None when it cannot be recorded.
+    # Pointers to memory are not recorded, because the memory may be gone
+    # when the command list is executed.
+    descriptor = index.getTypeDescriptor(typeString)
+    if descriptor.isInterfaceReference:
+        return 'handle'
+    if descriptor.decorators != '':
+        return None
+    if descriptor.kind == 'enum':
+        return 'integer'
+    if descriptor.kind != 'typedef' or '*' in descriptor.definition.ctype:
+        return None
+    if descriptor.definition.ctype == 'float':
+        return 'float'
+    if descriptor.definition.ctype == 'double':
+        return 'double'
+    return 'integer'
+
+def isCommandMethod(index, method):
+    if method.clazz is None or method.returnType not in ('void', 'error'):
+        return False
+    for arg in method.arguments:
+        if arg.arrayReturn or arg.pointerList or getCommandArgumentKind(index, arg.type) is None:
+            return False
+    return True
+
+class Command:
+    __slots__ = ('opcode', 'method', 'argumentKinds', 'size')
+
+    def __init__(self, opcode, method, argumentKinds):
+        self.opcode = opcode
+        self.method = method
+        self.argumentKinds = argumentKinds
+        self.size = CommandHeaderSize + CommandArgumentSize * len(argumentKinds)
+
+    def getSelectorName(self):
+        cname = self.method.cname
+        return cname[0].lower() + cname[1:]
+
+    def getArgumentOffset(self, argumentIndex):
+        return CommandArgumentSize * argumentIndex
+
+def getFragmentCommands(api):
+    # The commands of each fragment, with the opcodes numbered from one in
+    # the order of the methods in the fragments.
+    index = api.getIndex()
+    opcode = 1
+    fragmentCommands = []
+    for fragment in index.fragments:
+        commands = []
+        for interface in fragment.interfaces:
+            for method in interface.methods:
+                if isCommandMethod(index, method):
+                    argumentKinds = ['handle'] + [getCommandArgumentKind(index, arg.type) for arg in method.arguments]
+                    commands.append(Command(opcode, method, argumentKinds))
+                    opcode += 1
+        fragmentCommands.append((fragment, commands))
+    return fragmentCommands
+
+def getCommands(api):
+    commands = []
+    for fragment, fragmentCommands in getFragmentCommands(api):
+        commands += fragmentCommands
+    return commands
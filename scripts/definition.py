@@ -1,15 +1,62 @@
+import re
+import sys
+
 from lxml import etree
 
+# Converts text in 'CamelCase' into 'CAMEL_CASE'
+# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
+def convertToUnderscore(s):
+    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
+
+def convertToCamelCase(s):
+    result = ''
+    begin = True
+    for c in s:
+        if c == '_':
+            begin = True
+        elif begin:
+            result += c.upper()
+            begin = False
+        else:
+            result += c
+    return result
+
+def convertToLowCamelCase(s):
+    result = ''
+    begin = True
+    first = True
+    for c in s:
+        if c == '_':
+            begin = True
+        elif begin:
+            if not first:
+                result += c.upper()
+            else:
+                result += c
+            begin = False
+            first = False
+        else:
+            result += c
+    return result
+
 
 def getOptionalAttribute(node, attr, default):
     if attr not in node.keys():
         return default
     return node.get(attr)
 
+def getInternedAttribute(node, attr, default=None):
+    value = node.get(attr, default)
+    if value is None:
+        return None
+    return sys.intern(value)
+
 
 class Binding:
+    __slots__ = ('name', 'properties')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
+        self.name = getInternedAttribute(xmlNode, 'name')
         self.properties = {}
         self.loadProperties(xmlNode)
 
@@ -28,29 +75,35 @@ class Binding:
 
 
 class Typedef:
+    __slots__ = ('name', 'ctype', 'sysmelType', 'pharoType', 'squeakType')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
-        self.ctype = xmlNode.get('ctype')
-        self.sysmelType = xmlNode.get('sysmelType', self.ctype)
-        self.pharoType = xmlNode.get('pharoType', self.ctype)
-        self.squeakType = xmlNode.get('squeakType', self.ctype)
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.ctype = getInternedAttribute(xmlNode, 'ctype')
+        self.sysmelType = getInternedAttribute(xmlNode, 'sysmelType', self.ctype)
+        self.pharoType = getInternedAttribute(xmlNode, 'pharoType', self.ctype)
+        self.squeakType = getInternedAttribute(xmlNode, 'squeakType', self.ctype)
 
     def accept(self, visitor):
         return visitor.visitTypedef(self)
 
 
 class Field:
+    __slots__ = ('name', 'type')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
-        self.type = xmlNode.get('type')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.type = getInternedAttribute(xmlNode, 'type')
 
     def accept(self, visitor):
         return visitor.visitField(self)
 
 
 class Aggregate:
+    __slots__ = ('name', 'fields')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
+        self.name = getInternedAttribute(xmlNode, 'name')
         self.fields = []
         self.loadFields(xmlNode)
 
@@ -66,6 +119,8 @@ class Aggregate:
         return False
 
 class Struct(Aggregate):
+    __slots__ = ()
+
     def __init__(self, xmlNode):
         Aggregate.__init__(self, xmlNode)
 
@@ -76,6 +131,8 @@ class Struct(Aggregate):
         return True
 
 class Union(Aggregate):
+    __slots__ = ()
+
     def __init__(self, xmlNode):
         Aggregate.__init__(self, xmlNode)
 
@@ -86,12 +143,14 @@ class Union(Aggregate):
         return True
 
 class Enum:
+    __slots__ = ('name', 'ctype', 'constants', 'optionalPrefix', 'optionalSuffix')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
-        self.ctype = xmlNode.get('ctype')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.ctype = getInternedAttribute(xmlNode, 'ctype')
         self.constants = []
-        self.optionalPrefix = xmlNode.get('optionalPrefix', None)
-        self.optionalSuffix = xmlNode.get('optionalSuffix', None)
+        self.optionalPrefix = getInternedAttribute(xmlNode, 'optionalPrefix')
+        self.optionalSuffix = getInternedAttribute(xmlNode, 'optionalSuffix')
         self.loadConstants(xmlNode)
 
     def accept(self, visitor):
@@ -104,9 +163,11 @@ class Enum:
 
 
 class Constant:
+    __slots__ = ('name', 'type', 'value')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
-        self.type = getOptionalAttribute(xmlNode, 'type', 'int')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.type = getInternedAttribute(xmlNode, 'type', 'int')
         self.value = xmlNode.get('value')
 
     def accept(self, visitor):
@@ -114,6 +175,8 @@ class Constant:
 
 
 class SelfArgument:
+    __slots__ = ('name', 'type', 'arrayReturn', 'pointerList')
+
     def __init__(self, clazz):
         self.name = clazz.name
         self.type = clazz.name + '*'
@@ -122,19 +185,24 @@ class SelfArgument:
 
 
 class Argument:
+    __slots__ = ('name', 'type', 'arrayReturn', 'pointerList')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
-        self.type = xmlNode.get('type')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.type = getInternedAttribute(xmlNode, 'type')
         self.arrayReturn = getOptionalAttribute(xmlNode, 'arrayReturn', 'false') != 'false'
         self.pointerList = getOptionalAttribute(xmlNode, 'pointerList', 'false') != 'false'
 
 
 class Function:
+    __slots__ = ('name', 'cname', 'returnType', 'errorIsNotException', 'vectorize', 'clazz', 'arguments')
+
     def __init__(self, xmlNode, clazz = None):
-        self.name = xmlNode.get('name')
-        self.cname = getOptionalAttribute(xmlNode, 'cname', self.name)
-        self.returnType = xmlNode.get('returnType')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.cname = getInternedAttribute(xmlNode, 'cname', self.name)
+        self.returnType = getInternedAttribute(xmlNode, 'returnType')
         self.errorIsNotException = getOptionalAttribute(xmlNode, 'errorIsNotException', "false") != "false"
+        self.vectorize = getOptionalAttribute(xmlNode, 'vectorize', "false") != "false"
         self.clazz = clazz
         self.arguments = []
         self.loadArguments(xmlNode)
@@ -149,8 +217,12 @@ class Function:
 
 
 class Interface:
+    __slots__ = ('name', 'allocator', 'threading', 'methods', 'methodNames')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
+        self.name = getInternedAttribute(xmlNode, 'name')
+        self.allocator = getInternedAttribute(xmlNode, 'allocator', 'heap')
+        self.threading = getInternedAttribute(xmlNode, 'threading')
         self.methods = []
         self.methodNames = set()
         self.loadMethods(xmlNode)
@@ -169,8 +241,10 @@ class Interface:
         return name in self.methodNames
 
 class ApiFragment:
+    __slots__ = ('name', 'types', 'constants', 'globals', 'interfaces', 'agreggates')
+
     def __init__(self, xmlNode):
-        self.name = xmlNode.get('name')
+        self.name = getInternedAttribute(xmlNode, 'name')
 
         self.types = []
         self.constants = []
@@ -196,55 +270,86 @@ class ApiFragment:
             elif child.tag == 'interfaces':
                 self.loadInterfaces(child)
 
+    def loadContainerChild(self, containerTag, child):
+        if containerTag == 'types':
+            self.loadType(child)
+        elif containerTag == 'constants':
+            self.loadConstant(child)
+        elif containerTag == 'structs':
+            self.loadStruct(child)
+        elif containerTag == 'globals':
+            self.loadGlobal(child)
+        elif containerTag == 'interfaces':
+            self.loadInterface(child)
+
     def loadTypes(self, node):
         for child in node:
-            loadedNode = None
-            if child.tag == 'typedef':
-                loadedNode = Typedef(child)
+            self.loadType(child)
 
-            if loadedNode is not None:
-                self.types.append(loadedNode)
+    def loadType(self, child):
+        loadedNode = None
+        if child.tag == 'typedef':
+            loadedNode = Typedef(child)
+
+        if loadedNode is not None:
+            self.types.append(loadedNode)
 
     def loadConstants(self, node):
         for child in node:
-            loadedNode = None
-            if child.tag == 'enum': loadedNode = Enum(child)
-            elif child.tag == 'constant' : loadedNode = Constant(child)
+            self.loadConstant(child)
 
-            if loadedNode is not None:
-                self.constants.append(loadedNode)
+    def loadConstant(self, child):
+        loadedNode = None
+        if child.tag == 'enum': loadedNode = Enum(child)
+        elif child.tag == 'constant' : loadedNode = Constant(child)
+
+        if loadedNode is not None:
+            self.constants.append(loadedNode)
 
     def loadStructs(self, node):
         for child in node:
-            loadedNode = None
-            if child.tag == 'struct': loadedNode = Struct(child)
-            if child.tag == 'union': loadedNode = Union(child)
+            self.loadStruct(child)
 
-            if loadedNode is not None:
-                self.agreggates.append(loadedNode)
+    def loadStruct(self, child):
+        loadedNode = None
+        if child.tag == 'struct': loadedNode = Struct(child)
+        if child.tag == 'union': loadedNode = Union(child)
+
+        if loadedNode is not None:
+            self.agreggates.append(loadedNode)
 
     def loadGlobals(self, node):
         for child in node:
-            loadedNode = None
-            if child.tag == 'function': loadedNode = Function(child)
+            self.loadGlobal(child)
 
-            if loadedNode is not None:
-                self.globals.append(loadedNode)
+    def loadGlobal(self, child):
+        loadedNode = None
+        if child.tag == 'function': loadedNode = Function(child)
+
+        if loadedNode is not None:
+            self.globals.append(loadedNode)
 
     def loadInterfaces(self, node):
         for child in node:
-            loadedNode = None
-            if child.tag == 'interface': loadedNode = Interface(child)
+            self.loadInterface(child)
 
-            if loadedNode is not None:
-                self.interfaces.append(loadedNode)
+    def loadInterface(self, child):
+        loadedNode = None
+        if child.tag == 'interface': loadedNode = Interface(child)
+
+        if loadedNode is not None:
+            self.interfaces.append(loadedNode)
 
 class ApiVersion(ApiFragment):
+    __slots__ = ()
+
     def __init__(self, xmlNode):
         assert xmlNode.tag == 'version'
         ApiFragment.__init__(self, xmlNode)
 
-class ApiExtension:
+class ApiExtension(ApiFragment):
+    __slots__ = ()
+
     def __init__(self, xmlNode):
         assert xmlNode.tag == 'extension'
         ApiFragment.__init__(self, xmlNode)
@@ -256,6 +361,7 @@ class ApiDefinition:
         self.versions = {}
         self.extensions = {}
         self.loadFragments(xmlNode)
+        self.threading = xmlNode.get('threading', 'multiple')
 
         # TODO: Deprecate these
         self.name = xmlNode.get('name')
@@ -264,7 +370,7 @@ class ApiDefinition:
         self.constantPrefix = self.getBindingProperty('C', 'constantPrefix')
         self.functionPrefix = self.getBindingProperty('C', 'functionPrefix')
 
-        self.interfaceNameCache = None
+        self.index = None
 
     def accept(self, visitor):
         return visitor.visitApiDefinition(self)
@@ -272,42 +378,58 @@ class ApiDefinition:
     def getBindingProperty(self, language, key):
         return self.bindings[language].getProperty(key)
 
-    def buildInterfaceNameCache(self):
-        self.interfaceNameCache = set()
-        for version in self.versions.values():
-            version.getInterfaceNamesInto(self.interfaceNameCache)
-        for extension in self.extensions.values():
-            extension.getInterfaceNamesInto(self.interfaceNameCache)
+    def getOptionalBindingProperty(self, language, key, default):
+        binding = self.bindings.get(language)
+        if binding is None:
+            return default
+        return binding.properties.get(key, default)
+
+    def buildIndex(self):
+        self.index = ApiIndex(self)
+        return self.index
+
+    def getIndex(self):
+        if self.index is None:
+            self.buildIndex()
+        return self.index
 
     def getInterfaceNames(self):
-        if self.interfaceNameCache is None:
-            self.buildInterfaceNameCache()
-        return self.interfaceNameCache
+        return self.getIndex().interfaceNames
 
     def isInterfaceName(self, iname):
-        return iname in self.getInterfaceNames()
+        return iname in self.getIndex().interfaceNames
 
     def isInterfaceReference(self, typeString):
-        if typeString.endswith('*'):
-            return self.isInterfaceName(typeString[:-1])
-        return False
+        return typeString in self.getIndex().interfaceReferenceTypes
 
     @staticmethod
-    def loadFromFileNamed(filename):
-        tree = etree.parse(filename)
-        return ApiDefinition(tree.getroot())
+    def loadFromFileNamed(filename, streaming=False):
+        if streaming:
+            api = ApiDefinitionStreamLoader().loadFromFileNamed(filename)
+        else:
+            tree = etree.parse(filename)
+            api = ApiDefinition(tree.getroot())
+        api.buildIndex()
+        return api
 
     def loadFragments(self, node):
         for c in node:
             if c.tag == 'version':
                 version = ApiVersion(c)
                 self.versions[version.name] = version
+            elif c.tag == 'extension':
+                self.loadExtension(c)
             elif c.tag == 'extensions':
-                extension = ApiVersion(c)
-                self.extensions[extension.name] = extension
+                for extensionNode in c:
+                    if extensionNode.tag == 'extension':
+                        self.loadExtension(extensionNode)
             elif c.tag == 'bindings':
                 self.loadBindings(c)
 
+    def loadExtension(self, node):
+        extension = ApiExtension(node)
+        self.extensions[extension.name] = extension
+
     def loadBindings(self, node):
         for child in node:
             loadedNode = None
@@ -316,3 +438,191 @@ class ApiDefinition:
 
             if loadedNode is not None:
                 self.bindings[loadedNode.name] = loadedNode
+
+IdentifierPrefixPattern = re.compile('[A-Za-z0-9_]*')
+
+class TypeDescriptor:
+    """
+    A type string such as 'device*' split into its base name and decorators,
+    together with the definition that the base name resolves to.
+    """
+    __slots__ = ('typeString', 'baseName', 'prefixedBaseName', 'decorators', 'pointerDepth', 'kind', 'definition',
+        'isInterfaceReference', 'isInterfacePointerReference')
+
+    def __init__(self, typeString, typePrefix, symbols):
+        self.typeString = typeString
+        baseNameSize = IdentifierPrefixPattern.match(typeString).end()
+        self.baseName = sys.intern(typeString[:baseNameSize])
+        self.prefixedBaseName = sys.intern(typePrefix + self.baseName)
+        self.decorators = sys.intern(typeString[baseNameSize:])
+        self.pointerDepth = self.decorators.count('*')
+        self.kind, self.definition = symbols.get(self.baseName, ('unknown', None))
+        self.isInterfaceReference = self.kind == 'interface' and self.decorators == '*'
+        self.isInterfacePointerReference = self.kind == 'interface' and self.decorators == '**'
+
+class ApiIndex:
+    """
+    Symbol table and type resolution index of an ApiDefinition. It is built
+    once after loading, so that the generators look up type descriptors,
+    flattened views and name manglings instead of recomputing them.
+    """
+    def __init__(self, api):
+        self.symbols = {}
+        self.typeDescriptors = {}
+        self.typePrefix = api.typePrefix
+        self.fragments = list(api.versions.values()) + list(api.extensions.values())
+        self.interfaces = []
+        self.globals = []
+        self.methods = []
+        self.aggregates = []
+        self.enums = []
+        self.interfaceNames = set()
+        self.interfaceReferenceTypes = set()
+        self.underscoreNames = {}
+        self.camelCaseNames = {}
+        self.lowCamelCaseNames = {}
+        self.build()
+
+    def build(self):
+        for fragment in self.fragments:
+            self.addFragmentSymbols(fragment)
+
+        for fragment in self.fragments:
+            for function in fragment.globals:
+                self.addFunctionTypes(function)
+            for interface in fragment.interfaces:
+                for method in interface.methods:
+                    self.addFunctionTypes(method)
+            for aggregate in fragment.agreggates:
+                for field in aggregate.fields:
+                    self.getTypeDescriptor(field.type)
+
+    def addFragmentSymbols(self, fragment):
+        for typedef in fragment.types:
+            self.symbols[typedef.name] = ('typedef', typedef)
+        for constant in fragment.constants:
+            if isinstance(constant, Enum):
+                self.symbols[constant.name] = ('enum', constant)
+                self.enums.append(constant)
+        for aggregate in fragment.agreggates:
+            self.symbols[aggregate.name] = ('union' if aggregate.isUnion() else 'struct', aggregate)
+            self.aggregates.append(aggregate)
+        for interface in fragment.interfaces:
+            self.symbols[interface.name] = ('interface', interface)
+            self.interfaces.append(interface)
+            self.interfaceNames.add(interface.name)
+            self.interfaceReferenceTypes.add(interface.name + '*')
+            self.methods += interface.methods
+        self.globals += fragment.globals
+
+    def addFunctionTypes(self, function):
+        if function.returnType is not None:
+            self.getTypeDescriptor(function.returnType)
+        for arg in function.arguments:
+            self.getTypeDescriptor(arg.type)
+
+    def getTypeDescriptor(self, typeString):
+        descriptor = self.typeDescriptors.get(typeString)
+        if descriptor is None:
+            descriptor = TypeDescriptor(typeString, self.typePrefix, self.symbols)
+            self.typeDescriptors[typeString] = descriptor
+        return descriptor
+
+    def underscoreName(self, name):
+        result = self.underscoreNames.get(name)
+        if result is None:
+            result = self.underscoreNames[name] = convertToUnderscore(name)
+        return result
+
+    def camelCaseName(self, name):
+        result = self.camelCaseNames.get(name)
+        if result is None:
+            result = self.camelCaseNames[name] = convertToCamelCase(name)
+        return result
+
+    def lowCamelCaseName(self, name):
+        result = self.lowCamelCaseNames.get(name)
+        if result is None:
+            result = self.lowCamelCaseNames[name] = convertToLowCamelCase(name)
+        return result
+
+class ApiDefinitionStreamLoader:
+    """
+    Builds an ApiDefinition while the document is being parsed. Each direct
+    child of a fragment container is turned into a model node as soon as its
+    end tag arrives, and its element is cleared right away, so the complete
+    lxml tree is never kept alive next to the model.
+    """
+    FragmentTags = ('version', 'extension')
+    ContainerTags = ('types', 'constants', 'structs', 'globals', 'interfaces')
+
+    def __init__(self):
+        self.fragment = None
+        self.fragmentNode = None
+        self.versions = {}
+        self.extensions = {}
+        self.api = None
+
+    def loadFromFileNamed(self, filename):
+        for event, node in etree.iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                self.startElement(node)
+            else:
+                self.endElement(node)
+        return self.api
+
+    def isFragmentNode(self, node):
+        # Extensions are either direct children of the api, or grouped in an extensions element.
+        parent = node.getparent()
+        if node.tag not in self.FragmentTags or parent is None:
+            return False
+        if node.tag == 'extension' and parent.tag == 'extensions':
+            parent = parent.getparent()
+        return parent is not None and parent.getparent() is None
+
+    def startElement(self, node):
+        if self.fragment is None and self.isFragmentNode(node):
+            # Only the attributes are needed here, the children are streamed.
+            attributesNode = etree.Element(node.tag, node.attrib)
+            if node.tag == 'version':
+                self.fragment = ApiVersion(attributesNode)
+            else:
+                self.fragment = ApiExtension(attributesNode)
+            self.fragmentNode = node
+
+    def endElement(self, node):
+        parent = node.getparent()
+        if parent is None:
+            self.endApi(node)
+        elif node is self.fragmentNode:
+            self.endFragment(node)
+        elif self.fragment is not None and parent.tag in self.ContainerTags and parent.getparent() is self.fragmentNode:
+            self.loadFragmentChild(parent.tag, node)
+            self.releaseNode(node)
+
+    def loadFragmentChild(self, containerTag, node):
+        self.fragment.loadContainerChild(containerTag, node)
+
+    def releaseNode(self, node):
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+
+    def endFragment(self, node):
+        if node.tag == 'version':
+            self.versions[self.fragment.name] = self.fragment
+        else:
+            self.extensions[self.fragment.name] = self.fragment
+        node.clear()
+        self.fragment = None
+        self.fragmentNode = None
+
+    def endApi(self, node):
+        # The fragments were already loaded, so only the bindings are left.
+        for child in list(node):
+            if child.tag in self.FragmentTags or child.tag == 'extensions':
+                node.remove(child)
+
+        self.api = ApiDefinition(node)
+        self.api.versions.update(self.versions)
+        self.api.extensions.update(self.extensions)
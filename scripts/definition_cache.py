@@ -0,0 +1,141 @@
+import hashlib
+import io
+import os
+import os.path
+import pickle
+import sys
+import tempfile
+
+from definition import *
+
+# Environment variables used for configuring the parsed model cache.
+CacheDirectoryVariable = 'PHANAPI_CACHE_DIR'
+CacheMaxSizeVariable = 'PHANAPI_CACHE_MAX_SIZE'
+
+# Environment variable for parsing with the streaming loader instead of the tree loader.
+StreamingVariable = 'PHANAPI_STREAMING'
+
+DefaultCacheMaxSize = 64*1024*1024
+CacheEntryExtension = '.pickle'
+
+def computeModelVersion():
+    # The cached objects are instances of the classes in definition.py, so any
+    # change in that file or in the interpreter invalidates the cache.
+    import definition
+    digest = hashlib.sha256()
+    with open(definition.__file__, 'rb') as f:
+        digest.update(f.read())
+    digest.update(('%d.%d/%d' % (sys.version_info[0], sys.version_info[1], pickle.HIGHEST_PROTOCOL)).encode())
+    return digest.hexdigest()
+
+class ApiDefinitionCache:
+    def __init__(self, cacheDirectory, maxSize = DefaultCacheMaxSize):
+        self.cacheDirectory = cacheDirectory
+        self.maxSize = maxSize
+        self.modelVersion = computeModelVersion()
+
+    def entryPrefixFor(self, filename):
+        absolutePath = os.path.abspath(filename)
+        pathDigest = hashlib.sha256(absolutePath.encode()).hexdigest()[:16]
+        return os.path.basename(absolutePath) + '-' + pathDigest + '-'
+
+    def entryNameFor(self, filename, content):
+        digest = hashlib.sha256()
+        digest.update(self.modelVersion.encode())
+        digest.update(content)
+        return self.entryPrefixFor(filename) + digest.hexdigest() + CacheEntryExtension
+
+    def loadFromFileNamed(self, filename, streaming = False):
+        with open(filename, 'rb') as f:
+            content = f.read()
+
+        entryName = self.entryNameFor(filename, content)
+        entryPath = os.path.join(self.cacheDirectory, entryName)
+        api = self.loadEntry(entryPath)
+        if api is not None:
+            return api
+
+        api = ApiDefinition.loadFromFileNamed(io.BytesIO(content), streaming=streaming)
+        self.storeEntry(entryPath, api)
+        self.evictStaleEntries(self.entryPrefixFor(filename), entryName)
+        self.evictToMaxSize(entryName)
+        return api
+
+    def loadEntry(self, entryPath):
+        try:
+            with open(entryPath, 'rb') as f:
+                api = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or incompatible entry, rebuild it.
+            self.removeEntry(entryPath)
+            return None
+
+        # Touch the entry, so that the size bound evicts the least recently used ones.
+        try:
+            os.utime(entryPath)
+        except OSError:
+            pass
+        return api
+
+    def storeEntry(self, entryPath, api):
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+
+        # Write into a temporary file and rename it, so that concurrent
+        # generator jobs never see a partially written entry.
+        fd, temporaryPath = tempfile.mkstemp(dir=self.cacheDirectory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(api, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporaryPath, entryPath)
+        except BaseException:
+            self.removeEntry(temporaryPath)
+            raise
+
+    def removeEntry(self, entryPath):
+        try:
+            os.remove(entryPath)
+        except OSError:
+            pass
+
+    def listEntries(self):
+        entries = []
+        for entryName in os.listdir(self.cacheDirectory):
+            if not entryName.endswith(CacheEntryExtension):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cacheDirectory, entryName))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entryName))
+        return entries
+
+    def evictStaleEntries(self, entryPrefix, currentEntryName):
+        for mtime, size, entryName in self.listEntries():
+            if entryName.startswith(entryPrefix) and entryName != currentEntryName:
+                self.removeEntry(os.path.join(self.cacheDirectory, entryName))
+
+    def evictToMaxSize(self, currentEntryName):
+        entries = self.listEntries()
+        totalSize = sum(size for mtime, size, entryName in entries)
+        for mtime, size, entryName in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+            if entryName == currentEntryName:
+                continue
+            self.removeEntry(os.path.join(self.cacheDirectory, entryName))
+            totalSize -= size
+
+def isStreamingEnabled():
+    return os.environ.get(StreamingVariable, '') not in ('', '0')
+
+def loadApiDefinition(filename, streaming = None):
+    if streaming is None:
+        streaming = isStreamingEnabled()
+    cacheDirectory = os.environ.get(CacheDirectoryVariable)
+    if not cacheDirectory:
+        return ApiDefinition.loadFromFileNamed(filename, streaming=streaming)
+
+    maxSize = int(os.environ.get(CacheMaxSizeVariable, DefaultCacheMaxSize))
+    return ApiDefinitionCache(cacheDirectory, maxSize).loadFromFileNamed(filename, streaming)
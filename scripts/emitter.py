@@ -0,0 +1,89 @@
+from string import Template
+
+# Compiled templates, keyed by their source text. The generators use a
+# bounded set of literal templates, so the cache is only cleared as a guard
+# against callers that build the template text dynamically.
+TemplateCache = {}
+TemplateCacheMaxSize = 4096
+
+class CompiledTemplate:
+    """
+    A string.Template parsed once into a format string with positional
+    fields, plus the list of variable names that fill them. Invalid
+    placeholders are reported when the template is compiled, instead of when
+    it is substituted.
+    """
+    __slots__ = ('text', 'formatString', 'names')
+
+    def __init__(self, text):
+        self.text = text
+        self.names = []
+        parts = []
+        position = 0
+        for match in Template.pattern.finditer(text):
+            parts.append(self.escapeLiteral(text[position:match.start()]))
+            position = match.end()
+            if match.group('escaped') is not None:
+                parts.append('$')
+            elif match.group('invalid') is not None:
+                raise ValueError('Invalid placeholder in template %r at index %d' % (text, match.start('invalid')))
+            else:
+                name = match.group('named') or match.group('braced')
+                parts.append('{%d}' % len(self.names))
+                self.names.append(name)
+        parts.append(self.escapeLiteral(text[position:]))
+        self.formatString = ''.join(parts)
+
+    def escapeLiteral(self, literal):
+        return literal.replace('{', '{{').replace('}', '}}')
+
+    def substitute(self, variables, extraVariables):
+        if not self.names:
+            return self.text
+
+        values = []
+        for name in self.names:
+            if name in extraVariables:
+                values.append(extraVariables[name])
+            else:
+                values.append(variables[name])
+        return self.formatString.format(*values)
+
+def compileTemplate(text):
+    template = TemplateCache.get(text)
+    if template is None:
+        if len(TemplateCache) >= TemplateCacheMaxSize:
+            TemplateCache.clear()
+        template = CompiledTemplate(text)
+        TemplateCache[text] = template
+    return template
+
+class Emitter:
+    """
+    Common text emission for the generator visitors. Templates use the
+    string.Template syntax and are expanded with the extra variables passed
+    to each call, falling back to self.variables.
+    """
+    def __init__(self, out = None):
+        self.out = out
+        self.variables = {}
+
+    def processText(self, text, **extraVariables):
+        return compileTemplate(text).substitute(self.variables, extraVariables)
+
+    def write(self, text):
+        self.out.write(text)
+
+    def writeLine(self, line):
+        self.write(line)
+        self.newline()
+
+    def newline(self):
+        self.write('\n')
+
+    def printString(self, text, **extraVariables):
+        self.write(self.processText(text, **extraVariables))
+
+    def printLine(self, text, **extraVariables):
+        self.write(self.processText(text, **extraVariables))
+        self.newline()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+from definition import *
+from definition_cache import loadApiDefinition
+from output_files import FileOutputTarget
+
+import make_headers
+import make_headers_cpp
+import make_icdloader
+import make_implementation_stubs_cpp
+import make_pharo_bindings
+import make_sysmel_bindings
+
+# Backend name, command line option, output description and generation function.
+Backends = [
+    ('headers', '-headers', 'C header output dir', make_headers.generateHeaders),
+    ('cpp-headers', '-cpp-headers', 'C++ header output dir', make_headers_cpp.generateCppHeader),
+    ('icdloader', '-icdloader', 'ICD loader output dir', make_icdloader.generateIcdLoader),
+    ('impl-header', '-impl', 'C++ implementation stubs output dir', make_implementation_stubs_cpp.generateImplementationHeader),
+    ('impl-dispatch', '-impl', 'C++ implementation stubs output dir', make_implementation_stubs_cpp.generateDispatchInclude),
+    ('pharo', '-pharo', 'Pharo tonel output dir', make_pharo_bindings.generatePharoBindings),
+    ('squeak', '-squeak', 'Squeak tonel output dir', make_pharo_bindings.generateSqueakBindings),
+    ('sysmel', '-sysmel', 'Sysmel output file', make_sysmel_bindings.generateSysmelBindings),
+]
+
+BackendFunctions = dict((name, function) for name, option, help, function in Backends)
+
+workerApi = None
+
+def setWorkerApi(api):
+    global workerApi
+    workerApi = api
+
+def runBackend(name, outputPath, target):
+    startTime = time.perf_counter()
+    outputFiles = BackendFunctions[name](workerApi, outputPath, target=target)
+    elapsed = time.perf_counter() - startTime
+    return name, elapsed, outputFiles.changedFiles, len(outputFiles.changedFiles) + len(outputFiles.unchangedFiles)
+
+def makeArgumentParser():
+    parser = argparse.ArgumentParser(prog='generate-all',
+        description='Loads an API definition once and runs the selected generator backends in parallel.')
+    parser.add_argument('definitions')
+    options = []
+    for name, option, help, function in Backends:
+        if option not in options:
+            parser.add_argument(option, dest=option[1:].replace('-', '_'), metavar='PATH', help=help)
+            options.append(option)
+    parser.add_argument('-fsync', action='store_true', default=None, help='flush each written file to disk')
+    parser.add_argument('-streaming', action='store_true', default=None, help='parse the definitions with the streaming loader')
+    parser.add_argument('-jobs', type=int, default=os.cpu_count(), help='number of worker processes, 1 runs everything in this process')
+    return parser
+
+def selectBackends(arguments):
+    selected = []
+    for name, option, help, function in Backends:
+        outputPath = getattr(arguments, option[1:].replace('-', '_'))
+        if outputPath is not None:
+            selected.append((name, outputPath))
+    return selected
+
+def runBackends(api, backends, jobs, target):
+    setWorkerApi(api)
+    if jobs <= 1 or len(backends) <= 1:
+        for name, outputPath in backends:
+            yield runBackend(name, outputPath, target)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(backends)), initializer=setWorkerApi, initargs=(api,)) as executor:
+        futures = [executor.submit(runBackend, name, outputPath, target) for name, outputPath in backends]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+def main():
+    arguments = makeArgumentParser().parse_args()
+    backends = selectBackends(arguments)
+    if len(backends) == 0:
+        print("generate-all: no backend output was selected")
+        return 1
+
+    startTime = time.perf_counter()
+    api = loadApiDefinition(arguments.definitions, arguments.streaming)
+    print("%-16s %8.3f s" % ('load', time.perf_counter() - startTime))
+
+    changedFiles = []
+    for name, elapsed, backendChangedFiles, fileCount in runBackends(api, backends, arguments.jobs, FileOutputTarget(arguments.fsync)):
+        print("%-16s %8.3f s  %d of %d files changed" % (name, elapsed, len(backendChangedFiles), fileCount))
+        changedFiles += backendChangedFiles
+    print("%-16s %8.3f s" % ('total', time.perf_counter() - startTime))
+
+    for path in sorted(changedFiles):
+        print("Updated %s" % path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
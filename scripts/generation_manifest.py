@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import os.path
+
+import definition
+from definition import *
+from definition_cache import CacheDirectoryVariable
+from output_files import FileOutputTarget, OutputFileSet, hashContent
+
+ManifestFormatVersion = 2
+
+# The manifests are kept in this subdirectory of the cache directory. Without a
+# cache directory, there is no manifest and every run generates all the outputs.
+ManifestDirectoryName = 'manifests'
+
+# Output that depends on every node of the API.
+AllNodes = '*'
+
+def getNodeSlots(clazz):
+    slots = []
+    for superclass in reversed(clazz.__mro__):
+        slots += list(getattr(superclass, '__slots__', ()))
+    return slots
+
+def makeNodeState(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [makeNodeState(element) for element in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, dict):
+        return [[key, makeNodeState(element)] for key, element in value.items()]
+
+    state = [value.__class__.__name__]
+    for slot in getNodeSlots(value.__class__):
+        element = getattr(value, slot, None)
+        if slot == 'clazz':
+            # Back reference from a method into its interface.
+            element = element.name if element is not None else None
+        state.append([slot, makeNodeState(element)])
+    return state
+
+def hashState(state):
+    return hashlib.sha256(json.dumps(state, separators=(',', ':')).encode()).hexdigest()
+
+def computeNodeHashes(api):
+    index = api.getIndex()
+    nodeHashes = {}
+    for interface in index.interfaces:
+        nodeHashes['interface:' + interface.name] = hashState(makeNodeState(interface))
+    for aggregate in index.aggregates:
+        nodeHashes['aggregate:' + aggregate.name] = hashState(makeNodeState(aggregate))
+    for enum in index.enums:
+        nodeHashes['enum:' + enum.name] = hashState(makeNodeState(enum))
+    for function in index.globals:
+        nodeHashes['function:' + function.cname] = hashState(makeNodeState(function))
+    return nodeHashes
+
+def computeContextHash(api, backendName, sourceFiles):
+    # Everything that is not tracked per node: the generator sources, the
+    # bindings, the typedefs, loose constants and the symbol names, which are
+    # used by every output for resolving types.
+    index = api.getIndex()
+    digest = hashlib.sha256()
+    digest.update(backendName.encode())
+    for sourceFile in [definition.__file__] + list(sourceFiles):
+        with open(sourceFile, 'rb') as f:
+            digest.update(f.read())
+
+    state = [
+        [[language, makeNodeState(binding.properties)] for language, binding in api.bindings.items()],
+        [[fragment.name, makeNodeState(fragment.types), makeNodeState([c for c in fragment.constants if not isinstance(c, Enum)])] for fragment in index.fragments],
+        [[name, kind] for name, (kind, node) in index.symbols.items()],
+        list(api.versions.keys()),
+        list(api.extensions.keys()),
+    ]
+    digest.update(json.dumps(state, separators=(',', ':')).encode())
+    return digest.hexdigest()
+
+class GenerationManifest:
+    """
+    Per backend record of the hash of each interface, aggregate, enum and
+    global function, and of the nodes and content hash of each output file.
+    It lets a backend skip the outputs whose nodes did not change. The
+    manifest of an output directory is kept in the cache directory, so
+    nothing is added next to the outputs.
+    """
+    def __init__(self, outputDirectory, backendName, api, sourceFiles = [], target = None):
+        if target is None:
+            target = FileOutputTarget()
+        self.target = target
+        self.outputDirectory = outputDirectory
+        self.cacheDirectory = os.environ.get(CacheDirectoryVariable)
+        self.path = None
+        if self.cacheDirectory:
+            directoryDigest = hashlib.sha256(os.path.abspath(outputDirectory).encode()).hexdigest()[:16]
+            self.path = os.path.join(self.cacheDirectory, ManifestDirectoryName, backendName + '-' + directoryDigest + '.manifest.json')
+        self.contextHash = computeContextHash(api, backendName, sourceFiles)
+        self.nodeHashes = computeNodeHashes(api)
+        self.outputs = {}
+        self.previousNodeHashes = {}
+        self.previousOutputs = {}
+        self.isContextClean = False
+        self.loadPrevious()
+
+    def loadPrevious(self):
+        if self.path is None:
+            return
+
+        content = self.target.read(self.path)
+        if content is None:
+            return
+
+        try:
+            previous = json.loads(content)
+        except ValueError:
+            return
+
+        if previous.get('version') != ManifestFormatVersion:
+            return
+
+        self.previousNodeHashes = previous.get('nodes', {})
+        self.previousOutputs = previous.get('outputs', {})
+        self.isContextClean = previous.get('context') == self.contextHash
+
+    def relativePathOf(self, path):
+        return os.path.relpath(path, self.outputDirectory).replace(os.sep, '/')
+
+    def isNodeClean(self, key):
+        if key == AllNodes:
+            return self.previousNodeHashes == self.nodeHashes
+        return key in self.nodeHashes and self.previousNodeHashes.get(key) == self.nodeHashes[key]
+
+    def recordOutput(self, path, nodeKeys = [AllNodes]):
+        self.outputs[self.relativePathOf(path)] = {'nodes': sorted(nodeKeys)}
+
+    def isOutputUpToDate(self, path, nodeKeys = [AllNodes]):
+        self.recordOutput(path, nodeKeys)
+        if not self.isContextClean or not self.target.exists(path):
+            return False
+        previousOutput = self.previousOutputs.get(self.relativePathOf(path))
+        if previousOutput is None or previousOutput['nodes'] != sorted(nodeKeys):
+            return False
+        for key in nodeKeys:
+            if not self.isNodeClean(key):
+                return False
+        return True
+
+    def areOutputsUpToDate(self, paths, nodeKeys = [AllNodes]):
+        upToDate = True
+        for path in paths:
+            if not self.isOutputUpToDate(path, nodeKeys):
+                upToDate = False
+        return upToDate
+
+    def commit(self, outputFiles):
+        if self.path is None:
+            return
+
+        for path in outputFiles.changedFiles + outputFiles.unchangedFiles:
+            relativePath = self.relativePathOf(path)
+            if relativePath not in self.outputs:
+                self.recordOutput(path)
+
+            # The outputs that were kept unchanged have the hash of the previous run.
+            contentHash = outputFiles.contentHashes.get(path)
+            if contentHash is None:
+                contentHash = self.previousOutputs.get(relativePath, {}).get('hash')
+            self.outputs[relativePath]['hash'] = contentHash
+
+        # Outputs that were generated before, but not in this run belong to
+        # nodes that were removed from the API. They are only removed while
+        # they still have the generated content.
+        for relativePath, previousOutput in self.previousOutputs.items():
+            if relativePath in self.outputs:
+                continue
+            path = os.path.join(self.outputDirectory, relativePath)
+            content = self.target.read(path)
+            if content is not None and hashContent(content) == previousOutput.get('hash'):
+                outputFiles.removeFile(path)
+
+        self.target.ensureDirectory(self.cacheDirectory)
+        self.target.ensureDirectory(os.path.dirname(self.path))
+        manifest = {
+            'version': ManifestFormatVersion,
+            'context': self.contextHash,
+            'nodes': self.nodeHashes,
+            'outputs': self.outputs,
+        }
+        self.target.writeIfChanged(self.path, json.dumps(manifest, indent=1, sort_keys=True) + '\n')
+
+def generateOutputsIncrementally(api, outputDirectory, backendName, sourceFiles, outputPaths, emitOutputs, target = None):
+    # For backends whose outputs depend on the whole API. emitOutputs is only
+    # called when some node, or the context, changed since the last run.
+    manifest = GenerationManifest(outputDirectory, backendName, api, sourceFiles, target)
+    if manifest.areOutputsUpToDate(outputPaths):
+        outputFiles = OutputFileSet(target)
+        outputFiles.keepUnchanged(outputPaths)
+    else:
+        outputFiles = emitOutputs()
+    manifest.commit(outputFiles)
+    return outputFiles
@@ -0,0 +1,211 @@
+import cProfile
+import contextlib
+import json
+import os
+import os.path
+import sys
+import time
+import tracemalloc
+
+from definition import *
+from definition_cache import CacheDirectoryVariable, isStreamingEnabled, loadApiDefinition
+from output_files import OutputFileSet
+
+class ProfilePhase:
+    __slots__ = ('name', 'seconds', 'calls', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.active = False
+
+class GenerationProfile:
+    """
+    Phase timing for the generator entry points. The phases are the XML
+    load, the model construction and index, and every emit* method of the
+    instrumented visitors. Times are inclusive, so the time of a nested
+    phase is also part of the phase that called it.
+
+    A disabled profile does nothing, so the entry points use it
+    unconditionally.
+    """
+    def __init__(self, scriptName, statsFileName = None, profileFileName = None, enabled = False):
+        self.scriptName = scriptName
+        self.statsFileName = statsFileName
+        self.profileFileName = profileFileName
+        self.enabled = enabled or statsFileName is not None or profileFileName is not None
+        self.phases = {}
+        self.profiler = None
+        self.startTime = None
+        self.peakMemory = 0
+        self.fileCount = 0
+        self.changedFileCount = 0
+        self.removedFileCount = 0
+        self.byteCount = 0
+        self.lineCount = 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.instrumentObject(OutputFileSet, ['commit'], 'write outputs')
+        tracemalloc.start()
+        self.startTime = time.perf_counter()
+        if self.profileFileName is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def getPhase(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = ProfilePhase(name)
+        return phase
+
+    def timeCall(self, name, function, arguments, keywords):
+        phase = self.getPhase(name)
+        phase.calls += 1
+        if phase.active:
+            # Recursive call, already accounted by the outer one.
+            return function(*arguments, **keywords)
+
+        phase.active = True
+        startTime = time.perf_counter()
+        try:
+            return function(*arguments, **keywords)
+        finally:
+            phase.seconds += time.perf_counter() - startTime
+            phase.active = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        phase = self.getPhase(name)
+        phase.calls += 1
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase.seconds += time.perf_counter() - startTime
+
+    def makeTimedFunction(self, name, function):
+        def timedFunction(*arguments, **keywords):
+            return self.timeCall(name, function, arguments, keywords)
+        timedFunction.__name__ = function.__name__
+        timedFunction.isTimed = True
+        return timedFunction
+
+    def instrumentObject(self, object, methodNames, phaseName = None):
+        if not self.enabled:
+            return
+        for methodName in methodNames:
+            setattr(object, methodName, self.makeTimedFunction(phaseName or methodName, getattr(object, methodName)))
+
+    def instrumentEmitters(self, *visitorClasses):
+        # Wraps every emit* method of the visitor classes, for the whole process.
+        if not self.enabled:
+            return
+        for visitorClass in visitorClasses:
+            for methodName in dir(visitorClass):
+                method = getattr(visitorClass, methodName)
+                if methodName.startswith('emit') and callable(method) and not getattr(method, 'isTimed', False):
+                    setattr(visitorClass, methodName, self.makeTimedFunction(methodName, method))
+
+    def loadApiDefinition(self, filename):
+        if not self.enabled:
+            return loadApiDefinition(filename)
+
+        if os.environ.get(CacheDirectoryVariable):
+            with self.phase('load from cache'):
+                return loadApiDefinition(filename)
+
+        if isStreamingEnabled():
+            loader = ApiDefinitionStreamLoader()
+            self.instrumentObject(loader, ['loadFragmentChild', 'endApi'], 'model construction')
+            with self.phase('xml load'):
+                api = loader.loadFromFileNamed(filename)
+        else:
+            with self.phase('xml load'):
+                root = etree.parse(filename).getroot()
+            with self.phase('model construction'):
+                api = ApiDefinition(root)
+        with self.phase('index'):
+            api.buildIndex()
+        return api
+
+    def recordOutputs(self, outputFiles):
+        if not self.enabled:
+            return
+        self.fileCount += len(outputFiles.changedFiles) + len(outputFiles.unchangedFiles)
+        self.changedFileCount += len(outputFiles.changedFiles)
+        self.removedFileCount += len(outputFiles.removedFiles)
+        self.byteCount += outputFiles.byteCount
+        self.lineCount += outputFiles.lineCount
+
+    def finish(self):
+        if not self.enabled:
+            return
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profileFileName)
+        self.wallTime = time.perf_counter() - self.startTime
+        currentMemory, self.peakMemory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.printReport(sys.stderr)
+        if self.statsFileName is not None:
+            with open(self.statsFileName, 'w') as f:
+                json.dump(self.asJson(), f, indent=1)
+                f.write('\n')
+
+    def asJson(self):
+        return {
+            'script': self.scriptName,
+            'wallSeconds': self.wallTime,
+            'peakMemoryBytes': self.peakMemory,
+            'phases': [{'name': phase.name, 'seconds': phase.seconds, 'calls': phase.calls} for phase in self.phases.values()],
+            'outputs': {
+                'files': self.fileCount,
+                'changedFiles': self.changedFileCount,
+                'removedFiles': self.removedFileCount,
+                'bytes': self.byteCount,
+                'lines': self.lineCount,
+            },
+        }
+
+    def printReport(self, out):
+        out.write('%s profile (inclusive wall time)\n' % self.scriptName)
+        out.write('  %-32s %10s %8s\n' % ('phase', 'seconds', 'calls'))
+        for phase in self.phases.values():
+            out.write('  %-32s %10.4f %8d\n' % (phase.name, phase.seconds, phase.calls))
+        out.write('  %-32s %10.4f\n' % ('total', self.wallTime))
+        out.write('Peak traced memory: %d bytes\n' % self.peakMemory)
+        out.write('Outputs: %d files (%d changed, %d removed), %d lines, %d bytes\n' % (self.fileCount, self.changedFileCount, self.removedFileCount, self.lineCount, self.byteCount))
+        if self.profileFileName is not None:
+            out.write('cProfile data written to %s\n' % self.profileFileName)
+
+def parseProfileArguments(arguments, scriptName = None):
+    """
+    Removes the --stats[=report.json] and --profile[=dump.prof] options from
+    the command line arguments. Returns the profile and the other arguments.
+    """
+    if scriptName is None:
+        scriptName = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+    enabled = False
+    statsFileName = None
+    profileFileName = None
+    remainingArguments = []
+    for argument in arguments:
+        option, separator, value = argument.partition('=')
+        if option in ('--stats', '-stats'):
+            enabled = True
+            statsFileName = value or None
+        elif option in ('--profile', '-profile'):
+            profileFileName = value or scriptName + '.prof'
+        else:
+            remainingArguments.append(argument)
+    return GenerationProfile(scriptName, statsFileName, profileFileName, enabled), remainingArguments
@@ -0,0 +1,129 @@
+from definition import *
+
+# Size and alignment in bytes of the primitive C types for each target ABI.
+# The fixed size integer types and float and double are the same in all of them.
+AbiPrimitiveTypes = {
+    'LP64': {'char': 1, 'short': 2, 'int': 4, 'long': 8, 'long long': 8, 'float': 4, 'double': 8, 'pointer': 8},
+    'LLP64': {'char': 1, 'short': 2, 'int': 4, 'long': 4, 'long long': 8, 'float': 4, 'double': 8, 'pointer': 8},
+    'ILP32': {'char': 1, 'short': 2, 'int': 4, 'long': 4, 'long long': 8, 'float': 4, 'double': 8, 'pointer': 4},
+    'I386': {'char': 1, 'short': 2, 'int': 4, 'long': 4, 'long long': 8, 'float': 4, 'double': 8, 'pointer': 4},
+}
+Abis = ['LP64', 'LLP64', 'ILP32', 'I386']
+
+# Alignment in bytes of the primitive C types that are not aligned to their
+# size. The i386 System V ABI, used on 32 bits Linux and macOS, aligns the
+# 64 bits types to 4 bytes in the structures.
+AbiPrimitiveAlignments = {
+    'I386': {'long long': 4, 'double': 4},
+}
+
+# The primitive type of the C type names, without their signedness.
+PrimitiveTypeNames = {
+    'char': 'char', 'short': 'short', 'short int': 'short', 'int': 'int', '': 'int',
+    'long': 'long', 'long int': 'long', 'long long': 'long long', 'long long int': 'long long',
+    'float': 'float', 'double': 'double',
+    'int8_t': 'char', 'uint8_t': 'char', 'int16_t': 'short', 'uint16_t': 'short',
+    'int32_t': 'int', 'uint32_t': 'int', 'int64_t': 'long long', 'uint64_t': 'long long',
+    'size_t': 'pointer', 'intptr_t': 'pointer', 'uintptr_t': 'pointer', 'ptrdiff_t': 'pointer',
+}
+
+# The unsigned C type names that do not start with uint.
+UnsignedTypeNames = ['size_t']
+
+class FieldLayout:
+    __slots__ = ('field', 'offset', 'size', 'kind', 'signed')
+
+    def __init__(self, field, offset, size, kind, signed):
+        self.field = field
+        self.offset = offset
+        self.size = size
+        self.kind = kind
+        self.signed = signed
+
+class TypeLayout:
+    """
+    Size and alignment of a type, with the kind of its values. The kind is
+    'integer', 'float', 'pointer' or 'aggregate', and the aggregates also
+    have the layout of their fields.
+    """
+    __slots__ = ('size', 'alignment', 'kind', 'signed', 'aggregate', 'fields')
+
+    def __init__(self, size, alignment, kind, signed = False, aggregate = None, fields = None):
+        self.size = size
+        self.alignment = alignment
+        self.kind = kind
+        self.signed = signed
+        self.aggregate = aggregate
+        self.fields = fields
+
+def alignTo(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+class LayoutEngine:
+    """
+    Computes the layout of the types of an API for a target ABI, with the
+    usual C rules: each field is aligned to its own alignment, and an
+    aggregate is aligned to the largest alignment of its fields.
+    """
+    def __init__(self, index, abi):
+        self.index = index
+        self.abi = abi
+        self.primitiveTypes = AbiPrimitiveTypes[abi]
+        self.primitiveAlignments = AbiPrimitiveAlignments.get(abi, {})
+        self.aggregateLayouts = {}
+
+    def getPrimitiveLayout(self, ctype):
+        words = [word for word in ctype.replace('*', ' * ').split() if word != 'const']
+        if '*' in words:
+            size = self.primitiveTypes['pointer']
+            return TypeLayout(size, size, 'pointer')
+
+        signed = 'unsigned' not in words and not words[-1].startswith('uint') and words[-1] not in UnsignedTypeNames
+        name = ' '.join(word for word in words if word not in ('signed', 'unsigned'))
+        primitiveName = PrimitiveTypeNames.get(name)
+        if primitiveName is None:
+            raise Exception("Unknown primitive C type " + ctype)
+
+        size = self.primitiveTypes[primitiveName]
+        alignment = self.primitiveAlignments.get(primitiveName, size)
+        if primitiveName in ('float', 'double'):
+            return TypeLayout(size, alignment, name)
+        return TypeLayout(size, alignment, 'integer', signed)
+
+    def getTypeLayout(self, typeString):
+        descriptor = self.index.getTypeDescriptor(typeString)
+        if descriptor.pointerDepth > 0:
+            return self.getPrimitiveLayout('void*')
+        if descriptor.kind == 'typedef':
+            return self.getPrimitiveLayout(descriptor.definition.ctype)
+        if descriptor.kind == 'enum':
+            return self.getPrimitiveLayout(descriptor.definition.ctype or 'int')
+        if descriptor.kind in ('struct', 'union'):
+            return self.getAggregateLayout(descriptor.definition)
+        raise Exception("Cannot compute the layout of " + typeString)
+
+    def getAggregateLayout(self, aggregate):
+        layout = self.aggregateLayouts.get(aggregate.name)
+        if layout is None:
+            layout = self.aggregateLayouts[aggregate.name] = self.computeAggregateLayout(aggregate)
+        return layout
+
+    def computeAggregateLayout(self, aggregate):
+        fields = []
+        size = 0
+        alignment = 1
+        for field in aggregate.fields:
+            fieldLayout = self.getTypeLayout(field.type)
+            offset = 0
+            if aggregate.isStruct():
+                offset = alignTo(size, fieldLayout.alignment)
+                size = offset + fieldLayout.size
+            else:
+                size = max(size, fieldLayout.size)
+            alignment = max(alignment, fieldLayout.alignment)
+            fields.append(FieldLayout(field, offset, fieldLayout.size, fieldLayout.kind, fieldLayout.signed))
+        return TypeLayout(alignTo(size, alignment), alignment, 'aggregate', False, aggregate, fields)
+
+def computeAbiLayouts(index):
+    # The layout engines of all the target ABIs.
+    return dict((abi, LayoutEngine(index, abi)) for abi in Abis)
@@ -1,9 +1,14 @@
 #!/usr/bin/python3
-import re
 import sys
 
 from definition import *
-from string import Template
+from command_lists import hasCommandLists, getCommands
+from emitter import Emitter
+from vectorized_methods import CountArgumentName, ObjectsArgumentName, getVectorizedMethods, getArrayFunctionName
+from generation_manifest import generateOutputsIncrementally
+from layout import computeAbiLayouts
+from generation_profile import parseProfileArguments
+from output_files import OutputFileSet
 
 HEADER_START = \
 """
@@ -40,40 +45,36 @@ HEADER_END = \
 #endif /* $HeaderProtectMacro */
 """
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
+LAYOUT_CHECKS_START = \
+"""/* Structure layout checks, with the sizes and offsets computed by layout.py. */
+#include <stddef.h>
 
-class MakeHeaderVisitor:
+#ifdef __cplusplus
+#   define ${ConstantPrefix}LAYOUT_CHECK(condition, message) static_assert(condition, message)
+#else
+#   define ${ConstantPrefix}LAYOUT_CHECK(condition, message) _Static_assert(condition, message)
+#endif
+
+"""
+
+# The preprocessor condition of each target ABI. The i386 System V ABI aligns
+# the 64 bits types to 4 bytes in the structures, unlike 32 bits Windows.
+LAYOUT_ABI_CONDITIONS = [
+    ('LLP64', 'defined(_WIN64)'),
+    ('LP64', 'defined(__LP64__) || defined(_LP64)'),
+    ('ILP32', 'defined(_WIN32) || (defined(__SIZEOF_POINTER__) && __SIZEOF_POINTER__ == 4 && !defined(__i386__))'),
+    ('I386', 'defined(__i386__)'),
+]
+
+class MakeHeaderVisitor(Emitter):
     def __init__(self, out, icdInc):
         self.out = out
         self.icdInc = icdInc
         self.variables = {}
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
-
-    def write(self, text):
-        self.out.write(text)
-
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
-
-    def newline(self):
-        self.write('\n')
-
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
-
     def setup(self, api):
         self.api = api
+        self.index = api.getIndex()
         self.variables ={
             'HeaderProtectMacro' : '_' + api.headerFileName.upper().replace('.', '_') + '_' ,
             'ApiExportMacro': api.constantPrefix + 'EXPORT',
@@ -81,6 +82,7 @@ class MakeHeaderVisitor:
             'FunctionPrefix' : api.functionPrefix,
             'TypePrefix' : api.typePrefix,
         }
+        self.directDispatch = api.getOptionalBindingProperty('C', 'directDispatch', 'false') == 'true'
 
     def beginHeader(self):
         self.printString(HEADER_START)
@@ -93,6 +95,18 @@ class MakeHeaderVisitor:
         self.beginHeader();
         self.emitVersions(api.versions)
         self.emitExtensions(api.extensions)
+
+        # A single dispatch table has the functions of all the versions and extensions.
+        self.emitIcdInterface(self.index.fragments)
+        if self.directDispatch:
+            self.emitDirectDispatchers(self.index.fragments)
+        self.newline()
+        if self.api.getOptionalBindingProperty('C', 'getProcAddress', 'false') == 'true':
+            self.emitGetProcAddress()
+        if hasCommandLists(api):
+            self.emitCommandLists(api)
+        if self.api.getOptionalBindingProperty('C', 'layoutChecks', 'false') == 'true':
+            self.emitLayoutChecks()
         self.endHeader();
 
     def visitTypedef(self, typedef):
@@ -100,13 +114,13 @@ class MakeHeaderVisitor:
 
     def visitConstant(self, constant):
         self.printLine('#define $ConstantPrefix$ConstantName (($CType)$ConstantValue)',
-            ConstantName = convertToUnderscore(constant.name),
+            ConstantName = self.index.underscoreName(constant.name),
             CType = constant.ctype, ConstantValue = str(constant.value))
 
     def visitEnum(self, enum):
         self.printLine('typedef enum {')
         for constant in enum.constants:
-            self.printLine("\t$ConstantPrefix$ConstantName = $ConstantValue,", ConstantName=convertToUnderscore(constant.name), ConstantValue= str(constant.value))
+            self.printLine("\t$ConstantPrefix$ConstantName = $ConstantValue,", ConstantName=self.index.underscoreName(constant.name), ConstantValue= str(constant.value))
         self.printLine('} $TypePrefix$EnumName;', EnumName=enum.name)
         self.newline()
 
@@ -137,12 +151,7 @@ class MakeHeaderVisitor:
         if len(arguments) == 0:
             return 'void'
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name)
-        return result
+        return ', '.join(self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name) for arg in arguments)
 
     def emitGlobals(self, functions):
         self.writeLine('/* Global functions. */')
@@ -167,6 +176,24 @@ class MakeHeaderVisitor:
             self.emitFunction(method)
         self.newline()
 
+        vectorizedMethods = getVectorizedMethods(self.index, interface)
+        if len(vectorizedMethods) > 0:
+            self.printLine('/* Array entry points for interface $TypePrefix$Name. */', Name = interface.name)
+            for method in vectorizedMethods:
+                self.emitArrayFunction(method)
+            self.newline()
+
+    def emitArrayFunction(self, method):
+        # Calls the method for each object, with the arguments taken from the arrays.
+        arguments = [self.processText('unsigned int $Name', Name = CountArgumentName),
+            self.processText('$TypePrefix$Type* const* $Name', Type = method.clazz.name, Name = ObjectsArgumentName)]
+        for arg in method.arguments:
+            arguments.append(self.processText('$TypePrefix$Type const* $Name', Type = arg.type, Name = arg.name))
+        self.printLine('${ApiExportMacro} $TypePrefix$ReturnType $FunctionPrefix$FunctionName($Arguments);',
+            ReturnType = method.returnType,
+            FunctionName = getArrayFunctionName(method),
+            Arguments = ', '.join(arguments))
+
     def emitField(self, field):
         self.printLine('\t$TypePrefix$Type $Name;', Type = field.type, Name = field.name)
 
@@ -194,22 +221,89 @@ class MakeHeaderVisitor:
         self.printLine('} $TypePrefix$Name;', Name = struct.name)
         self.newline()
 
-    def emitIcdInterface(self, fragment):
+    def emitLayoutChecks(self):
+        self.printString(LAYOUT_CHECKS_START)
+        layoutEngines = computeAbiLayouts(self.index)
+        first = True
+        for abi, condition in LAYOUT_ABI_CONDITIONS:
+            if first:
+                self.writeLine('#if ' + condition)
+                first = False
+            else:
+                self.writeLine('#elif ' + condition)
+            for aggregate in self.index.aggregates:
+                self.emitAggregateLayoutChecks(aggregate, layoutEngines[abi].getAggregateLayout(aggregate))
+        self.writeLine('#endif')
+
+    def emitAggregateLayoutChecks(self, aggregate, layout):
+        self.printLine('${ConstantPrefix}LAYOUT_CHECK(sizeof($TypePrefix$Name) == $Size, "$TypePrefix$Name size");',
+            Name = aggregate.name, Size = str(layout.size))
+        for fieldLayout in layout.fields:
+            self.printLine('${ConstantPrefix}LAYOUT_CHECK(offsetof($TypePrefix$Name, $Field) == $Offset, "$TypePrefix$Name.$Field offset");',
+                Name = aggregate.name, Field = fieldLayout.field.name, Offset = str(fieldLayout.offset))
+
+    def emitIcdInterface(self, fragments):
         self.printLine('/* Installable client driver interface. */')
         self.printLine('typedef struct _${TypePrefix}icd_dispatch {')
         self.printLine('\tint icd_interface_version;')
         self.icdInc.write('10')
-        for function in fragment.globals:
-            self.printLine('\t$FunctionPrefix${FunctionName}_FUN $FunctionPrefix${FunctionName};', FunctionName = function.cname)
-            self.icdInc.write(self.processText(',\n$FunctionPrefix${FunctionName}', FunctionName = function.cname))
+        for fragment in fragments:
+            for function in fragment.globals:
+                self.printLine('\t$FunctionPrefix${FunctionName}_FUN $FunctionPrefix${FunctionName};', FunctionName = function.cname)
+                self.icdInc.write(self.processText(',\n$FunctionPrefix${FunctionName}', FunctionName = function.cname))
 
-        for interface in fragment.interfaces:
-            for method in interface.methods:
-                self.printLine('\t$FunctionPrefix${FunctionName}_FUN $FunctionPrefix${FunctionName};', FunctionName = method.cname)
-                self.icdInc.write(self.processText(',\n$FunctionPrefix${FunctionName}', FunctionName = method.cname))
+            for interface in fragment.interfaces:
+                for method in interface.methods:
+                    self.printLine('\t$FunctionPrefix${FunctionName}_FUN $FunctionPrefix${FunctionName};', FunctionName = method.cname)
+                    self.icdInc.write(self.processText(',\n$FunctionPrefix${FunctionName}', FunctionName = method.cname))
 
         self.printLine('} ${TypePrefix}icd_dispatch;')
 
+    def emitGetProcAddress(self):
+        self.writeLine('/* Entry point lookup by function name. */')
+        self.printLine('${ApiExportMacro} void* ${FunctionPrefix}GetProcAddress(const char* name);')
+        self.newline()
+
+    def emitCommandLists(self, api):
+        self.writeLine('/* Command list opcodes. */')
+        self.writeLine('typedef enum {')
+        for command in getCommands(api):
+            self.printLine('\t${ConstantPrefix}COMMAND_$Name = $Opcode,', Name = self.index.underscoreName(command.method.cname), Opcode = str(command.opcode))
+        self.printLine('} ${TypePrefix}command_opcode;')
+        self.newline()
+        self.writeLine('/* Executes the commands, stopping at the first one that fails. */')
+        self.printLine('${ApiExportMacro} ${TypePrefix}error ${FunctionPrefix}ExecuteCommandList(unsigned int size, const void* commands);')
+        self.newline()
+
+    def emitDirectDispatchers(self, fragments):
+        # Callers that read the dispatch table of the object, instead of going
+        # through the exported entry point. The object must not be null.
+        self.newline()
+        self.printLine('/* Direct dispatch table callers. */')
+        for fragment in fragments:
+            for interface in fragment.interfaces:
+                for method in interface.methods:
+                    self.emitDirectDispatcher(method)
+
+    def emitDirectDispatcher(self, method):
+        selfArgument = SelfArgument(method.clazz)
+        allArguments = [selfArgument] + method.arguments
+        returnKeyword = 'return '
+        if method.returnType == 'void':
+            returnKeyword = ''
+
+        self.printLine('static inline $TypePrefix$ReturnType ${FunctionPrefix}Direct$FunctionName($Arguments)',
+            ReturnType = method.returnType,
+            FunctionName = method.cname,
+            Arguments = self.makeArgumentsString(allArguments))
+        self.printLine('{')
+        self.printLine('	$Return(*(${TypePrefix}icd_dispatch**)$SelfName)->$FunctionPrefix$FunctionName($ArgumentNames);',
+            Return = returnKeyword,
+            SelfName = selfArgument.name,
+            FunctionName = method.cname,
+            ArgumentNames = ', '.join(arg.name for arg in allArguments))
+        self.printLine('}')
+
     def emitFragment(self, fragment):
         # Emit the types
         for typ in fragment.types:
@@ -236,10 +330,6 @@ class MakeHeaderVisitor:
         for interface in fragment.interfaces:
             self.emitInterface(interface)
 
-        # Emit the icd interface
-        self.emitIcdInterface(fragment)
-        self.newline()
-
     def emitVersion(self, version):
         self.emitFragment(version)
 
@@ -254,12 +344,28 @@ class MakeHeaderVisitor:
         for extension in extensions.values():
             self.emitExtension(extension)
 
+def generateHeaders(api, outputDirectory, target = None):
+    headerFileName = outputDirectory + '/' + api.headerFileName
+    icdIncludeFileName = outputDirectory + '/' + api.getBindingProperty('C', 'icdIncludeFile')
+
+    def emitHeaders():
+        outputFiles = OutputFileSet(target)
+        visitor = MakeHeaderVisitor(outputFiles.create(headerFileName), outputFiles.create(icdIncludeFileName))
+        api.accept(visitor)
+        outputFiles.commit()
+        return outputFiles
+
+    return generateOutputsIncrementally(api, outputDirectory, 'headers', [__file__], [headerFileName, icdIncludeFileName], emitHeaders, target)
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("make-headers <definitions> <output dir>")
+    profile, arguments = parseProfileArguments(sys.argv[1:])
+    if len(arguments) < 2:
+        print("make-headers [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
     else:
-        api = ApiDefinition.loadFromFileNamed(sys.argv[1])
-        with open(sys.argv[2] + '/' + api.headerFileName, 'w') as out:
-            with open(sys.argv[2] + '/' + api.getBindingProperty('C', 'icdIncludeFile'), 'w') as out2:
-                visitor = MakeHeaderVisitor(out, out2)
-                api.accept(visitor)
+        profile.start()
+        profile.instrumentEmitters(MakeHeaderVisitor)
+        api = profile.loadApiDefinition(arguments[0])
+        outputFiles = generateHeaders(api, arguments[1])
+        outputFiles.printSummary()
+        profile.recordOutputs(outputFiles)
+        profile.finish()
@@ -1,9 +1,11 @@
 #!/usr/bin/python3
-import re
 import sys
 
 from definition import *
-from string import Template
+from emitter import Emitter
+from generation_manifest import generateOutputsIncrementally
+from generation_profile import parseProfileArguments
+from output_files import OutputFileSet
 
 
 HEADER_START = \
@@ -194,39 +196,14 @@ HEADER_END = \
 """
 
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
-
-class MakeHeaderVisitor:
+class MakeHeaderVisitor(Emitter):
     def __init__(self, out):
         self.out = out
         self.variables = {}
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
-
-    def write(self, text):
-        self.out.write(text)
-
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
-
-    def newline(self):
-        self.write('\n')
-
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
-
     def setup(self, api):
         self.api = api
+        self.index = api.getIndex()
         self.variables = {
             'ApiName': api.name,
             'HeaderProtectMacro': (api.headerFileName + 'pp').upper().replace('.', '_') + '_',
@@ -238,6 +215,11 @@ class MakeHeaderVisitor:
             'ThrowIfFailed': api.functionPrefix + 'ThrowIfFailed'
         }
 
+        # The wrappers call the direct dispatch table callers of the C header, when it has them.
+        self.variables['CallPrefix'] = api.functionPrefix
+        if api.getOptionalBindingProperty('C', 'directDispatch', 'false') == 'true':
+            self.variables['CallPrefix'] = api.functionPrefix + 'Direct'
+
     def beginHeader(self):
         self.printString(HEADER_START)
 
@@ -252,15 +234,17 @@ class MakeHeaderVisitor:
         self.endHeader();
 
     def convertMethodReturnType(self, typeString):
-        if self.api.isInterfaceReference(typeString):
-            return self.processText('${TypePrefix}ref<$TypePrefix$Type>', Type=typeString[:-1])
+        descriptor = self.index.getTypeDescriptor(typeString)
+        if descriptor.isInterfaceReference:
+            return self.processText('${TypePrefix}ref<$TypePrefix$Type>', Type=descriptor.baseName)
         return self.processText('$TypePrefix$Type', Type=typeString)
 
     def convertMethodArgumentType(self, typeString):
-        if typeString.endswith('**') and self.api.isInterfaceReference(typeString[:-1]):
-            return self.processText('${TypePrefix}ref<$TypePrefix$Type>*', Type=typeString[:-2])
-        if self.api.isInterfaceReference(typeString):
-            return self.processText('const ${TypePrefix}ref<$TypePrefix$Type>&', Type=typeString[:-1])
+        descriptor = self.index.getTypeDescriptor(typeString)
+        if descriptor.isInterfacePointerReference:
+            return self.processText('${TypePrefix}ref<$TypePrefix$Type>*', Type=descriptor.baseName)
+        if descriptor.isInterfaceReference:
+            return self.processText('const ${TypePrefix}ref<$TypePrefix$Type>&', Type=descriptor.baseName)
         return self.processText('$TypePrefix$Type', Type=typeString)
 
     def emitMethodWrapper(self, function):
@@ -274,7 +258,7 @@ class MakeHeaderVisitor:
                 FunctionName = function.name,
                 Arguments = arguments)
             self.printLine('\t{')
-            self.printLine('\t\t$ThrowIfFailed($FunctionPrefix$FunctionName($Arguments));', FunctionName = function.cname, Arguments = paramNames)
+            self.printLine('\t\t$ThrowIfFailed($CallPrefix$FunctionName($Arguments));', FunctionName = function.cname, Arguments = paramNames)
             self.printLine('\t}')
             self.newline()
         else:
@@ -284,7 +268,7 @@ class MakeHeaderVisitor:
                 FunctionName = function.name,
                 Arguments = arguments)
             self.printLine('\t{')
-            self.printLine('\t\treturn $FunctionPrefix$FunctionName($Arguments);', FunctionName = function.cname, Arguments = paramNames)
+            self.printLine('\t\treturn $CallPrefix$FunctionName($Arguments);', FunctionName = function.cname, Arguments = paramNames)
             self.printLine('\t}')
             self.newline()
 
@@ -293,26 +277,20 @@ class MakeHeaderVisitor:
         if len(arguments) == 0:
             return ''
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += self.processText('$Type $Name', Type = self.convertMethodArgumentType(arg.type), Name = arg.name)
-        return result
+        return ', '.join(self.processText('$Type $Name', Type = self.convertMethodArgumentType(arg.type), Name = arg.name) for arg in arguments)
 
     def makeArgumentNamesString(self, arguments):
-        result = 'this'
-        for i in range(len(arguments)):
-            arg = arguments[i]
+        result = ['this']
+        for arg in arguments:
             typeString = arg.type
-            if typeString.endswith('**') and self.api.isInterfaceReference(typeString[:-1]):
-                convertedArgument = self.processText('reinterpret_cast<$TypePrefix$Type> ($Arg)', Arg = arg.name, Type=typeString)
-            elif self.api.isInterfaceReference(typeString):
-                convertedArgument = '%s.get()' % arg.name
+            descriptor = self.index.getTypeDescriptor(typeString)
+            if descriptor.isInterfacePointerReference:
+                result.append(self.processText('reinterpret_cast<$TypePrefix$Type> ($Arg)', Arg = arg.name, Type=typeString))
+            elif descriptor.isInterfaceReference:
+                result.append('%s.get()' % arg.name)
             else:
-                convertedArgument = arg.name
-            result += ', %s' % convertedArgument
-        return result
+                result.append(arg.name)
+        return ', '.join(result)
 
     def emitInterface(self, interface):
         self.printLine('// Interface wrapper for $TypePrefix$Name.', Name = interface.name)
@@ -348,11 +326,27 @@ class MakeHeaderVisitor:
         for extension in extensions.values():
             self.emitExtension(extension)
 
+def generateCppHeader(api, outputDirectory, target = None):
+    headerFileName = outputDirectory + '/' + api.getBindingProperty('C++', 'headerFile')
+
+    def emitHeader():
+        outputFiles = OutputFileSet(target)
+        visitor = MakeHeaderVisitor(outputFiles.create(headerFileName))
+        api.accept(visitor)
+        outputFiles.commit()
+        return outputFiles
+
+    return generateOutputsIncrementally(api, outputDirectory, 'cpp-headers', [__file__], [headerFileName], emitHeader, target)
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("make-headers <definitions> <output dir>")
+    profile, arguments = parseProfileArguments(sys.argv[1:])
+    if len(arguments) < 2:
+        print("make-headers [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
     else:
-        api = ApiDefinition.loadFromFileNamed(sys.argv[1])
-        with open(sys.argv[2] + '/' + api.getBindingProperty('C++', 'headerFile'), 'w') as out:
-            visitor = MakeHeaderVisitor(out)
-            api.accept(visitor)
+        profile.start()
+        profile.instrumentEmitters(MakeHeaderVisitor)
+        api = profile.loadApiDefinition(arguments[0])
+        outputFiles = generateCppHeader(api, arguments[1])
+        outputFiles.printSummary()
+        profile.recordOutputs(outputFiles)
+        profile.finish()
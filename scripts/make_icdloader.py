@@ -1,42 +1,116 @@
 #!/usr/bin/python3
-import re
 import sys
 
 from definition import *
-from string import Template
+from emitter import Emitter
+from generation_manifest import generateOutputsIncrementally
+from generation_profile import parseProfileArguments
+from command_lists import hasCommandLists, getCommands
+from output_files import OutputFileSet
+from vectorized_methods import CountArgumentName, ObjectsArgumentName, getVectorizedMethods, getArrayFunctionName
+from perfect_hash import PerfectHash
 
+PROC_ADDRESS_TYPES = \
+"""namespace
+{
+struct ProcAddressEntry
+{
+	const char *name;
+	void *address;
+};
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
+inline uint32_t hashProcName(const char *name, uint32_t seed)
+{
+	uint32_t h = 2166136261u ^ seed;
+	for (; *name; ++name)
+		h = (h ^ (uint8_t)*name) * 16777619u;
+	h ^= h >> 16;
+	h *= 0x85ebca6bu;
+	h ^= h >> 13;
+	h *= 0xc2b2ae35u;
+	h ^= h >> 16;
+	return h;
+}
+}
+"""
 
+COMMAND_ARGUMENT_READERS = \
+"""namespace
+{
+template<typename T>
+inline T commandInteger(const uint8_t *arguments, int index)
+{
+	int64_t value;
+	memcpy(&value, arguments + index*8, sizeof(value));
+	return static_cast<T> (value);
+}
 
-class MakeIcdLoaderVisitor:
-    def __init__(self, out):
-        self.out = out
-        self.variables = {}
+template<typename T>
+inline T commandValue(const uint8_t *arguments, int index)
+{
+	T value;
+	memcpy(&value, arguments + index*8, sizeof(value));
+	return value;
+}
+}
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
+"""
 
-    def write(self, text):
-        self.out.write(text)
+COMMAND_LIST_EXECUTE_START = \
+"""${ApiExportMacro} ${TypePrefix}error ${FunctionPrefix}ExecuteCommandList ( unsigned int size, const void* commands )
+{
+	const uint8_t *position = static_cast<const uint8_t*> (commands);
+	const uint8_t *end = position + size;
+	while (position < end)
+	{
+		uint32_t opcode;
+		uint32_t commandSize;
+		if (end - position < 8)
+			return ${ConstantPrefix}INVALID_OPERATION;
+		memcpy(&opcode, position, 4);
+		memcpy(&commandSize, position + 4, 4);
+		if (commandSize < 8 || commandSize > size_t(end - position))
+			return ${ConstantPrefix}INVALID_OPERATION;
 
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
+		const uint8_t *arguments = position + 8;
+		${TypePrefix}error error = ${ConstantPrefix}OK;
+		switch (opcode)
+		{
+"""
 
-    def newline(self):
-        self.write('\n')
+COMMAND_LIST_EXECUTE_END = \
+"""		default:
+			return ${ConstantPrefix}INVALID_OPERATION;
+		}
 
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
+		if (error < 0)
+			return error;
+		position += commandSize;
+	}
 
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
+	return ${ConstantPrefix}OK;
+}
+"""
+
+PROC_ADDRESS_LOOKUP = \
+"""
+${ApiExportMacro} void* ${FunctionPrefix}GetProcAddress ( const char* name )
+{
+	if (name == nullptr)
+		return nullptr;
+	uint32_t seed = procAddressDisplacements[hashProcName(name, 0) & $BucketMask];
+	const ProcAddressEntry &entry = procAddressTable[hashProcName(name, seed) & $SlotMask];
+	if (entry.name == nullptr || strcmp(entry.name, name) != 0)
+		return nullptr;
+	return entry.address;
+}
+"""
+
+
+class MakeIcdLoaderVisitor(Emitter):
+    def __init__(self, out):
+        self.out = out
+        self.variables = {}
 
     def setup(self, api):
         self.api = api
@@ -49,16 +123,26 @@ class MakeIcdLoaderVisitor:
 
             'HeaderInclude': api.getBindingProperty('C', 'headerInclude')
         }
+        self.getProcAddress = api.getOptionalBindingProperty('C', 'getProcAddress', 'false') == 'true'
+        self.commandLists = hasCommandLists(api)
 
     def beginSource(self):
         self.writeLine("// This file was generated automatically. DO NOT MODIFY")
         self.printLine("#include $HeaderInclude")
+        if self.getProcAddress or self.commandLists:
+            self.writeLine("#include <stdint.h>")
+            self.writeLine("#include <string.h>")
         self.newline()
 
     def visitApiDefinition(self, api):
         self.setup(api)
         self.beginSource()
         self.emitVersions(api.versions)
+        self.emitExtensions(api.extensions)
+        if self.commandLists:
+            self.emitExecuteCommandList(api)
+        if self.getProcAddress:
+            self.emitGetProcAddress(api)
 
     def emitVersions(self, versions):
         for version in versions.values():
@@ -68,30 +152,86 @@ class MakeIcdLoaderVisitor:
         for interface in version.interfaces:
             for method in interface.methods:
                 self.emitMethod(method)
+            for method in getVectorizedMethods(self.api.getIndex(), interface):
+                self.emitArrayMethod(method)
+
+    def emitExtensions(self, extensions):
+        for extension in extensions.values():
+            self.emitVersion(extension)
+
+    def emitExecuteCommandList(self, api):
+        self.printString(COMMAND_ARGUMENT_READERS)
+        self.printString(COMMAND_LIST_EXECUTE_START)
+        for command in getCommands(api):
+            self.emitCommandCase(command)
+        self.printString(COMMAND_LIST_EXECUTE_END)
+        self.newline()
+
+    def emitCommandCase(self, command):
+        method = command.method
+        allArguments = [SelfArgument(method.clazz)] + method.arguments
+        argumentValues = []
+        for argumentIndex, (arg, kind) in enumerate(zip(allArguments, command.argumentKinds)):
+            if kind == 'integer':
+                reader = 'commandInteger'
+            else:
+                reader = 'commandValue'
+            argumentValues.append(self.processText('$Reader<$TypePrefix$Type> (arguments, $Index)', Reader = reader, Type = arg.type, Index = str(argumentIndex)))
+
+        self.printLine('\t\tcase ${ConstantPrefix}COMMAND_$Name:', Name = self.api.getIndex().underscoreName(method.cname))
+        self.printLine('\t\t\tif (commandSize < $Size)', Size = str(command.size))
+        self.printLine('\t\t\t\treturn ${ConstantPrefix}INVALID_OPERATION;')
+        if method.returnType == 'error':
+            self.printLine('\t\t\terror = $FunctionPrefix$FunctionName( $Arguments );', FunctionName = method.cname, Arguments = ', '.join(argumentValues))
+        else:
+            self.printLine('\t\t\t$FunctionPrefix$FunctionName( $Arguments );', FunctionName = method.cname, Arguments = ', '.join(argumentValues))
+        self.printLine('\t\t\tbreak;')
+
+    def emitGetProcAddress(self, api):
+        # The functions in the order of the dispatch tables.
+        functionNames = []
+        for fragment in api.getIndex().fragments:
+            for function in fragment.globals:
+                functionNames.append(self.processText('$FunctionPrefix$FunctionName', FunctionName=function.cname))
+            for interface in fragment.interfaces:
+                for method in interface.methods:
+                    functionNames.append(self.processText('$FunctionPrefix$FunctionName', FunctionName=method.cname))
+                for method in getVectorizedMethods(api.getIndex(), interface):
+                    functionNames.append(self.processText('$FunctionPrefix$FunctionName', FunctionName=getArrayFunctionName(method)))
+
+        perfectHash = PerfectHash(functionNames)
+        self.printString(PROC_ADDRESS_TYPES)
+        self.newline()
+        self.writeLine('// Perfect hash of the function names, see perfect_hash.py.')
+        self.writeLine('static const uint32_t procAddressDisplacements[] = {')
+        for displacement in perfectHash.displacements:
+            self.writeLine('\t%du,' % displacement)
+        self.writeLine('};')
+        self.newline()
+        self.writeLine('static const ProcAddressEntry procAddressTable[] = {')
+        for name in perfectHash.slots:
+            if name is None:
+                self.writeLine('\t{nullptr, nullptr},')
+            else:
+                self.writeLine('\t{"%s", reinterpret_cast<void*> (&%s)},' % (name, name))
+        self.writeLine('};')
+        self.printString(PROC_ADDRESS_LOOKUP,
+            BucketMask = str(perfectHash.bucketCount - 1),
+            SlotMask = str(perfectHash.slotCount - 1))
 
     def makeArgumentsString(self, arguments):
         # Emit void when no having arguments
         if len(arguments) == 0:
             return 'void'
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name)
-        return result
+        return ', '.join(self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name) for arg in arguments)
 
     def makeArgumentNamesString(self, arguments):
         # Emit void when no having arguments
         if len(arguments) == 0:
             return ''
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += arg.name
-        return result
+        return ', '.join(arg.name for arg in arguments)
 
     def emitMethod(self, method):
         allArguments = method.arguments
@@ -120,11 +260,65 @@ class MakeIcdLoaderVisitor:
         self.printLine('}')
         self.newline()
 
+    def emitArrayMethod(self, method):
+        arguments = [self.processText('unsigned int $Name', Name = CountArgumentName),
+            self.processText('$TypePrefix$Type* const* $Name', Type = method.clazz.name, Name = ObjectsArgumentName)]
+        for arg in method.arguments:
+            arguments.append(self.processText('$TypePrefix$Type const* $Name', Type = arg.type, Name = arg.name))
+        argumentValues = ['object'] + [arg.name + '[i]' for arg in method.arguments]
+
+        self.printLine('${ApiExportMacro} $TypePrefix$ReturnType $FunctionPrefix$FunctionName ( $Arguments )',
+            ReturnType = method.returnType,
+            FunctionName = getArrayFunctionName(method),
+            Arguments = ', '.join(arguments))
+        self.printLine('{')
+        self.printLine('\tfor (unsigned int i = 0; i < $Count; ++i)', Count = CountArgumentName)
+        self.printLine('\t{')
+        self.printLine('\t\t$TypePrefix$Type *object = $Objects[i];', Type = method.clazz.name, Objects = ObjectsArgumentName)
+        if method.returnType == 'error':
+            self.printLine('\t\tif (object == nullptr)')
+            self.printLine('\t\t\treturn ${ConstantPrefix}NULL_POINTER;')
+        else:
+            self.printLine('\t\tif (object == nullptr)')
+            self.printLine('\t\t\tcontinue;')
+        self.printLine('\t\t${TypePrefix}icd_dispatch *dispatchTable = *reinterpret_cast<${TypePrefix}icd_dispatch**> (object);')
+        if method.returnType == 'error':
+            self.printLine('\t\t${TypePrefix}error error = dispatchTable->$FunctionPrefix$FunctionName ( $Arguments );',
+                FunctionName = method.cname,
+                Arguments = ', '.join(argumentValues))
+            self.printLine('\t\tif (error < 0)')
+            self.printLine('\t\t\treturn error;')
+        else:
+            self.printLine('\t\tdispatchTable->$FunctionPrefix$FunctionName ( $Arguments );',
+                FunctionName = method.cname,
+                Arguments = ', '.join(argumentValues))
+        self.printLine('\t}')
+        if method.returnType == 'error':
+            self.printLine('\treturn ${ConstantPrefix}OK;')
+        self.printLine('}')
+        self.newline()
+
+def generateIcdLoader(api, outputDirectory, target = None):
+    redirectionFileName = outputDirectory + '/redirection.cpp'
+
+    def emitIcdLoader():
+        outputFiles = OutputFileSet(target)
+        visitor = MakeIcdLoaderVisitor(outputFiles.create(redirectionFileName))
+        api.accept(visitor)
+        outputFiles.commit()
+        return outputFiles
+
+    return generateOutputsIncrementally(api, outputDirectory, 'icdloader', [__file__], [redirectionFileName], emitIcdLoader, target)
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("make-icdloader <definitions> <output dir>")
+    profile, arguments = parseProfileArguments(sys.argv[1:])
+    if len(arguments) < 2:
+        print("make-icdloader [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
     else:
-        api = ApiDefinition.loadFromFileNamed(sys.argv[1])
-        with open(sys.argv[2] + '/redirection.cpp', 'w') as out:
-                visitor = MakeIcdLoaderVisitor(out)
-                api.accept(visitor)
+        profile.start()
+        profile.instrumentEmitters(MakeIcdLoaderVisitor)
+        api = profile.loadApiDefinition(arguments[0])
+        outputFiles = generateIcdLoader(api, arguments[1])
+        outputFiles.printSummary()
+        profile.recordOutputs(outputFiles)
+        profile.finish()
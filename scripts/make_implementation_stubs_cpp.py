@@ -1,9 +1,11 @@
 #!/usr/bin/python3
-import re
 import sys
 
 from definition import *
-from string import Template
+from emitter import Emitter
+from generation_manifest import generateOutputsIncrementally
+from generation_profile import parseProfileArguments
+from output_files import OutputFileSet
 
 
 HEADER_START = \
@@ -15,12 +17,77 @@ HEADER_START = \
 #include <stdexcept>
 #include <memory>
 #include <atomic>
+"""
 
+HEADER_NAMESPACE_START = \
+"""
 namespace $Namespace
 {
 
 extern $IcdDispatchTableType cppRefcountedDispatchTable;
+"""
+
+# The reference counts of the interfaces used from a single thread have the
+# std::atomic_uint operations used by ref_counter, as plain integer operations.
+COUNT_TEMPLATE = \
+"""
+/**
+ * Phanapi reference count for the objects that are only used from one thread.
+ */
+class single_thread_count
+{
+public:
+    single_thread_count(unsigned int initialValue)
+        : value(initialValue) {}
+
+    unsigned int load(std::memory_order) const
+    {
+        return value;
+    }
+
+    unsigned int fetch_add(unsigned int increment, std::memory_order)
+    {
+        auto old = value;
+        value += increment;
+        return old;
+    }
+
+    unsigned int fetch_sub(unsigned int decrement, std::memory_order)
+    {
+        auto old = value;
+        value -= decrement;
+        return old;
+    }
+
+    bool compare_exchange_weak(unsigned int &expected, unsigned int desired, std::memory_order)
+    {
+        if(value != expected)
+        {
+            expected = value;
+            return false;
+        }
+
+        value = desired;
+        return true;
+    }
+
+private:
+    unsigned int value;
+};
 
+/**
+ * The type of the reference counts of an interface. The interfaces with
+ * another threading than the API specialize it.
+ */
+template<typename I>
+struct interface_count
+{
+    typedef $ApiCountType type;
+};
+"""
+
+REF_COUNTER_TEMPLATE = \
+"""
 /**
  * Phanapi reference counter
  */
@@ -91,10 +158,195 @@ public:
 
     $IcdDispatchTableType *dispatchTable;
     T * object;
-    std::atomic_uint strongCount;
-    std::atomic_uint weakCount;
+    $CountType strongCount;
+    $CountType weakCount;
+};
+"""
+
+# The intrusive reference counter shares its allocation with the object, which
+# is constructed at objectOffset() from the counter.
+INTRUSIVE_REF_COUNTER_TEMPLATE = \
+"""
+/**
+ * Phanapi allocators for the objects of an interface. The counter and the
+ * object are allocated in a single block of Size bytes.
+ */
+template<typename I, size_t Size>
+struct heap_allocator
+{
+    static void *allocate()
+    {
+        return ::operator new(Size);
+    }
+
+    static void deallocate(void *block)
+    {
+        ::operator delete(block);
+    }
+};
+
+/**
+ * Phanapi pool allocator. Each thread keeps a free list with up to
+ * maxFreeBlocks blocks of Size bytes for the interface.
+ */
+template<typename I, size_t Size>
+class pool_allocator
+{
+public:
+    static const size_t maxFreeBlocks = 1024;
+
+    static void *allocate()
+    {
+        auto &list = freeList();
+        auto block = list.first;
+        if(!block)
+            return ::operator new(Size);
+
+        list.first = block->next;
+        --list.count;
+        return block;
+    }
+
+    static void deallocate(void *pointer)
+    {
+        auto &list = freeList();
+        if(list.count == maxFreeBlocks)
+        {
+            ::operator delete(pointer);
+            return;
+        }
+
+        auto block = reinterpret_cast<free_block*> (pointer);
+        block->next = list.first;
+        list.first = block;
+        ++list.count;
+    }
+
+private:
+    struct free_block
+    {
+        free_block *next;
+    };
+
+    struct free_list
+    {
+        free_block *first = nullptr;
+        size_t count = 0;
+
+        ~free_list()
+        {
+            while(first)
+            {
+                auto next = first->next;
+                ::operator delete(first);
+                first = next;
+            }
+        }
+    };
+
+    static free_list &freeList()
+    {
+        static thread_local free_list list;
+        return list;
+    }
 };
 
+/**
+ * The allocator of the objects of an interface. The interfaces with
+ * allocator="pool" specialize it with the pool allocator.
+ */
+template<typename I, size_t Size>
+struct interface_allocator : heap_allocator<I, Size> {};
+
+/**
+ * Phanapi reference counter, in the same allocation as its object.
+ */
+template <typename T>
+class ref_counter
+{
+public:
+    typedef void (*free_function) (ref_counter<T> *counter);
+
+    ref_counter(free_function theFreeStorage)
+        : dispatchTable(&cppRefcountedDispatchTable), strongCount(1), weakCount(1), freeStorage(theFreeStorage)
+    {
+    }
+
+    static constexpr size_t objectOffset()
+    {
+        return (sizeof(ref_counter<T>) + alignof(std::max_align_t) - 1) / alignof(std::max_align_t) * alignof(std::max_align_t);
+    }
+
+    T *object()
+    {
+        return reinterpret_cast<T*> (reinterpret_cast<char*> (this) + objectOffset());
+    }
+
+    $ErrorType retain()
+    {
+        // First sanity check.
+        if(strongCount.load(std::memory_order_acquire) == 0)
+            return $ErrorInvalidOperation;
+
+        // Increase the reference count.
+        strongCount.fetch_add(1, std::memory_order_acq_rel);
+        return $ErrorOk;
+    }
+
+    $ErrorType release()
+    {
+        // First sanity check.
+        if(strongCount.load(std::memory_order_acquire) == 0)
+            return $ErrorInvalidOperation;
+
+        // Decrease the strong count.
+        auto old = strongCount.fetch_sub(1, std::memory_order_acq_rel);
+        if(old == 1)
+        {
+            // The destructor is virtual, so this destroys the implementation object.
+            object()->~T();
+            weakRelease();
+        }
+
+        return $ErrorOk;
+    }
+
+    bool weakLock()
+    {
+        unsigned int oldCount;
+        while((oldCount = strongCount.load(std::memory_order_acquire)) != 0)
+        {
+            if(strongCount.compare_exchange_weak(oldCount, oldCount + 1, std::memory_order_acq_rel))
+                return true;
+        }
+
+        return false;
+    }
+
+    void weakRetain()
+    {
+        weakCount.fetch_add(1, std::memory_order_acq_rel);
+    }
+
+    void weakRelease()
+    {
+        auto old = weakCount.fetch_sub(1, std::memory_order_acq_rel);
+        if(old == 1)
+        {
+            // Nobody else is referencing me.
+            freeStorage(this);
+        }
+    }
+
+    $IcdDispatchTableType *dispatchTable;
+    $CountType strongCount;
+    $CountType weakCount;
+    free_function freeStorage;
+};
+"""
+
+REFERENCE_TEMPLATES = \
+"""
 template<typename T>
 class weak_ref;
 
@@ -181,17 +433,17 @@ public:
     template<typename U>
     U *as() const
     {
-        return static_cast<U*> (counter->object);
+        return static_cast<U*> (counter->$CounterObject);
     }
 
     T *get() const
     {
-        return counter ? counter->object : nullptr;
+        return counter ? counter->$CounterObject : nullptr;
     }
 
     T *operator->() const
     {
-        return counter->object;
+        return counter->$CounterObject;
     }
 
     explicit operator bool() const
@@ -315,7 +567,10 @@ public:
         return std::hash<Counter*> () (counter);
     }
 };
+"""
 
+MAKE_OBJECT_TEMPLATE = \
+"""
 template<typename I, typename T, typename...Args>
 inline ref<I> makeObjectWithInterface(Args... args)
 {
@@ -323,7 +578,64 @@ inline ref<I> makeObjectWithInterface(Args... args)
     std::unique_ptr<ref_counter<I>> counter(new ref_counter<I> (object.release()));
     return ref<I> (counter.release());
 }
+"""
 
+INTRUSIVE_MAKE_OBJECT_TEMPLATE = \
+"""
+/**
+ * Phanapi object storage: the reference counter followed by the object.
+ */
+template<typename I, typename T>
+struct object_storage
+{
+    typedef ref_counter<I> Counter;
+    typedef interface_allocator<I, Counter::objectOffset() + sizeof(T)> Allocator;
+
+    static_assert(alignof(T) <= alignof(std::max_align_t), "The object cannot be over-aligned.");
+
+    template<typename...Args>
+    static Counter *create(Args... args)
+    {
+        auto counter = new (Allocator::allocate()) Counter(&freeStorage);
+        T *object;
+        try
+        {
+            object = new (counter->object()) T(args...);
+        }
+        catch(...)
+        {
+            freeStorage(counter);
+            throw;
+        }
+
+        // The dispatch functions find the interface at a fixed offset.
+        if(static_cast<I*> (object) != counter->object())
+        {
+            object->~T();
+            freeStorage(counter);
+            throw std::logic_error("The interface must be at the start of the object.");
+        }
+
+        object->setRefCounterPointer(counter);
+        return counter;
+    }
+
+    static void freeStorage(Counter *counter)
+    {
+        counter->~Counter();
+        Allocator::deallocate(counter);
+    }
+};
+
+template<typename I, typename T, typename...Args>
+inline ref<I> makeObjectWithInterface(Args... args)
+{
+    return ref<I> (object_storage<I, T>::create(args...));
+}
+"""
+
+HEADER_BASE_INTERFACE = \
+"""
 template<typename T, typename...Args>
 inline ref<typename T::main_interface> makeObject(Args... args)
 {
@@ -412,40 +724,26 @@ $IcdDispatchTableType cppRefcountedDispatchTable = {
 } // End of $Namespace
 """
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
 
-class MakeImplVisitor:
+# The reference count types for the threading of the APIs and interfaces.
+ThreadingCountTypes = {
+    'multiple': 'std::atomic_uint',
+    'single': 'single_thread_count',
+}
+
+class MakeImplVisitor(Emitter):
     def __init__(self, out):
         self.out = out
         self.variables = {}
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
-
-    def write(self, text):
-        self.out.write(text)
-
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
-
-    def newline(self):
-        self.write('\n')
-
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
-
     def setup(self, api):
         self.api = api
+        self.index = api.getIndex()
         self.namespace = api.getBindingProperty('C++/Impl', 'namespace')
+        self.intrusiveObjects = api.getOptionalBindingProperty('C++/Impl', 'intrusiveObjects', 'false') == 'true'
+        self.interfaceCounts = any(self.getInterfaceThreading(interface) == 'single'
+            for fragment in list(api.versions.values()) + list(api.extensions.values())
+            for interface in fragment.interfaces)
         self.variables = {
             'ApiName': api.name,
             'HeaderProtectMacro': (api.headerFileName + 'pp').upper().replace('.', '_') + '_',
@@ -464,8 +762,19 @@ class MakeImplVisitor:
             'ErrorOk': api.constantPrefix + 'OK',
             'ErrorInvalidOperation': api.constantPrefix + 'INVALID_OPERATION',
             'ErrorNullPointer': api.constantPrefix + 'NULL_POINTER',
+            'CounterObject': 'object()' if self.intrusiveObjects else 'object',
+            'CountType': 'typename interface_count<T>::type' if self.interfaceCounts else 'std::atomic_uint',
+            'ApiCountType': ThreadingCountTypes[self.getThreading(api.threading)],
         }
 
+    def getThreading(self, threading):
+        if threading not in ThreadingCountTypes:
+            raise Exception("Unknown threading " + threading)
+        return threading
+
+    def getInterfaceThreading(self, interface):
+        return self.getThreading(interface.threading or self.api.threading)
+
 
 class MakeHeaderVisitor(MakeImplVisitor):
     def __init__(self, out):
@@ -473,6 +782,22 @@ class MakeHeaderVisitor(MakeImplVisitor):
 
     def beginHeader(self):
         self.printString(HEADER_START)
+        if self.intrusiveObjects:
+            self.printLine('#include <cstddef>')
+            self.printLine('#include <new>')
+        self.printString(HEADER_NAMESPACE_START)
+        if self.interfaceCounts:
+            self.printString(COUNT_TEMPLATE)
+        if self.intrusiveObjects:
+            self.printString(INTRUSIVE_REF_COUNTER_TEMPLATE)
+        else:
+            self.printString(REF_COUNTER_TEMPLATE)
+        self.printString(REFERENCE_TEMPLATES)
+        if self.intrusiveObjects:
+            self.printString(INTRUSIVE_MAKE_OBJECT_TEMPLATE)
+        else:
+            self.printString(MAKE_OBJECT_TEMPLATE)
+        self.printString(HEADER_BASE_INTERFACE)
 
     def endHeader(self):
         self.printString(HEADER_END)
@@ -498,15 +823,17 @@ class MakeHeaderVisitor(MakeImplVisitor):
                 Arguments = arguments)
 
     def convertMethodReturnType(self, typeString):
-        if self.api.isInterfaceReference(typeString):
-            return typeString[:-1] + '_ptr'
+        descriptor = self.index.getTypeDescriptor(typeString)
+        if descriptor.isInterfaceReference:
+            return descriptor.baseName + '_ptr'
         return self.processText('$TypePrefix$Type', Type=typeString)
 
     def convertMethodArgumentType(self, typeString):
-        if typeString.endswith('**') and self.api.isInterfaceReference(typeString[:-1]):
-            return typeString[:-2] + '_ref*'
-        if self.api.isInterfaceReference(typeString):
-            return 'const ' + typeString[:-1] + '_ref &'
+        descriptor = self.index.getTypeDescriptor(typeString)
+        if descriptor.isInterfacePointerReference:
+            return descriptor.baseName + '_ref*'
+        if descriptor.isInterfaceReference:
+            return 'const ' + descriptor.baseName + '_ref &'
         return self.processText('$TypePrefix$Type', Type=typeString)
 
     def makeArgumentsString(self, arguments):
@@ -514,19 +841,10 @@ class MakeHeaderVisitor(MakeImplVisitor):
         if len(arguments) == 0:
             return ''
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += self.processText('$Type $Name', Type = self.convertMethodArgumentType(arg.type), Name = arg.name)
-        return result
+        return ', '.join(self.processText('$Type $Name', Type = self.convertMethodArgumentType(arg.type), Name = arg.name) for arg in arguments)
 
     def makeArgumentNamesString(self, arguments):
-        result = 'this'
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            result += ', %s' % arg.name
-        return result
+        return ', '.join(['this'] + [arg.name for arg in arguments])
 
     def beginNamespace(self):
         self.printLine('namespace $Namespace')
@@ -540,8 +858,25 @@ class MakeHeaderVisitor(MakeImplVisitor):
         self.printLine('typedef ref_counter<$Name> *${Name}_ptr;', Name = interface.name)
         self.printLine('typedef ref<$Name> ${Name}_ref;', Name = interface.name)
         self.printLine('typedef weak_ref<$Name> ${Name}_weakref;', Name = interface.name)
+        self.declareInterfaceAllocator(interface)
+        self.declareInterfaceCount(interface)
         self.newline()
 
+    def declareInterfaceCount(self, interface):
+        threading = self.getInterfaceThreading(interface)
+        if threading != self.api.threading:
+            self.printLine('template<> struct interface_count<$Name> { typedef $CountType type; };',
+                Name = interface.name, CountType = ThreadingCountTypes[threading])
+
+    def declareInterfaceAllocator(self, interface):
+        if interface.allocator == 'heap':
+            return
+        if interface.allocator != 'pool':
+            raise Exception("Unknown allocator %s of interface %s" % (interface.allocator, interface.name))
+        if not self.intrusiveObjects:
+            raise Exception("The pool allocator of interface %s requires the intrusiveObjects property" % interface.name)
+        self.printLine('template<size_t Size> struct interface_allocator<$Name, Size> : pool_allocator<$Name, Size> {};', Name = interface.name)
+
     def emitInterface(self, interface):
         self.printLine('// Interface wrapper for $TypePrefix$Name.', Name = interface.name)
         self.printLine('struct $Name : base_interface', Name = interface.name)
@@ -627,7 +962,7 @@ class MakeDispatchVisitor(MakeImplVisitor):
                 Arguments = self.makeDispatchCallArgumentsString(function.arguments)
             )
 
-            if self.api.isInterfaceReference(function.returnType):
+            if self.index.getTypeDescriptor(function.returnType).isInterfaceReference:
                 self.printLine("\treturn reinterpret_cast<$TypePrefix$ReturnType> ($CallExpression);",
                     ReturnType = function.returnType,
                     CallExpression = callExpression
@@ -642,31 +977,23 @@ class MakeDispatchVisitor(MakeImplVisitor):
         if len(arguments) == 0:
             return 'void'
 
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-            result += self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name)
-        return result
+        return ', '.join(self.processText('$TypePrefix$Type $Name', Type = arg.type, Name = arg.name) for arg in arguments)
 
     def makeDispatchCallArgumentsString(self, arguments):
-        result = ''
-        for i in range(len(arguments)):
-            arg = arguments[i]
-            if i > 0: result += ', '
-
-            typeString = arg.type
-            if typeString.endswith('**') and self.api.isInterfaceReference(typeString[:-1]):
-                result += self.processText('reinterpret_cast<$Namespace::$TargetType> ($Arg)',
-                    TargetType = typeString[:-2] + '_ref*',
+        result = []
+        for arg in arguments:
+            descriptor = self.index.getTypeDescriptor(arg.type)
+            if descriptor.isInterfacePointerReference:
+                result.append(self.processText('reinterpret_cast<$Namespace::$TargetType> ($Arg)',
+                    TargetType = descriptor.baseName + '_ref*',
                     Arg = arg.name
-                )
-            elif self.api.isInterfaceReference(typeString):
-                result += self.processText('asRef($Namespace::$Type, $Arg)', Type = arg.type[:-1], Arg = arg.name)
+                ))
+            elif descriptor.isInterfaceReference:
+                result.append(self.processText('asRef($Namespace::$Type, $Arg)', Type = descriptor.baseName, Arg = arg.name))
             else:
-                result += arg.name
+                result.append(arg.name)
 
-        return result
+        return ', '.join(result)
 
     def emitInterface(self, interface):
         self.printLine("//==============================================================================")
@@ -697,16 +1024,42 @@ class MakeDispatchVisitor(MakeImplVisitor):
         for extension in extensions.values():
             self.emitExtension(extension)
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("make-headers <definitions> <output dir>")
-    else:
-        api = ApiDefinition.loadFromFileNamed(sys.argv[1])
+def generateImplementationHeader(api, outputDirectory, target = None):
+    headerFileName = outputDirectory + '/' + api.getBindingProperty('C++/Impl', 'headerFile')
 
-        with open(sys.argv[2] + '/' + api.getBindingProperty('C++/Impl', 'headerFile'), 'w') as out:
-            visitor = MakeHeaderVisitor(out)
-            api.accept(visitor)
+    def emitHeader():
+        outputFiles = OutputFileSet(target)
+        visitor = MakeHeaderVisitor(outputFiles.create(headerFileName))
+        api.accept(visitor)
+        outputFiles.commit()
+        return outputFiles
 
-        with open(sys.argv[2] + '/' + api.getBindingProperty('C++/Impl', 'dispatchIncludeFile'), 'w') as out:
-            visitor = MakeDispatchVisitor(out)
-            api.accept(visitor)
+    return generateOutputsIncrementally(api, outputDirectory, 'impl-header', [__file__], [headerFileName], emitHeader, target)
+
+def generateDispatchInclude(api, outputDirectory, target = None):
+    dispatchIncludeFileName = outputDirectory + '/' + api.getBindingProperty('C++/Impl', 'dispatchIncludeFile')
+
+    def emitDispatchInclude():
+        outputFiles = OutputFileSet(target)
+        visitor = MakeDispatchVisitor(outputFiles.create(dispatchIncludeFileName))
+        api.accept(visitor)
+        outputFiles.commit()
+        return outputFiles
+
+    return generateOutputsIncrementally(api, outputDirectory, 'impl-dispatch', [__file__], [dispatchIncludeFileName], emitDispatchInclude, target)
+
+if __name__ == '__main__':
+    profile, arguments = parseProfileArguments(sys.argv[1:])
+    if len(arguments) < 2:
+        print("make-headers [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
+    else:
+        profile.start()
+        profile.instrumentEmitters(MakeHeaderVisitor, MakeDispatchVisitor)
+        api = profile.loadApiDefinition(arguments[0])
+        outputFiles = generateImplementationHeader(api, arguments[1])
+        outputFiles.printSummary()
+        profile.recordOutputs(outputFiles)
+        outputFiles = generateDispatchInclude(api, arguments[1])
+        outputFiles.printSummary()
+        profile.recordOutputs(outputFiles)
+        profile.finish()
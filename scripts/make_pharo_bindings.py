@@ -4,41 +4,424 @@ import sys
 import os.path
 
 from definition import *
-from string import Template
+from command_lists import hasCommandLists, getFragmentCommands
+from emitter import Emitter
+from generation_manifest import GenerationManifest
+from generation_profile import parseProfileArguments
+from layout import computeAbiLayouts
+from output_files import DefaultWriteJobs, OutputFileSet
+from vectorized_methods import CountArgumentName, ObjectsArgumentName, LongSize, PointerSize, getVectorizedMethods, getArrayFunctionName, getArrayElementLayout
+
+COMMAND_LIST_METHODS = \
+"""{ #category : #'initialization' }
+$ClassName >> initialize [
+	buffer_ := ByteArray new: 4096.
+	size_ := 0
+]
+
+{ #category : #'testing' }
+$ClassName >> isEmpty [
+	^ size_ = 0
+]
+
+{ #category : #'accessing' }
+$ClassName >> byteSize [
+	^ size_
+]
+
+{ #category : #'execution' }
+$ClassName >> reset [
+	size_ := 0
+]
+
+{ #category : #'execution' }
+$ClassName >> execute [
+	"Runs the recorded commands with a single call, and empties the list."
+	| resultValue_ |
+	size_ = 0 ifTrue: [ ^ self ].
+	resultValue_ := $CBindingsClass uniqueInstance executeCommandList_size: size_ commands: buffer_.
+	size_ := 0.
+	resultValue_ < 0 ifTrue: [ self error: 'Command list execution failed with error ' , resultValue_ printString ]
+]
+
+{ #category : #'private' }
+$ClassName >> beginCommand: opcode size: commandSize [
+	| offset_ newBuffer_ |
+	size_ + commandSize > buffer_ size ifTrue: [
+		newBuffer_ := ByteArray new: (buffer_ size * 2 max: size_ + commandSize).
+		newBuffer_ replaceFrom: 1 to: size_ with: buffer_ startingAt: 1.
+		buffer_ := newBuffer_ ].
+	offset_ := size_.
+	buffer_ unsignedLongAt: offset_ + 1 put: opcode.
+	buffer_ unsignedLongAt: offset_ + 5 put: commandSize.
+	size_ := size_ + commandSize.
+	^ offset_ + 9
+]
+
+{ #category : #'private' }
+$ClassName >> integerAt: offset put: value [
+	| integer_ |
+	integer_ := value.
+	value == true ifTrue: [ integer_ := 1 ].
+	value == false ifTrue: [ integer_ := 0 ].
+	integer_ < 0
+		ifTrue: [ buffer_ signedLongLongAt: offset put: integer_ ]
+		ifFalse: [ buffer_ unsignedLongLongAt: offset put: integer_ ]
+]
+
+{ #category : #'private' }
+$ClassName >> floatAt: offset put: value [
+	buffer_ floatAt: offset put: value asFloat
+]
+
+{ #category : #'private' }
+$ClassName >> doubleAt: offset put: value [
+	buffer_ doubleAt: offset put: value asFloat
+]
+
+{ #category : #'private' }
+$ClassName >> handleAt: offset put: anObject [
+	anObject ifNil: [ ^ buffer_ unsignedLongLongAt: offset put: 0 ].
+	buffer_ unsignedLongLongAt: offset put: anObject validHandle asInteger
+]
 
+"""
+
+# uFFI compiles the callout of a ffiCall: method on its first call, and
+# discards it when the session starts again. The warm up compiles and
+# installs the callouts like the first call does, without calling them.
+WARM_UP_METHODS = \
+"""{ #category : #'warm up' }
+$ClassName class >> warmUpBindings [
+	<script>
+	| bindings_ |
+	bindings_ := $CBindingsClass uniqueInstance.
+	$Selectors do: [ :selector_ |
+		"A callout that cannot be compiled now is left to its first call."
+		[ self warmUpCallout: selector_ in: bindings_ ] on: Error do: [ :error_ | error_ return: nil ] ]
+]
+
+{ #category : #'warm up' }
+$ClassName class >> warmUpBindingsInBackground [
+	<script>
+	[ self warmUpBindings ] forkAt: Processor userBackgroundPriority named: '$ClassName warm up'
+]
+
+{ #category : #'warm up' }
+$ClassName class >> warmUpCallout: selector in: bindings [
+	| method_ context_ callout_ ffiMethod_ |
+	method_ := bindings class lookupSelector: selector.
+	(method_ isNil or: [ method_ hasProperty: #ffiNonCompiledMethod ]) ifTrue: [ ^ self ].
+	context_ := Context sender: nil receiver: bindings method: method_ arguments: (Array new: method_ numArgs).
+	callout_ := (bindings ffiCalloutIn: context_)
+		convention: bindings ffiCallingConvention;
+		yourself.
+	ffiMethod_ := callout_ newBuilder build: [ :builder_ |
+		builder_
+			signature: (method_ literals detect: [ :literal_ | literal_ isArray ]);
+			sender: context_;
+			library: bindings ffiLibrary ].
+	ffiMethod_
+		selector: selector;
+		propertyAt: #ffiNonCompiledMethod put: method_;
+		propertyAt: #ffiMethodSelector put: selector.
+	method_ methodClass methodDict at: selector put: ffiMethod_.
+	FFIMethodRegistry uniqueInstance registerMethod: ffiMethod_
+]
+
+{ #category : #'system startup' }
+$ClassName class >> startUp: resuming [
+	resuming ifTrue: [ self warmUpBindingsInBackground ]
+]
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
+"""
 
+# Production images can route the wrappers to their unchecked variants, after
+# the application has been validated with the checked ones. The replaced
+# wrappers are kept in a property of the installed methods, for going back.
+WRAPPER_SWITCH_METHODS = \
+"""{ #category : #'unchecked wrappers' }
+$ClassName class >> useUncheckedWrappers [
+	<script>
+	self uncheckedWrappers do: [ :entry_ |
+		Smalltalk at: entry_ first ifPresent: [ :class_ |
+			| checked_ unchecked_ |
+			checked_ := class_ compiledMethodAt: entry_ second ifAbsent: [ nil ].
+			unchecked_ := class_ compiledMethodAt: entry_ third ifAbsent: [ nil ].
+			(checked_ notNil and: [ unchecked_ notNil and: [ (checked_ hasProperty: #checkedWrapper) not ] ]) ifTrue: [
+				unchecked_ := unchecked_ copy.
+				unchecked_ selector: entry_ second.
+				unchecked_ propertyAt: #checkedWrapper put: checked_.
+				class_ addSelectorSilently: entry_ second withMethod: unchecked_ ] ] ]
+]
+
+{ #category : #'unchecked wrappers' }
+$ClassName class >> useCheckedWrappers [
+	<script>
+	self uncheckedWrappers do: [ :entry_ |
+		Smalltalk at: entry_ first ifPresent: [ :class_ |
+			| installed_ |
+			installed_ := class_ compiledMethodAt: entry_ second ifAbsent: [ nil ].
+			(installed_ notNil and: [ installed_ hasProperty: #checkedWrapper ]) ifTrue: [
+				class_ addSelectorSilently: entry_ second withMethod: (installed_ propertyAt: #checkedWrapper) ] ] ]
+]
 
-def convertToCamelCase(s):
-    result = ''
-    begin = True
-    for c in s:
-        if c == '_':
-            begin = True
-        elif begin:
-            result += c.upper()
-            begin = False
-        else:
-            result += c
-    return result
+"""
+
+# Maps the handles to their live wrappers, so that an object returned many
+# times keeps a single wrapper. The values are weak, so a wrapper can still be
+# collected and finalized, and a reused address then gets a new wrapper.
+WRAPPER_REGISTRY_METHODS = \
+"""{ #category : #'accessing' }
+$ClassName class >> uniqueInstance [
+	^ UniqueInstance ifNil: [ UniqueInstance := self new ]
+]
+
+{ #category : #'initialization' }
+$ClassName >> initialize [
+	wrappers_ := WeakValueDictionary new.
+	mutex_ := Mutex new.
+	addedSincePurge_ := 0.
+	purgeThreshold_ := 64.
+	self resetCounters
+]
+
+{ #category : #'accessing' }
+$ClassName >> wrapperOf: aHandle for: aClass ifReused: releaseBlock [
+	"Returns the live wrapper of the handle, or a new one. The handle comes with a reference, which releaseBlock drops when the wrapper is reused."
+	| key_ wrapper_ |
+	(aHandle isNil or: [ aHandle isNull ]) ifTrue: [ ^ aClass forHandle: aHandle ].
+	key_ := aHandle asInteger.
+	^ mutex_ critical: [
+		wrapper_ := wrappers_ at: key_ ifAbsent: [ nil ].
+		(wrapper_ notNil and: [ wrapper_ class == aClass ])
+			ifTrue: [
+				hits_ := hits_ + 1.
+				releaseBlock value ]
+			ifFalse: [
+				misses_ := misses_ + 1.
+				wrapper_ := aClass forHandle: aHandle.
+				self addWrapper: wrapper_ key: key_ ].
+		wrapper_ ]
+]
+
+{ #category : #'private' }
+$ClassName >> addWrapper: aWrapper key: aKey [
+	"Called inside the mutex. The handles of the collected wrappers are purged after as many additions as there were live wrappers at the last purge."
+	wrappers_ at: aKey put: aWrapper.
+	addedSincePurge_ := addedSincePurge_ + 1.
+	addedSincePurge_ >= purgeThreshold_ ifTrue: [ self purgeCollectedWrappers ]
+]
+
+{ #category : #'private' }
+$ClassName >> purgeCollectedWrappers [
+	"Called inside the mutex. Removes the handles whose wrapper was garbage collected."
+	| collectedKeys_ |
+	collectedKeys_ := OrderedCollection new.
+	wrappers_ keysAndValuesDo: [ :key :value | value ifNil: [ collectedKeys_ add: key ] ].
+	collectedKeys_ do: [ :key | wrappers_ removeKey: key ].
+	addedSincePurge_ := 0.
+	purgeThreshold_ := wrappers_ size max: 64
+]
+
+{ #category : #'accessing' }
+$ClassName >> forget: aWrapper handle: aHandle [
+	"Called before the wrapper releases its handle, which may then be reused by another object."
+	| key_ |
+	(aHandle isNil or: [ aHandle isNull ]) ifTrue: [ ^ self ].
+	key_ := aHandle asInteger.
+	mutex_ critical: [
+		(wrappers_ at: key_ ifAbsent: [ nil ]) == aWrapper ifTrue: [
+			wrappers_ removeKey: key_ ] ]
+]
+
+{ #category : #'statistics' }
+$ClassName >> hits [
+	^ hits_
+]
+
+{ #category : #'statistics' }
+$ClassName >> misses [
+	^ misses_
+]
+
+{ #category : #'statistics' }
+$ClassName >> size [
+	"The number of live wrappers."
+	| liveCount_ |
+	^ mutex_ critical: [
+		self purgeCollectedWrappers.
+		liveCount_ := 0.
+		wrappers_ keysAndValuesDo: [ :key :value | value ifNotNil: [ liveCount_ := liveCount_ + 1 ] ].
+		liveCount_ ]
+]
+
+{ #category : #'statistics' }
+$ClassName >> resetCounters [
+	hits_ := 0.
+	misses_ := 0
+]
+
+"""
 
+# Assignments per constants initializer method, which keeps the class
+# variable bindings of each method under the literal limit of old bytecode sets.
+ConstantsPerInitializer = 200
+
+# Scratch buffers for passing the handles of collections of wrappers to the
+# pointerList arguments, kept by each process for its calls. The arrayReturn
+# arguments receive their handles in a handle array.
+HANDLE_BUFFERS_METHODS = \
+"""{ #category : #'accessing' }
+$ClassName class >> current [
+	"The buffers of the active process."
+	^ $VariableClass value ifNil: [
+		| buffers_ |
+		buffers_ := self new.
+		$VariableClass value: buffers_.
+		buffers_ ]
+]
+
+{ #category : #'instance creation' }
+$ClassName class >> newBuffer: byteSize [
+	$NewBuffer
+]
+
+{ #category : #'initialization' }
+$ClassName >> initialize [
+	free_ := OrderedCollection new.
+	leased_ := IdentitySet new
+]
+
+{ #category : #'buffers' }
+$ClassName >> acquire: byteSize [
+	| buffer_ |
+	buffer_ := free_ detect: [ :each | each size >= byteSize ] ifNone: [ nil ].
+	buffer_
+		ifNil: [ buffer_ := self class newBuffer: (byteSize max: 256) ]
+		ifNotNil: [ free_ remove: buffer_ ].
+	leased_ add: buffer_.
+	^ buffer_
+]
+
+{ #category : #'buffers' }
+$ClassName >> release: aBuffer [
+	(leased_ includes: aBuffer) ifFalse: [ ^ self ].
+	leased_ remove: aBuffer.
+	free_ add: aBuffer
+]
+
+{ #category : #'buffers' }
+$ClassName >> handlesOf: anObject [
+	"The handles of a collection of wrappers, written in one pass into a scratch buffer. Buffers, handle arrays and nil are passed as they are."
+	| buffer_ wordSize_ |
+	anObject ifNil: [ ^ nil ].
+	(anObject isKindOf: $HandleArrayClass) ifTrue: [ ^ anObject handleBuffer ].
+	((anObject isKindOf: ByteArray) or: [ anObject isKindOf: ExternalAddress ]) ifTrue: [ ^ anObject ].
+	wordSize_ := Smalltalk wordSize.
+	buffer_ := self acquire: anObject size * wordSize_.
+	anObject doWithIndex: [ :each :index_ |
+		buffer_ pointerAt: index_ - 1 * wordSize_ + 1 put: (each ifNil: [ ExternalAddress new ] ifNotNil: [ each validHandle ]) ].
+	^ buffer_
+]
+
+{ #category : #'buffers' }
+$ClassName >> resultHandlesOf: anObject [
+	"The buffer that receives the handles of an arrayReturn argument. A handle array drops its previous handles first."
+	anObject ifNil: [ ^ nil ].
+	(anObject isKindOf: $HandleArrayClass) ifTrue: [ ^ anObject resetForResults; handleBuffer ].
+	((anObject isKindOf: ByteArray) or: [ anObject isKindOf: ExternalAddress ]) ifTrue: [ ^ anObject ].
+	^ self error: 'An arrayReturn argument takes a handle array, a buffer or nil'
+]
+
+"""
+
+# The handles written by an arrayReturn argument, wrapped when they are accessed.
+HANDLE_ARRAY_METHODS = \
+"""{ #category : #'instance creation' }
+$ClassName class >> new: size of: anInterfaceClass [
+	^ self basicNew initializeWithSize: size elementClass: anInterfaceClass
+]
+
+{ #category : #'initialization' }
+$ClassName >> initializeWithSize: size elementClass: anInterfaceClass [
+	buffer_ := $HandleBuffersClass newBuffer: (size max: 1) * Smalltalk wordSize.
+	size_ := size.
+	elementClass_ := anInterfaceClass.
+	wrappers_ := Array new: size
+]
+
+{ #category : #'initialization' }
+$ClassName >> resetForResults [
+	self releaseUnwrappedHandles.
+	buffer_ atAllPut: 0.
+	wrappers_ atAllPut: nil
+]
+
+{ #category : #'releasing' }
+$ClassName >> releaseUnwrappedHandles [
+	"Releases the references of the handles that were never accessed, which no wrapper owns."
+	(elementClass_ respondsTo: #releaseHandle:) ifFalse: [ ^ self ].
+	1 to: size_ do: [ :index_ |
+		| handle_ |
+		handle_ := self handleAt: index_.
+		((wrappers_ at: index_) isNil and: [ handle_ isNull not ]) ifTrue: [
+			elementClass_ releaseHandle: handle_.
+			buffer_ pointerAt: index_ - 1 * Smalltalk wordSize + 1 put: ExternalAddress new ] ]
+]
+
+{ #category : #'accessing' }
+$ClassName >> size [
+	^ size_
+]
+
+{ #category : #'accessing' }
+$ClassName >> handleBuffer [
+	^ buffer_
+]
+
+{ #category : #'accessing' }
+$ClassName >> handleAt: index [
+	^ buffer_ pointerAt: index - 1 * Smalltalk wordSize + 1
+]
+
+{ #category : #'accessing' }
+$ClassName >> at: index [
+	| handle_ |
+	(wrappers_ at: index) ifNotNil: [ :wrapper_ | ^ wrapper_ ].
+	handle_ := self handleAt: index.
+	handle_ isNull ifTrue: [ ^ nil ].
+	^ wrappers_ at: index put: (elementClass_ $ForHandle handle_)
+]
+
+{ #category : #'accessing' }
+$ClassName >> at: index put: anObject [
+	^ self shouldNotImplement
+]
+
+{ #category : #'enumerating' }
+$ClassName >> do: aBlock [
+	1 to: size_ do: [ :index_ | aBlock value: (self at: index_) ]
+]
+
+{ #category : #'copying' }
+$ClassName >> species [
+	^ Array
+]
+
+"""
+
+# The characters that cannot be in the names of the version and extension packages.
+PackageNameInvalidCharacters = re.compile('[^A-Za-z0-9_]')
 
 def nameListToString(nameList):
-    nameString = ''
-    for name in nameList:
-        if len(nameString) > 0:
-            nameString += ' '
-        nameString += name
-    return nameString
+    return ' '.join(nameList)
 
 
-class MakePharoBindingsVisitor:
-    def __init__(self, outputDirectory, apiDefinition, forSqueak = False):
+class MakePharoBindingsVisitor(Emitter):
+    def __init__(self, outputDirectory, apiDefinition, forSqueak = False, target = None):
         self.outputDirectory = outputDirectory
+        self.outputFiles = OutputFileSet(target, DefaultWriteJobs)
         self.out = None
         self.variables = {}
         self.constants = {}
@@ -58,7 +441,14 @@ class MakePharoBindingsVisitor:
         self.typesClassName = self.namespacePrefix + 'Types'
         self.cbindingsClassName = self.namespacePrefix + 'CBindings'
         self.doItClassName = self.namespacePrefix
-        self.startedExtensions = set()
+        self.generatedDoItClassName = self.namespacePrefix + 'GeneratedDoIt'
+        self.commandListClassName = self.namespacePrefix + 'CommandList'
+        self.wrapperRegistryClassName = self.namespacePrefix + 'WrapperRegistry'
+        self.handleBuffersClassName = self.namespacePrefix + 'HandleBuffers'
+        self.handleBuffersVariableClassName = self.namespacePrefix + 'HandleBuffersVariable'
+        self.handleArrayClassName = self.namespacePrefix + 'HandleArray'
+        self.calloutSelectors = []
+        self.classFiles = {}
         self.bindingsPoolDictionaries = [self.constantsClassName, self.typesClassName]
         self.externalStructureSuperClass = 'FFIExternalStructure'
         self.externalUnionSuperClass = 'FFIExternalUnion'
@@ -68,46 +458,69 @@ class MakePharoBindingsVisitor:
             self.externalStructureSuperClass = apiDefinition.getBindingProperty('Squeak', 'externalStructureSuperClass')
             self.externalUnionSuperClass = apiDefinition.getBindingProperty('Squeak', 'externalUnionSuperClass')
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
-
-    def write(self, text):
-        self.out.write(text)
-
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
-
-    def newline(self):
-        self.write('\n')
-
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
+        # With splitPackages, each version and extension goes into its own
+        # package, and a generated baseline declares the dependencies between them.
+        self.splitPackages = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'splitPackages', 'false') == 'true'
+        self.baselineClassName = 'BaselineOf' + self.generatedCodeCategory.replace('-', '')
+        self.fragmentPackages = {}
+        self.aggregateClassNames = set()
+
+        # With uncheckedWrappers, each wrapper also gets an unsafe variant that
+        # passes the handles without validating them.
+        self.uncheckedWrappers = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'uncheckedWrappers', 'false') == 'true'
+        # With directConstants, the constants are assigned by generated statements
+        # instead of one reflective write per constant when the pool is initialized.
+        self.directConstants = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'directConstants', 'false') == 'true'
+        # With precomputedLayouts, the structures get field accessors with the
+        # offsets computed by layout.py, instead of building them in the image.
+        self.precomputedLayouts = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'precomputedLayouts', 'false') == 'true'
+        self.isWindowsCondition = 'Smalltalk os isWindows'
+        self.isIlp32Condition = "(Smalltalk os isWindows or: [ Smalltalk os subtype beginsWith: 'arm' ])"
+        if forSqueak:
+            self.isWindowsCondition = "(Smalltalk platformName = 'Win32')"
+            self.isIlp32Condition = "((Smalltalk platformName = 'Win32') or: [ Smalltalk platformSubtype beginsWith: 'arm' ])"
+        self.handleArrays = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'handleArrays', 'false') == 'true'
+        self.wrapperRegistry = apiDefinition.getOptionalBindingProperty(self.targetLanguage, 'wrapperRegistry', 'false') == 'true'
+        # With warmUpBindings, the generated DoIt compiles all the callouts after
+        # loading and when the session starts, so that their first call is not slower.
+        self.warmUpBindings = not forSqueak and apiDefinition.getOptionalBindingProperty('Pharo', 'warmUpBindings', 'false') == 'true'
 
     def visitApiDefinition(self, api):
         self.setup(api)
         self.processVersions(api.versions)
-        try:
-            self.emitBindings(api)
-        finally:
-            self.finishCurrentFile()
+        self.processExtensions(api.extensions)
+        self.emitBindings(api)
+        self.finishCurrentFile()
+        self.outputFiles.commit()
+        self.manifest.commit(self.outputFiles)
 
     def setup(self, api):
         self.api = api
+        self.index = api.getIndex()
+        self.manifest = GenerationManifest(self.outputDirectory, self.targetLanguage.lower(), api, [__file__], self.outputFiles.target)
+        self.upToDateClasses = set()
+        self.commandLists = hasCommandLists(api)
+        if self.precomputedLayouts:
+            self.layoutEngines = computeAbiLayouts(self.index)
+        for version in api.versions.values():
+            self.fragmentPackages[version] = self.makeFragmentPackageName('V' + version.name)
+        for extension in api.extensions.values():
+            self.fragmentPackages[extension] = self.makeFragmentPackageName(extension.name)
         self.variables = {
             'ConstantPrefix': api.constantPrefix,
             'FunctionPrefix': api.functionPrefix,
             'TypePrefix': api.typePrefix,
         }
 
+    def makeFragmentPackageName(self, fragmentName):
+        if not self.splitPackages:
+            return self.generatedCodeCategory
+        # Dots separate the version number in the Monticello file names.
+        return self.generatedCodeCategory + '-' + PackageNameInvalidCharacters.sub('_', fragmentName)
+
     def visitEnum(self, enum):
         for constant in enum.constants:
-            cname = self.processText("$ConstantPrefix$ConstantName", ConstantName=convertToUnderscore(constant.name))
+            cname = self.processText("$ConstantPrefix$ConstantName", ConstantName=self.index.underscoreName(constant.name))
             self.constants[cname] = constant.value
         cenumName = self.processText("$TypePrefix$EnumName", EnumName=enum.name)
         if self.forSqueak:
@@ -144,7 +557,7 @@ class MakePharoBindingsVisitor:
 
     def visitInterface(self, interface):
         cname = typedefName = self.processText("$TypePrefix$Name", Name=interface.name)
-        self.interfaceTypeMap[interface.name + '*'] = self.namespacePrefix + convertToCamelCase(interface.name)
+        self.interfaceTypeMap[interface.name + '*'] = self.namespacePrefix + self.index.camelCaseName(interface.name)
         if self.forSqueak:
             self.typeBindings[cname] = "void"
         else:
@@ -170,16 +583,18 @@ class MakePharoBindingsVisitor:
         for version in versions.values():
             self.processVersion(version)
 
+    def processExtension(self, extension):
+        self.processFragment(extension)
+
+    def processExtensions(self, extensions):
+        for extension in extensions.values():
+            self.processExtension(extension)
+
     def finishCurrentFile(self):
-        if self.out is not None:
-            self.out.close()
         self.out = None
 
     def ensureFolderExists(self, path):
-        if not os.path.isdir(path):
-            if os.path.exists(path):
-                raise Exception("Cannot create directory " + path)
-            os.mkdir(path)
+        self.outputFiles.ensureDirectory(path)
 
     def ensureCategoryFolder(self, category):
         folderName = os.path.join(self.outputDirectory, category)
@@ -189,8 +604,8 @@ class MakePharoBindingsVisitor:
 
     def beginFileInCategory(self, category, fileName):
         folder = self.ensureCategoryFolder(category)
-        self.out = open(os.path.join(folder, fileName), "w")
-        self.outFileName = fileName
+        self.out = self.outputFiles.create(os.path.join(folder, fileName))
+        return self.out
 
     def emitPackageFile(self, package):
         self.beginFileInCategory(package, 'package.st')
@@ -198,27 +613,32 @@ class MakePharoBindingsVisitor:
 
     def beginClassFile(self, category, className):
         self.finishCurrentFile()
-        self.beginFileInCategory(category, className + '.class.st')
+        self.classFiles[(category, className, False)] = self.beginFileInCategory(category, className + '.class.st')
+
+    def isClassFileUpToDate(self, category, className, nodeKey):
+        # Class files that only depend on a single node are skipped when that
+        # node is unchanged since the last run recorded in the manifest.
+        fileName = os.path.join(self.outputDirectory, category, className + '.class.st')
+        if self.manifest.isOutputUpToDate(fileName, [nodeKey]):
+            self.upToDateClasses.add(className)
+            self.outputFiles.keepUnchanged([fileName])
+            return True
+        return False
 
     def beginClassFileAppending(self, category, className, isExtension=False):
-        folder = self.ensureCategoryFolder(category)
-        if isExtension:
-            fileName = os.path.join(folder, className + '.extension.st')
-        else:
-            fileName = os.path.join(folder, className + '.class.st')
-
-        if self.outFileName != fileName:
-            self.finishCurrentFile()
-            if isExtension and (className not in self.startedExtensions):
-                self.out = open(fileName, "w")
+        # The content of each class and extension file stays in memory keyed
+        # by class, so switching between classes does not touch the disk.
+        key = (category, className, isExtension)
+        out = self.classFiles.get(key)
+        if out is None:
+            folder = self.ensureCategoryFolder(category)
+            if isExtension:
+                out = self.outputFiles.create(os.path.join(folder, className + '.extension.st'))
+                out.write(self.processText('Extension { #name : #$ClassName }\n\n', ClassName=className))
             else:
-                self.out = open(fileName, "a")
-            self.outFileName = fileName
-
-            if isExtension and (className not in self.startedExtensions):
-                self.printLine('Extension { #name : #$ClassName }', ClassName=className)
-                self.newline()
-                self.startedExtensions.add(className)
+                out = self.outputFiles.open(os.path.join(folder, className + '.class.st'))
+            self.classFiles[key] = out
+        self.out = out
 
     def emitTonelStringList(self, varName, stringList):
         if len(stringList) == 0:
@@ -234,8 +654,10 @@ class MakePharoBindingsVisitor:
             i += 1
         self.printLine("\t],")
 
-    def emitSubclass(self, baseClass, className, instanceVariableNames=[], classVariableNames=[], poolDictionaries=[]):
-        self.beginClassFile(self.generatedCodeCategory, className)
+    def emitSubclass(self, baseClass, className, instanceVariableNames=[], classVariableNames=[], poolDictionaries=[], category=None):
+        if category is None:
+            category = self.generatedCodeCategory
+        self.beginClassFile(category, className)
 
         self.printLine('Class {')
         self.printLine('\t#name : #$ClassName,', ClassName=className)
@@ -243,7 +665,7 @@ class MakePharoBindingsVisitor:
         self.emitTonelStringList('classVars', classVariableNames)
         self.emitTonelStringList('pools', poolDictionaries)
         self.printLine('\t#superclass : #$BaseClass,', BaseClass=baseClass)
-        self.printLine("\t#category : '$Category'", Category=self.generatedCodeCategory)
+        self.printLine("\t#category : '$Category'", Category=category)
         self.printLine('}')
         self.newline()
 
@@ -255,6 +677,9 @@ class MakePharoBindingsVisitor:
         self.printLine('"')
         self.printLine('\tsuper initialize.')
         self.newline()
+        if self.directConstants:
+            self.emitDirectConstantsInitializers()
+            return
         if self.forSqueak:
              self.printString(
 """
@@ -274,35 +699,32 @@ class MakePharoBindingsVisitor:
         self.beginMethod(self.constantsClassName + ' class', 'initialization', 'data')
         self.printLine('\t^ #(')
         for constantName in self.constants.keys():
-            constantValue = self.constants[constantName]
-            if constantValue.startswith('0x'):
-                constantValue = '16r' + constantValue[2:]
-            self.printLine("\t\t$ConstantName $ConstantValue", ConstantName=constantName, ConstantValue=constantValue)
+            self.printLine("\t\t$ConstantName $ConstantValue", ConstantName=constantName, ConstantValue=self.makeConstantLiteral(constantName))
         self.printLine('\t)')
         self.endMethod()
 
-    def isValidIdentCharacter(self, character):
-        return ('a' <= character and character <= 'z') or \
-               ('A' <= character and character <= 'Z') or \
-               ('0' <= character and character <= '9') or \
-               character == '_'
-
-    def makeFullTypeName(self, rawTypeName):
-        baseTypeNameSize = 0
-        for i in range(len(rawTypeName)):
-            if self.isValidIdentCharacter(rawTypeName[i]):
-                baseTypeNameSize = i + 1
-            else:
-                break
+    def emitDirectConstantsInitializers(self):
+        constantNames = list(self.constants.keys())
+        chunks = [constantNames[i:i + ConstantsPerInitializer] for i in range(0, len(constantNames), ConstantsPerInitializer)]
+        for chunkIndex in range(len(chunks)):
+            self.printLine('\tself initializeConstants$Index.', Index=str(chunkIndex + 1))
+        self.endMethod()
+
+        for chunkIndex, chunk in enumerate(chunks):
+            self.beginMethod(self.constantsClassName + ' class', 'initialization', 'initializeConstants' + str(chunkIndex + 1))
+            for constantName in chunk:
+                self.printLine('\t$ConstantName := $ConstantValue.', ConstantName=constantName, ConstantValue=self.makeConstantLiteral(constantName))
+            self.endMethod()
 
-        baseTypeName = rawTypeName[0:baseTypeNameSize]
-        typeDecorators = rawTypeName[baseTypeNameSize:]
-        mappedBaseType = self.typeBindings[baseTypeName]
-        #print "'%s' %d '%s' '%s' -> '%s'" % (rawTypeName, baseTypeNameSize, baseTypeName, typeDecorators, mappedBaseType);
-        return mappedBaseType + typeDecorators
+    def makeConstantLiteral(self, constantName):
+        constantValue = self.constants[constantName]
+        if constantValue.startswith('0x'):
+            constantValue = '16r' + constantValue[2:]
+        return constantValue
 
     def makeFullTypeNameWithPrefix(self, rawTypeName):
-        return self.makeFullTypeName(self.api.typePrefix + rawTypeName)
+        descriptor = self.index.getTypeDescriptor(rawTypeName)
+        return self.typeBindings[descriptor.prefixedBaseName] + descriptor.decorators
 
     def makeFullReturnTypeNameWithPrefix(self, rawTypeName):
         if rawTypeName == 'cstring':
@@ -323,27 +745,75 @@ class MakePharoBindingsVisitor:
 
         for ctypeName in self.typeBindings.keys():
             pharoName = self.typeBindings[ctypeName]
-            self.printLine('\t$CTypeName := $PharoName.', CTypeName=ctypeName, PharoName=pharoName)
+            if self.splitPackages and pharoName in self.aggregateClassNames:
+                # The structure may be in a package that is not loaded.
+                self.printLine('\t$CTypeName := Smalltalk at: #$PharoName ifAbsent: [ nil ].', CTypeName=ctypeName, PharoName=pharoName)
+            else:
+                self.printLine('\t$CTypeName := $PharoName.', CTypeName=ctypeName, PharoName=pharoName)
         self.endMethod()
 
     def emitCBindings(self, api):
         self.emitSubclass(self.cbindingsBaseClassName, self.cbindingsClassName, [], [], self.bindingsPoolDictionaries)
+        if self.commandLists:
+            self.emitExecuteCommandListBinding()
+
+        for fragment in self.index.fragments:
+            package = self.fragmentPackages[fragment]
+            if self.splitPackages:
+                self.beginClassFileAppending(package, self.cbindingsClassName, True)
 
-        for version in api.versions.values():
             # Emit the methods of the interfaces.
-            for interface in version.interfaces:
-                self.emitInterfaceCBindings(interface)
+            for interface in fragment.interfaces:
+                self.emitInterfaceCBindings(interface, package)
 
             # Emit the global c functions
-            self.emitCGlobals(version.globals)
+            self.emitCGlobals(fragment.globals, package)
+
+    def emitExecuteCommandListBinding(self):
+        self.beginCalloutMethod('command lists', 'executeCommandList_size: size commands: commands')
+        if self.forSqueak:
+            self.printLine("\t<cdecl: $ReturnType '${FunctionPrefix}ExecuteCommandList' (ulong byte*)>", ReturnType=self.makeFullReturnTypeNameWithPrefix('error'))
+            self.printLine("\t^ self externalCallFailed")
+        else:
+            self.printLine("\t^ self ffiCall: #(${TypePrefix}error ${FunctionPrefix}ExecuteCommandList (uint size , void* commands) )")
+        self.endMethod()
 
-    def emitInterfaceCBindings(self, interface):
+    def emitInterfaceCBindings(self, interface, package):
+        category = interface.name
+        if self.splitPackages:
+            category = '*' + package
         for method in interface.methods:
-            self.emitCMethodBinding(method, interface.name)
+            self.emitCMethodBinding(method, category)
+        for method in getVectorizedMethods(self.index, interface):
+            self.emitCArrayMethodBinding(method, category)
+
+    def emitCArrayMethodBinding(self, method, category):
+        arrayNames = [ObjectsArgumentName] + [arg.name for arg in method.arguments]
+        selector = method.name + 'Array_' + CountArgumentName + ': ' + CountArgumentName
+        for name in arrayNames:
+            selector += ' ' + name + ': ' + name
+
+        self.beginCalloutMethod(category, selector)
+        if self.forSqueak:
+            self.printLine("\t<cdecl: $ReturnType '$FunctionPrefix$FunctionName' (ulong$Arrays)>",
+                ReturnType=self.makeFullReturnTypeNameWithPrefix(method.returnType),
+                FunctionName=getArrayFunctionName(method),
+                Arrays=' byte*' * len(arrayNames))
+            self.printLine("\t^ self externalCallFailed")
+        else:
+            self.printLine("\t^ self ffiCall: #($TypePrefix$ReturnType $FunctionPrefix$FunctionName (uint $Count$Arrays) )",
+                ReturnType=method.returnType,
+                FunctionName=getArrayFunctionName(method),
+                Count=CountArgumentName,
+                Arrays=''.join(' , void* ' + name for name in arrayNames))
+        self.endMethod()
 
-    def emitCGlobals(self, globals):
+    def emitCGlobals(self, globals, package):
+        category = 'global c functions'
+        if self.splitPackages:
+            category = '*' + package
         for method in globals:
-            self.emitCMethodBinding(method, 'global c functions')
+            self.emitCMethodBinding(method, category)
 
     def emitCMethodBinding(self, method, category):
 
@@ -365,7 +835,7 @@ class MakePharoBindingsVisitor:
                 name = 'selfObject'
             selector += name + ': ' + name
 
-        self.beginMethod(self.cbindingsClassName, category, selector)
+        self.beginCalloutMethod(category, selector)
         if self.forSqueak:
            self.printString("\t<cdecl: $ReturnType '$FunctionPrefix$FunctionName' (",
                 ReturnType=self.makeFullReturnTypeNameWithPrefix(method.returnType),
@@ -404,20 +874,26 @@ class MakePharoBindingsVisitor:
         self.endMethod()
 
     def emitInterfaceClasses(self, api):
-        for version in api.versions.values():
-            for interface in version.interfaces:
-                pharoName = self.namespacePrefix + convertToCamelCase(interface.name)
-                self.emitSubclass(self.interfaceBaseClassName, pharoName)
-
-    def emitAggregate(self, aggregate):
+        for fragment in self.index.fragments:
+            package = self.fragmentPackages[fragment]
+            for interface in fragment.interfaces:
+                pharoName = self.namespacePrefix + self.index.camelCaseName(interface.name)
+                if not self.isClassFileUpToDate(package, pharoName, 'interface:' + interface.name):
+                    self.emitSubclass(self.interfaceBaseClassName, pharoName, category=package)
+
+    def emitAggregate(self, aggregate, package):
         cname = self.processText("$TypePrefix$AggregateName", AggregateName=aggregate.name)
-        pharoName = self.namespacePrefix + convertToCamelCase(aggregate.name)
+        pharoName = self.namespacePrefix + self.index.camelCaseName(aggregate.name)
         self.typeBindings[cname] = pharoName
+        self.aggregateClassNames.add(pharoName)
+        if self.isClassFileUpToDate(package, pharoName, 'aggregate:' + aggregate.name):
+            return
+
         superClass = self.externalStructureSuperClass
         if aggregate.isUnion():
             superClass = self.externalUnionSuperClass
 
-        self.emitSubclass(superClass, pharoName, [], [], self.bindingsPoolDictionaries)
+        self.emitSubclass(superClass, pharoName, [], [], self.bindingsPoolDictionaries, package)
 
         if self.forSqueak:
             self.beginMethod(pharoName + ' class', 'definition', 'fields')
@@ -441,10 +917,67 @@ class MakePharoBindingsVisitor:
         self.printLine("\t)")
         self.endMethod()
 
+        if self.precomputedLayouts:
+            self.emitFieldAccessors(aggregate, pharoName)
+
+    def emitFieldAccessors(self, aggregate, pharoName):
+        abiLayouts = dict((abi, engine.getAggregateLayout(aggregate)) for abi, engine in self.layoutEngines.items())
+        for fieldIndex, field in enumerate(aggregate.fields):
+            abiFields = dict((abi, layout.fields[fieldIndex]) for abi, layout in abiLayouts.items())
+            self.beginMethod(pharoName, 'accessing', field.name)
+            self.emitAbiStatements(dict((abi, '^ ' + self.makeFieldGetter(field, fieldLayout)) for abi, fieldLayout in abiFields.items()))
+            self.endMethod()
+
+            self.beginMethod(pharoName, 'accessing', field.name + ': anObject')
+            self.emitAbiStatements(dict((abi, self.makeFieldSetter(field, fieldLayout)) for abi, fieldLayout in abiFields.items()), '. ^ self')
+            self.endMethod()
+
+    def emitAbiStatements(self, abiStatements, branchReturn = ''):
+        # The statement of each ABI, with literal offsets. The image selects
+        # the 32 bits ABIs by its word size, and then ILP32 on Windows and ARM,
+        # or i386 System V on the other platforms. LLP64 is selected by the platform.
+        defaultStatement = abiStatements['LP64']
+        if abiStatements['ILP32'] == abiStatements['I386']:
+            if abiStatements['ILP32'] != defaultStatement:
+                self.printLine('\tSmalltalk wordSize = 4 ifTrue: [ $Statement$Return ].', Statement=abiStatements['ILP32'], Return=branchReturn)
+        else:
+            self.printLine('\tSmalltalk wordSize = 4 ifTrue: [ $Condition ifTrue: [ $Ilp32Statement$Return ]. $I386Statement$Return ].',
+                Condition=self.isIlp32Condition, Ilp32Statement=abiStatements['ILP32'], I386Statement=abiStatements['I386'], Return=branchReturn)
+        if abiStatements['LLP64'] != defaultStatement:
+            self.printLine('\t$Condition ifTrue: [ $Statement$Return ].', Condition=self.isWindowsCondition, Statement=abiStatements['LLP64'], Return=branchReturn)
+        self.printLine('\t$Statement', Statement=defaultStatement)
+
+    def getFieldAccessorSelector(self, fieldLayout):
+        if fieldLayout.kind == 'pointer':
+            return 'pointerAt:'
+        elif fieldLayout.kind in ('float', 'double'):
+            return fieldLayout.kind + 'At:'
+
+        integerType = {1: 'Byte', 2: 'Short', 4: 'Long', 8: 'LongLong'}[fieldLayout.size]
+        if fieldLayout.signed:
+            return 'signed' + integerType + 'At:'
+        return 'unsigned' + integerType + 'At:'
+
+    def makeFieldGetter(self, field, fieldLayout):
+        offset = str(fieldLayout.offset + 1)
+        if fieldLayout.kind == 'aggregate':
+            structAt = 'structAt:'
+            if not self.forSqueak:
+                structAt = 'referenceStructAt:'
+            return self.processText('$Type fromHandle: (handle $StructAt $Offset length: $Size)',
+                Type=self.makeFullTypeNameWithPrefix(field.type), StructAt=structAt, Offset=offset, Size=str(fieldLayout.size))
+        return self.processText('handle $Selector $Offset', Selector=self.getFieldAccessorSelector(fieldLayout), Offset=offset)
+
+    def makeFieldSetter(self, field, fieldLayout):
+        offset = str(fieldLayout.offset + 1)
+        if fieldLayout.kind == 'aggregate':
+            return self.processText('handle structAt: $Offset put: anObject getHandle length: $Size', Offset=offset, Size=str(fieldLayout.size))
+        return self.processText('handle $Selector $Offset put: anObject', Selector=self.getFieldAccessorSelector(fieldLayout), Offset=offset)
+
     def emitAggregates(self, api):
-        for version in api.versions.values():
-            for struct in version.agreggates:
-                self.emitAggregate(struct)
+        for fragment in self.index.fragments:
+            for struct in fragment.agreggates:
+                self.emitAggregate(struct, self.fragmentPackages[fragment])
 
     def emitPoolInitializations(self, api, doItClassName):
         self.beginMethod(doItClassName + ' class', 'initialization', 'initializeConstants')
@@ -457,13 +990,21 @@ class MakePharoBindingsVisitor:
     def emitAggregatesInitializations(self, api, doItClassName):
         self.beginMethod(doItClassName + ' class', 'initialization', 'initializeStructures')
         self.printLine("\t<script>")
-        for version in api.versions.values():
-            for struct in version.agreggates:
-                pharoName = self.namespacePrefix + convertToCamelCase(struct.name)
-                if self.forSqueak:
-                    self.printLine('\t$Structure defineFields.', Structure=pharoName)
+        initializeSelector = 'rebuildFieldAccessors'
+        if self.forSqueak:
+            initializeSelector = 'defineFields'
+        if self.precomputedLayouts:
+            # Squeak still needs the compiled spec of the fields for passing the structures.
+            initializeSelector = 'compileFields'
+        for fragment in self.index.fragments:
+            if self.precomputedLayouts and not self.forSqueak:
+                break
+            for struct in fragment.agreggates:
+                pharoName = self.namespacePrefix + self.index.camelCaseName(struct.name)
+                if self.splitPackages:
+                    self.printLine('\tSmalltalk at: #$Structure ifPresent: [ :structure | structure $Selector ].', Structure=pharoName, Selector=initializeSelector)
                 else:
-                    self.printLine('\t$Structure rebuildFieldAccessors.', Structure=pharoName)
+                    self.printLine('\t$Structure $Selector.', Structure=pharoName, Selector=initializeSelector)
         self.endMethod()
 
     def emitBindingsInitializations(self, api, doItClassName):
@@ -471,52 +1012,331 @@ class MakePharoBindingsVisitor:
         self.printLine("\t<script>")
         self.printLine("\tself initializeConstants.")
         self.printLine("\tself initializeStructures.")
+        if self.warmUpBindings:
+            self.printLine("\tSessionManager default registerUserClassNamed: self name.")
+            self.printLine("\tself warmUpBindingsInBackground.")
         self.endMethod()
 
+    def emitWrapperSwitch(self, doItClassName):
+        entries = []
+        for fragment in self.index.fragments:
+            for interface in fragment.interfaces:
+                for method in interface.methods:
+                    entries.append(self.makeWrapperSwitchEntry(method))
+            for method in fragment.globals:
+                if self.hasUncheckedWrapper(method):
+                    entries.append(self.makeWrapperSwitchEntry(method))
+
+        self.beginMethod(doItClassName + ' class', 'unchecked wrappers', 'uncheckedWrappers')
+        self.printLine('\t"The class, the wrapper selector and the unchecked wrapper selector."')
+        self.printLine('\t^ #(')
+        for entry in entries:
+            self.printLine('\t\t$Entry', Entry=entry)
+        self.printLine('\t)')
+        self.endMethod()
+        self.printString(WRAPPER_SWITCH_METHODS, ClassName=doItClassName)
+
+    def makeWrapperSwitchEntry(self, method):
+        return self.makeSymbolArray([self.getWrapperOwnerClass(method), self.getWrapperSelector(method), self.getWrapperSelector(method, True)])
+
+    def emitWarmUp(self, doItClassName):
+        self.printString(WARM_UP_METHODS, ClassName=doItClassName, CBindingsClass=self.cbindingsClassName,
+            Selectors=self.makeSymbolArray(self.calloutSelectors))
+
     def emitDoIts(self, api, doItClassName):
         self.emitSubclass('Object', doItClassName)
         self.emitPoolInitializations(api, doItClassName)
         self.emitAggregatesInitializations(api, doItClassName)
         self.emitBindingsInitializations(api, doItClassName)
+        if self.warmUpBindings:
+            self.emitWarmUp(doItClassName)
+        if self.uncheckedWrappers:
+            self.emitWrapperSwitch(doItClassName)
 
     def emitBaseClasses(self, api):
         self.emitPackageFile(self.generatedCodeCategory)
+        if self.splitPackages:
+            self.emitFragmentPackages(api)
+            self.emitBaseline(api)
         self.emitConstants()
         self.emitInterfaceClasses(api)
         self.emitAggregates(api)
         self.emitTypeBindings()
         self.emitCBindings(api)
         self.emitPharoBindings(api)
+        if self.commandLists:
+            self.emitCommandList(api)
+        if self.wrapperRegistry:
+            self.emitWrapperRegistry()
+        if self.handleArrays:
+            self.emitHandleArrays()
 
-        self.emitDoIts(api, self.namespacePrefix + 'GeneratedDoIt')
+        self.emitDoIts(api, self.generatedDoItClassName)
+
+    def emitWrapperRegistry(self):
+        self.emitSubclass('Object', self.wrapperRegistryClassName, ['wrappers_', 'mutex_', 'hits_', 'misses_', 'addedSincePurge_', 'purgeThreshold_'], ['UniqueInstance'])
+        self.printString(WRAPPER_REGISTRY_METHODS, ClassName=self.wrapperRegistryClassName)
+
+    def emitHandleArrays(self):
+        newBuffer = '^ ByteArray newPinned: byteSize'
+        if self.forSqueak:
+            newBuffer = '^ (ByteArray new: byteSize) pin; yourself'
+        forHandle = 'forHandle:'
+        if self.wrapperRegistry:
+            forHandle = 'forOwnedHandle:'
+
+        self.emitSubclass('ProcessLocalVariable', self.handleBuffersVariableClassName)
+        self.emitSubclass('Object', self.handleBuffersClassName, ['free_', 'leased_'])
+        self.printString(HANDLE_BUFFERS_METHODS, ClassName=self.handleBuffersClassName, VariableClass=self.handleBuffersVariableClassName,
+            HandleArrayClass=self.handleArrayClassName, NewBuffer=newBuffer)
+        self.emitSubclass('SequenceableCollection', self.handleArrayClassName, ['buffer_', 'size_', 'elementClass_', 'wrappers_'])
+        self.printString(HANDLE_ARRAY_METHODS, ClassName=self.handleArrayClassName, HandleBuffersClass=self.handleBuffersClassName, ForHandle=forHandle)
+
+    def isHandleArrayArgument(self, arg):
+        if not self.handleArrays or not (arg.pointerList or arg.arrayReturn):
+            return False
+        return self.index.getTypeDescriptor(arg.type).isInterfacePointerReference
+
+    def emitReleaseHandle(self, interface, package):
+        # Lets the handle arrays release the handles that were never wrapped.
+        ownerClass = self.namespacePrefix + self.index.camelCaseName(interface.name)
+        self.beginClassFileAppending(package, ownerClass, False)
+        self.beginMethod(ownerClass + ' class', 'handle arrays', 'releaseHandle: aHandle')
+        self.printLine('	$CBindingsClass uniqueInstance release_$Name: aHandle', CBindingsClass=self.cbindingsClassName, Name=interface.name)
+        self.endMethod()
+
+    def emitForOwnedHandle(self, interface, package):
+        ownerClass = self.namespacePrefix + self.index.camelCaseName(interface.name)
+        self.beginClassFileAppending(package, ownerClass, False)
+        self.beginMethod(ownerClass + ' class', 'wrapper registry', 'forOwnedHandle: aHandle')
+        if interface.hasMethod('release'):
+            self.printLine('\t^ $Registry uniqueInstance wrapperOf: aHandle for: self ifReused: [ $CBindingsClass uniqueInstance release_$Name: aHandle ]',
+                Registry=self.wrapperRegistryClassName, CBindingsClass=self.cbindingsClassName, Name=interface.name)
+        else:
+            self.printLine('\t^ $Registry uniqueInstance wrapperOf: aHandle for: self ifReused: [ ]', Registry=self.wrapperRegistryClassName)
+        self.endMethod()
+
+    def emitCommandList(self, api):
+        # Records the commands into a buffer, which is executed with a single call.
+        self.emitSubclass('Object', self.commandListClassName, ['buffer_', 'size_'])
+        self.printString(COMMAND_LIST_METHODS, ClassName=self.commandListClassName, CBindingsClass=self.cbindingsClassName)
+        for fragment, commands in getFragmentCommands(api):
+            package = self.fragmentPackages[fragment]
+            category = 'commands'
+            if self.splitPackages:
+                self.beginClassFileAppending(package, self.commandListClassName, True)
+                category = '*' + package
+            for command in commands:
+                self.emitCommandRecorder(command, category)
+
+    def emitCommandRecorder(self, command, category):
+        method = command.method
+        allArguments = [SelfArgument(method.clazz)] + method.arguments
+        argumentNames = []
+        for arg in allArguments:
+            name = arg.name
+            if name == 'self':
+                name = 'selfObject'
+            argumentNames.append(name)
+
+        selector = command.getSelectorName() + ': ' + argumentNames[0]
+        for arg, name in zip(method.arguments, argumentNames[1:]):
+            selector += ' ' + arg.name + ': ' + name
+
+        self.beginMethod(self.commandListClassName, category, selector)
+        self.printLine('\t| offset_ |')
+        self.printLine('\toffset_ := self beginCommand: $Opcode size: $Size.', Opcode=str(command.opcode), Size=str(command.size))
+        for argumentIndex, (name, kind) in enumerate(zip(argumentNames, command.argumentKinds)):
+            offset = 'offset_'
+            if argumentIndex > 0:
+                offset = 'offset_ + ' + str(command.getArgumentOffset(argumentIndex))
+            self.printLine('\tself $Kind: $Offset put: $Name.', Kind=kind + 'At', Offset=offset, Name=name)
+        self.endMethod()
+
+    def emitFragmentPackages(self, api):
+        for fragment in self.index.fragments:
+            self.emitPackageFile(self.fragmentPackages[fragment])
+
+    def emitBaseline(self, api):
+        self.emitPackageFile(self.baselineClassName)
+        self.emitSubclass('BaselineOf', self.baselineClassName, category=self.baselineClassName)
+
+        versionPackages = [self.fragmentPackages[version] for version in api.versions.values()]
+        extensionPackages = [self.fragmentPackages[extension] for extension in api.extensions.values()]
+        self.beginMethod(self.baselineClassName, 'baselines', 'baseline: spec')
+        self.printLine('\t<baseline>')
+        self.printLine("\tspec for: #'common' do: [")
+        self.printLine("\t\tspec postLoadDoIt: #initializeBindings.")
+        self.printLine("\t\tspec package: #'$Package'.", Package=self.generatedCodeCategory)
+
+        # Each version requires the previous ones, and the extensions require every version.
+        requiredPackages = [self.generatedCodeCategory]
+        for package in versionPackages:
+            self.emitBaselinePackage(package, requiredPackages)
+            requiredPackages = requiredPackages + [package]
+        for package in extensionPackages:
+            self.emitBaselinePackage(package, requiredPackages)
+
+        self.printLine("\t\tspec group: 'Core' with: $Packages.", Packages=self.makeSymbolArray(requiredPackages))
+        self.printLine("\t\tspec group: 'default' with: #('Core').")
+        self.printLine("\t\tspec group: 'All' with: #('Core'$Packages).", Packages=''.join(" #'" + package + "'" for package in extensionPackages))
+        self.printLine('\t].')
+        self.endMethod()
+
+        self.beginMethod(self.baselineClassName, 'actions', 'initializeBindings')
+        self.printLine('\t(Smalltalk at: #$DoIt) initializeBindings', DoIt=self.generatedDoItClassName)
+        self.endMethod()
+
+    def emitBaselinePackage(self, package, requiredPackages):
+        self.printLine("\t\tspec")
+        self.printLine("\t\t\tpackage: #'$Package' with: [", Package=package)
+        self.printLine("\t\t\t\tspec requires: $Packages. ].", Packages=self.makeSymbolArray(requiredPackages))
+
+    def makeSymbolArray(self, names):
+        return '#(' + ' '.join("#'" + name + "'" for name in names) + ')'
 
     def emitPharoBindings(self, api):
-        for version in api.versions.values():
-            for interface in version.interfaces:
-                self.emitInterfaceBindings(interface)
-            self.emitGlobals(version.globals)
+        for fragment in self.index.fragments:
+            package = self.fragmentPackages[fragment]
+            for interface in fragment.interfaces:
+                self.emitInterfaceBindings(interface, package)
+            self.emitGlobals(fragment.globals, package)
+
+    def emitInterfaceBindings(self, interface, package):
+        if self.namespacePrefix + self.index.camelCaseName(interface.name) in self.upToDateClasses:
+            return
 
-    def emitInterfaceBindings(self, interface):
+        if self.wrapperRegistry:
+            self.emitForOwnedHandle(interface, package)
+        if self.handleArrays and interface.hasMethod('release'):
+            self.emitReleaseHandle(interface, package)
         for method in interface.methods:
-            self.emitMethodWrapper(method)
+            self.emitMethodWrapper(method, package)
+            if self.hasUncheckedWrapper(method):
+                self.emitMethodWrapper(method, package, True)
+        for method in getVectorizedMethods(self.index, interface):
+            self.emitBulkMethodWrapper(method, package)
+
+    def emitBulkMethodWrapper(self, method, package):
+        # Class side wrapper that calls the method for each object of a
+        # collection with a single call, taking the arguments from collections.
+        ownerClass = self.namespacePrefix + self.index.camelCaseName(method.clazz.name)
+        methodName = 'bulk' + method.name[0].upper() + method.name[1:] + ': ' + ObjectsArgumentName
+        for arg in method.arguments:
+            methodName += ' ' + arg.name + ': ' + arg.name
+
+        self.beginClassFileAppending(package, ownerClass, False)
+        self.beginMethod(ownerClass + ' class', 'bulk wrappers', methodName)
+        arrays = [(ObjectsArgumentName, 'handle', None, False)]
+        for arg in method.arguments:
+            kind, size, signed = getArrayElementLayout(self.index, arg.type)
+            arrays.append((arg.name, kind, size, signed))
+
+        temporaries = ['count_'] + [name + '_' for name, kind, size, signed in arrays]
+        if method.returnType == 'error':
+            temporaries.insert(1, 'resultValue_')
+        usesLongSize = any(size == LongSize for name, kind, size, signed in arrays)
+        if usesLongSize:
+            temporaries.append('longSize_')
+        self.printLine('\t| $Temporaries |', Temporaries=' '.join(temporaries))
+        self.printLine('\tcount_ := $Objects size.', Objects=ObjectsArgumentName)
+        if usesLongSize:
+            self.printLine('\tlongSize_ := ($IsWindows or: [ Smalltalk wordSize = 4 ]) ifTrue: [ 4 ] ifFalse: [ 8 ].', IsWindows=self.isWindowsCondition)
+        for name, kind, size, signed in arrays:
+            self.printLine('\t${Name}_ := ByteArray new: count_ * $Size.', Name=name, Size=self.getArrayElementSizeExpression(size))
+        self.printLine('\t1 to: count_ do: [ :i_ |')
+        for name, kind, size, signed in arrays:
+            if kind == 'integer' and size in (LongSize, PointerSize):
+                # The integers with a platform size are written with their size at run time.
+                self.printLine('\t\t${Name}_ integerAt: i_ - 1 * $Size + 1 put: $Value size: $Size signed: $Signed.',
+                    Name=name, Size=self.getArrayElementSizeExpression(size), Value=self.getArrayElementValue(name, kind), Signed=str(signed).lower())
+            else:
+                self.printLine('\t\t${Name}_ $Writer i_ - 1 * $Size + 1 put: $Value.',
+                    Name=name, Writer=self.getArrayElementWriter(kind, size, signed), Size=self.getArrayElementSizeExpression(size),
+                    Value=self.getArrayElementValue(name, kind))
+        self.printLine('\t].')
+        self.printString('\t')
+        if method.returnType == 'error':
+            self.printString('resultValue_ := ')
+        self.printString('$CBindingsClass uniqueInstance $MethodName', CBindingsClass=self.cbindingsClassName, MethodName=method.name)
+        self.printString('Array_$Count: count_', Count=CountArgumentName)
+        for name, kind, size, signed in arrays:
+            self.printString(' $Name: ${Name}_', Name=name)
+        self.printLine('.')
+        if method.returnType == 'error':
+            self.printLine('\tresultValue_ < 0 ifTrue: [ ($Objects at: 1) checkErrorCode: resultValue_ ]', Objects=ObjectsArgumentName)
+        self.endMethod()
 
-    def emitGlobals(self, globals):
+    def getArrayElementSizeExpression(self, size):
+        if size is None or size == PointerSize:
+            return '(Smalltalk wordSize)'
+        if size == LongSize:
+            return 'longSize_'
+        return str(size)
+
+    def getArrayElementWriter(self, kind, size, signed):
+        if kind == 'handle':
+            return 'pointerAt:'
+        elif kind == 'float':
+            return 'floatAt:'
+        elif kind == 'double':
+            return 'doubleAt:'
+
+        integerType = {1: 'Byte', 2: 'Short', 4: 'Long', 8: 'LongLong'}[size]
+        if signed:
+            return 'signed' + integerType + 'At:'
+        return 'unsigned' + integerType + 'At:'
+
+    def getArrayElementValue(self, name, kind):
+        if kind == 'handle':
+            return self.processText('($Name at: i_) validHandle', Name=name)
+        elif kind in ('float', 'double'):
+            return self.processText('($Name at: i_) asFloat', Name=name)
+        return self.processText('($Name at: i_)', Name=name)
+
+    def emitGlobals(self, globals, package):
         for method in globals:
-            self.emitMethodWrapper(method)
+            self.emitMethodWrapper(method, package)
+            if self.hasUncheckedWrapper(method):
+                self.emitMethodWrapper(method, package, True)
+
+    def hasUncheckedWrapper(self, method):
+        if not self.uncheckedWrappers:
+            return False
+        return method.clazz is not None or any(arg.type in self.interfaceTypeMap for arg in method.arguments)
 
-    def emitMethodWrapper(self, method):
-        ownerClass = self.namespacePrefix
+    def getWrapperOwnerClass(self, method):
+        if method.clazz is None:
+            return self.namespacePrefix
+        return self.namespacePrefix + self.index.camelCaseName(method.clazz.name)
+
+    def getWrapperMethodName(self, method, unchecked = False):
+        methodName = method.name
+        if methodName == 'release':
+            methodName = 'primitiveRelease'
+        if unchecked:
+            methodName = 'unsafe' + methodName[0].upper() + methodName[1:]
+        return methodName
+
+    def getWrapperSelector(self, method, unchecked = False):
+        selector = self.getWrapperMethodName(method, unchecked)
+        if len(method.arguments) > 0:
+            selector += ':' + ''.join(arg.name + ':' for arg in method.arguments[1:])
+        return selector
+
+    def emitMethodWrapper(self, method, package, unchecked = False):
+        # The unchecked variants pass the handles without validating them.
+        ownerClass = self.getWrapperOwnerClass(method)
         clazz = method.clazz
         allArguments = method.arguments
-        category = '*' + self.generatedCodeCategory
+        category = '*' + package
         if clazz is not None:
-            ownerClass = self.namespacePrefix + convertToCamelCase(clazz.name)
             allArguments = [SelfArgument(method.clazz)] + allArguments
             category = 'wrappers'
+            if unchecked:
+                category = 'unchecked wrappers'
 
-        methodName = method.name
-        if methodName == 'release':
-            methodName = 'primitiveRelease'
+        methodName = self.getWrapperMethodName(method, unchecked)
 
         # Build the method selector.
         first = True
@@ -528,13 +1348,34 @@ class MakePharoBindingsVisitor:
             else:
                 methodName += " " + name + ": " + name
 
-        self.beginMethodAppendingFile(ownerClass, category, methodName)
+        self.beginMethodAppendingFile(package, ownerClass, category, methodName)
 
         # Temporal variable for the return value
-        self.printLine("\t| resultValue_ |")
+        # The input handles are written into scratch buffers, which are
+        # released after the call. The results are written into handle arrays.
+        handleArrayArguments = [arg.name for arg in method.arguments if self.isHandleArrayArgument(arg)]
+        scratchArguments = [arg.name for arg in method.arguments if self.isHandleArrayArgument(arg) and not arg.arrayReturn]
+        if len(handleArrayArguments) == 0:
+            self.printLine("\t| resultValue_ |")
+        else:
+            self.printLine("\t| resultValue_ handleBuffers_ $Buffers |", Buffers=' '.join(name + '_' for name in handleArrayArguments))
+            self.printLine("\thandleBuffers_ := $HandleBuffersClass current.", HandleBuffersClass=self.handleBuffersClassName)
+            for arg in method.arguments:
+                if arg.name in scratchArguments:
+                    self.printLine("\t${ArgName}_ := handleBuffers_ handlesOf: $ArgName.", ArgName=arg.name)
+                elif arg.name in handleArrayArguments:
+                    self.printLine("\t${ArgName}_ := handleBuffers_ resultHandlesOf: $ArgName.", ArgName=arg.name)
+
+        # The handle may belong to another object after being released.
+        if self.wrapperRegistry and clazz is not None and method.name == 'release':
+            self.printLine("\t$Registry uniqueInstance forget: self handle: (self handle).", Registry=self.wrapperRegistryClassName)
 
         # Call the c bindings.
-        self.printString("\tresultValue_ := $CBindingsClass uniqueInstance $MethodName", CBindingsClass=self.cbindingsClassName, MethodName=method.name)
+        if len(scratchArguments) != 0:
+            self.printString("\tresultValue_ := [ ")
+        else:
+            self.printString("\tresultValue_ := ")
+        self.printString("$CBindingsClass uniqueInstance $MethodName", CBindingsClass=self.cbindingsClassName, MethodName=method.name)
         first = True
         for arg in allArguments:
             name = arg.name
@@ -542,20 +1383,33 @@ class MakePharoBindingsVisitor:
                 name = 'selfObject'
             value = name
 
-            if arg.type in self.interfaceTypeMap:
-                value = self.processText("(self validHandleOf: $ArgName)", ArgName=name)
+            if name in handleArrayArguments:
+                value = name + '_'
+            elif arg.type in self.interfaceTypeMap:
+                if unchecked:
+                    value = self.processText("($ArgName ifNotNil: [ $ArgName handle ])", ArgName=name)
+                else:
+                    value = self.processText("(self validHandleOf: $ArgName)", ArgName=name)
 
             if first:
-                if first and clazz is not None:
+                if first and clazz is not None and unchecked:
+                    self.printString('_$ArgName: (self handle)', ArgName=name)
+                elif first and clazz is not None:
                     self.printString('_$ArgName: (self validHandle)', ArgName=name)
                 else:
                     self.printString('_$ArgName: $ArgValue', ArgName=name, ArgValue=value)
                 first = False
             else:
                 self.printString(' $ArgName: $ArgValue', ArgName=name, ArgValue=value)
-        self.printLine('.')
+        if len(scratchArguments) != 0:
+            self.printLine(' ]')
+            self.printLine('\t\tensure: [ $Releases ].', Releases='. '.join('handleBuffers_ release: %s_' % name for name in scratchArguments))
+        else:
+            self.printLine('.')
 
-        if method.returnType in self.interfaceTypeMap:
+        if method.returnType in self.interfaceTypeMap and self.wrapperRegistry:
+            self.printLine('\t^ $InterfaceWrapper forOwnedHandle: resultValue_', InterfaceWrapper=self.interfaceTypeMap[method.returnType])
+        elif method.returnType in self.interfaceTypeMap:
             self.printLine('\t^ $InterfaceWrapper forHandle: resultValue_', InterfaceWrapper=self.interfaceTypeMap[method.returnType])
         elif method.returnType == 'error':
             self.printLine('\tself checkErrorCode: resultValue_')
@@ -571,8 +1425,13 @@ class MakePharoBindingsVisitor:
         self.printLine("{ #category : #'$Category' }", Category=category)
         self.printLine("$ClassName >> $MethodHeader [", ClassName=className, MethodHeader=methodHeader)
 
-    def beginMethodAppendingFile(self, className, category, methodHeader):
-        self.beginClassFileAppending(self.generatedCodeCategory, className, category.startswith('*'))
+    def beginCalloutMethod(self, category, methodHeader):
+        selector = ''.join(part for part in methodHeader.split() if part.endswith(':'))
+        self.calloutSelectors.append(selector or methodHeader)
+        self.beginMethod(self.cbindingsClassName, category, methodHeader)
+
+    def beginMethodAppendingFile(self, package, className, category, methodHeader):
+        self.beginClassFileAppending(package, className, category.startswith('*'))
         self.beginMethod(className, category, methodHeader)
 
     def endMethod(self):
@@ -580,10 +1439,18 @@ class MakePharoBindingsVisitor:
         self.newline()
 
 
+def generatePharoBindings(api, outputDirectory, forSqueak = False, target = None):
+    visitor = MakePharoBindingsVisitor(outputDirectory, api, forSqueak, target)
+    api.accept(visitor)
+    return visitor.outputFiles
+
+def generateSqueakBindings(api, outputDirectory, target = None):
+    return generatePharoBindings(api, outputDirectory, True, target)
+
 def main():
-    arguments = sys.argv[1:]
+    profile, arguments = parseProfileArguments(sys.argv[1:])
     if len(arguments) < 2:
-        print("make-headers [-squeak] <definitions> <output dir>")
+        print("make-headers [-squeak] [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
         return
 
     forSqueak = False
@@ -591,9 +1458,13 @@ def main():
         arguments = arguments[1:]
         forSqueak = True
 
-    api = ApiDefinition.loadFromFileNamed(arguments[0])
-    visitor = MakePharoBindingsVisitor(arguments[1], api, forSqueak)
-    api.accept(visitor)
+    profile.start()
+    profile.instrumentEmitters(MakePharoBindingsVisitor)
+    api = profile.loadApiDefinition(arguments[0])
+    outputFiles = generatePharoBindings(api, arguments[1], forSqueak)
+    outputFiles.printSummary()
+    profile.recordOutputs(outputFiles)
+    profile.finish()
 
 if __name__ == '__main__':
     main()
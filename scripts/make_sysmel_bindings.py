@@ -1,10 +1,14 @@
 #!/usr/bin/python3
-import re
 import sys
 import os.path
 
 from definition import *
-from string import Template
+from command_lists import hasCommandLists, getCommands
+from vectorized_methods import CountArgumentName, ObjectsArgumentName, getVectorizedMethods, getArrayFunctionName
+from emitter import Emitter
+from generation_manifest import generateOutputsIncrementally
+from generation_profile import parseProfileArguments
+from output_files import OutputFileSet
 
 OUTPUT_HEADER = """
 namespace $Namespace definition:
@@ -99,6 +103,44 @@ template SmartRefPtr(PT: Type)
 
 """
 
+COMMAND_LIST_START = """struct CommandList definition: {
+    private field storage_ type: UInt8 pointer.
+    private field capacity_ type: UInt32.
+    private field size_ type: UInt32.
+
+    inline method initializeWith: (storage: UInt8 pointer) capacity: (capacity: UInt32) ::=> Void := {
+        storage_ := storage.
+        capacity_ := capacity.
+        size_ := 0.
+    }.
+
+    inline method reset => Void := {
+        size_ := 0.
+    }.
+
+    ## Runs the recorded commands with a single call, and empties the list.
+    method execute => Void := {
+        let commandsSize := size_.
+        size_ := 0.
+        if: commandsSize > 0 then: {
+            throwIfError: (${FunctionPrefix}ExecuteCommandList(commandsSize, storage_)).
+        }.
+    }.
+
+    ## The recorded commands are executed when the storage is full. A command
+    ## larger than the storage is not recorded, and its recorder calls it directly.
+    inline method beginCommand: (opcode: UInt32) size: (commandSize: UInt32) ::=> UInt8 pointer := {
+        if: size_ + commandSize > capacity_ then: {
+            self execute.
+        }.
+        let command := storage_ + size_.
+        (command reinterpretCastTo: UInt32 pointer) _ := opcode.
+        ((command + 4) reinterpretCastTo: UInt32 pointer) _ := commandSize.
+        size_ := size_ + commandSize.
+        command + 8
+    }.
+"""
+
 OUTPUT_FOOTER = """
 
 inline method throwIfError: (errorCode: Error) ::=> Void := {
@@ -111,55 +153,15 @@ inline method throwIfError: (errorCode: Error) ::=> Void := {
 }. ## End of namespace $Namespace
 """
 
-# Converts text in 'CamelCase' into 'CAMEL_CASE'
-# Snippet taken from: http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-def convertToUnderscore(s):
-    return re.sub('(?!^)([0-9A-Z]+)', r'_\1', s).upper().replace('__', '_')
-
-
-def convertToCamelCase(s):
-    result = ''
-    begin = True
-    for c in s:
-        if c == '_':
-            begin = True
-        elif begin:
-            result += c.upper()
-            begin = False
-        else:
-            result += c
-    return result
-
-def convertToLowCamelCase(s):
-    result = ''
-    begin = True
-    first = True
-    for c in s:
-        if c == '_':
-            begin = True
-        elif begin:
-            if not first:
-                result += c.upper()
-            else:
-                result += c
-            begin = False
-            first = False
-        else:
-            result += c
-    return result
 
 def nameListToString(nameList):
-    nameString = ''
-    for name in nameList:
-        if len(nameString) > 0:
-            nameString += ' '
-        nameString += name
-    return nameString
+    return ' '.join(nameList)
 
 
-class MakeSysmelBindingsVisitor:
-    def __init__(self, outputFileName, apiDefinition):
-        self.out = open(outputFileName, "w")
+class MakeSysmelBindingsVisitor(Emitter):
+    def __init__(self, outputFileName, apiDefinition, target = None):
+        self.outputFiles = OutputFileSet(target)
+        self.out = self.outputFiles.create(outputFileName)
         self.outFileName = outputFileName
         self.variables = {}
         self.enums = {}
@@ -170,40 +172,20 @@ class MakeSysmelBindingsVisitor:
         self.namespace = apiDefinition.getBindingProperty(self.targetLanguage, 'namespace')
         self.startedExtensions = set()
 
-    def processText(self, text, **extraVariables):
-        t = Template(text)
-        return t.substitute(**dict(list(self.variables.items()) + list(extraVariables.items())))
-
-    def write(self, text):
-        self.out.write(text)
-
-    def writeLine(self, line):
-        self.write(line)
-        self.newline()
-
-    def newline(self):
-        self.write('\n')
-
-    def printString(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-
-    def printLine(self, text, **extraVariables):
-        self.write(self.processText(text, **extraVariables))
-        self.newline()
-
     def printHR(self):
         self.printLine("#"*80)
 
     def visitApiDefinition(self, api):
         self.setup(api)
         self.processVersions(api.versions)
-        try:
-            self.emitBindings(api)
-        finally:
-            self.finishCurrentFile()
+        self.processExtensions(api.extensions)
+        self.emitBindings(api)
+        self.finishCurrentFile()
+        self.outputFiles.commit()
 
     def setup(self, api):
         self.api = api
+        self.index = api.getIndex()
         self.variables = {
             'ConstantPrefix': api.constantPrefix,
             'FunctionPrefix': api.functionPrefix,
@@ -211,7 +193,7 @@ class MakeSysmelBindingsVisitor:
         }
 
     def visitEnum(self, enum):
-        enumTypeName = convertToCamelCase(enum.name);
+        enumTypeName = self.index.camelCaseName(enum.name);
         self.enums[enumTypeName] = enum
         cenumName = enum.name
         self.typeBindings[cenumName] = enumTypeName
@@ -221,13 +203,13 @@ class MakeSysmelBindingsVisitor:
 
     def visitInterface(self, interface):
         cname = interface.name
-        interfaceName = convertToCamelCase(interface.name)
+        interfaceName = self.index.camelCaseName(interface.name)
         self.interfaceTypeMap[interface.name + '*'] = interfaceName + " pointer"
         self.typeBindings[cname] = interfaceName
 
     def visitStruct(self, aggregate):
         cname = aggregate.name
-        structName = convertToCamelCase(aggregate.name)
+        structName = self.index.camelCaseName(aggregate.name)
         self.typeBindings[cname] = structName
 
     def visitUnion(self, aggregate):
@@ -256,9 +238,14 @@ class MakeSysmelBindingsVisitor:
         for version in versions.values():
             self.processVersion(version)
 
+    def processExtension(self, extension):
+        self.processFragment(extension)
+
+    def processExtensions(self, extensions):
+        for extension in extensions.values():
+            self.processExtension(extension)
+
     def finishCurrentFile(self):
-        if self.out is not None:
-            self.out.close()
         self.out = None
 
     def emitTypeDefs(self):
@@ -269,9 +256,9 @@ class MakeSysmelBindingsVisitor:
         self.printLine("## Interface declarations.")
         self.printHR()
 
-        for version in api.versions.values():
-            for interface in version.interfaces:
-                self.printLine("class $InterfaceName definition: {}.", InterfaceName=convertToCamelCase(interface.name))
+        for fragment in self.index.fragments:
+            for interface in fragment.interfaces:
+                self.printLine("class $InterfaceName definition: {}.", InterfaceName=self.index.camelCaseName(interface.name))
         self.newline()
 
     def emitEnums(self):
@@ -300,7 +287,7 @@ class MakeSysmelBindingsVisitor:
         kind = "struct"
         if aggregate.isUnion():
             kind = "union"
-        name = convertToCamelCase(aggregate.name)
+        name = self.index.camelCaseName(aggregate.name)
         self.printLine("$AggregateKind $Name definition: {", AggregateKind=kind, Name=name)
         for field in aggregate.fields:
             self.printLine("\tpublic field $FieldName type: $FieldType.", FieldType=self.makeFullTypeName(field.type), FieldName=field.name)
@@ -309,47 +296,47 @@ class MakeSysmelBindingsVisitor:
         self.newline()
 
     def emitAggregates(self, api):
-        for version in api.versions.values():
-            for struct in version.agreggates:
+        for fragment in self.index.fragments:
+            for struct in fragment.agreggates:
                 self.emitAggregate(struct)
 
-    def isValidIdentCharacter(self, character):
-        return ('a' <= character and character <= 'z') or \
-               ('A' <= character and character <= 'Z') or \
-               ('0' <= character and character <= '9') or \
-               character == '_'
-
     def makeFullTypeName(self, rawTypeName):
-        baseTypeNameSize = 0
-        for i in range(len(rawTypeName)):
-            if self.isValidIdentCharacter(rawTypeName[i]):
-                baseTypeNameSize = i + 1
-            else:
-                break
-
-        baseTypeName = rawTypeName[0:baseTypeNameSize]
-        typeDecorators = rawTypeName[baseTypeNameSize:].replace('*', ' pointer')
-        mappedBaseType = self.typeBindings[baseTypeName]
-        #print "'%s' %d '%s' '%s' -> '%s'" % (rawTypeName, baseTypeNameSize, baseTypeName, typeDecorators, mappedBaseType);
-        return mappedBaseType + typeDecorators
+        descriptor = self.index.getTypeDescriptor(rawTypeName)
+        return self.typeBindings[descriptor.baseName] + descriptor.decorators.replace('*', ' pointer')
 
     def emitCBindings(self, api):
         self.printHR()
         self.printLine("## The exported C API functions.")
         self.printHR()
 
-        for version in api.versions.values():
+        for fragment in self.index.fragments:
             # Emit the global c functions
-            self.emitCGlobals(version.globals)
+            self.emitCGlobals(fragment.globals)
 
             # Emit the methods of the interfaces.
-            for interface in version.interfaces:
+            for interface in fragment.interfaces:
                 self.emitInterfaceCBindings(interface)
+        if hasCommandLists(api):
+            self.printLine("function ${FunctionPrefix}ExecuteCommandList externC (size: UInt32, commands: Void const pointer) => Error.")
         self.newline()
 
     def emitInterfaceCBindings(self, interface):
         for method in interface.methods:
             self.emitCMethodBinding(method, interface.name)
+        for method in getVectorizedMethods(self.index, interface):
+            self.emitCArrayMethodBinding(method)
+
+    def getArrayArguments(self, method):
+        arrayArguments = [(ObjectsArgumentName, SelfArgument(method.clazz).type)]
+        for arg in method.arguments:
+            arrayArguments.append((arg.name, arg.type))
+        return arrayArguments
+
+    def emitCArrayMethodBinding(self, method):
+        self.printString("function $FunctionPrefix$FunctionName externC ($Count: UInt32", FunctionName=getArrayFunctionName(method), Count=CountArgumentName)
+        for name, type in self.getArrayArguments(method):
+            self.printString(", $ArgName: $ArgType const pointer", ArgName=name, ArgType=self.makeFullTypeName(type))
+        self.printLine(") => $ReturnType.", ReturnType=self.makeFullTypeName(method.returnType))
 
     def emitCGlobals(self, globals):
         for method in globals:
@@ -393,19 +380,19 @@ class MakeSysmelBindingsVisitor:
         self.printLine(") => $ReturnType.", ReturnType=self.makeFullTypeName(method.returnType))
 
     def emitInterfaceClasses(self, api):
-        for version in api.versions.values():
-            for interface in version.interfaces:
-                pharoName = self.namespacePrefix + convertToCamelCase(interface.name)
+        for fragment in self.index.fragments:
+            for interface in fragment.interfaces:
+                pharoName = self.namespacePrefix + self.index.camelCaseName(interface.name)
                 self.emitSubclass(self.interfaceBaseClassName, pharoName)
 
     def emitSmartPointers(self, api):
         self.printHR()
         self.printLine("## Smart pointers.")
         self.printHR()
-        for version in api.versions.values():
-            for interface in version.interfaces:
+        for fragment in self.index.fragments:
+            for interface in fragment.interfaces:
                 if interface.hasMethod('release') and interface.hasMethod('addReference'):
-                    self.printLine("compileTime constant ${InterfaceName}Ref := SmartRefPtr($InterfaceName).", InterfaceName=convertToCamelCase(interface.name))
+                    self.printLine("compileTime constant ${InterfaceName}Ref := SmartRefPtr($InterfaceName).", InterfaceName=self.index.camelCaseName(interface.name))
 
         self.newline()
 
@@ -414,27 +401,35 @@ class MakeSysmelBindingsVisitor:
         self.printLine("## Object bindings.")
         self.printHR()
 
-        for version in api.versions.values():
-            for interface in version.interfaces:
+        for fragment in self.index.fragments:
+            for interface in fragment.interfaces:
                 self.emitInterfaceBindings(interface)
 
     def emitInterfaceBindings(self, interface):
-        self.printLine('$Name extend: {', Name=convertToCamelCase(interface.name))
+        self.printLine('$Name extend: {', Name=self.index.camelCaseName(interface.name))
         for method in interface.methods:
             self.emitMethodWrapper(method)
+        vectorizedMethods = getVectorizedMethods(self.index, interface)
+        if len(vectorizedMethods) != 0:
+            self.printLine('\tmeta extend: {')
+            for method in vectorizedMethods:
+                self.emitBulkMethodWrapper(method)
+            self.printLine('\t}.')
         self.printLine('}.')
         self.newline()
 
     def convertMethodArgumentType(self, type):
-        if type.endswith('**') and self.api.isInterfaceReference(type[:-1]):
-            return self.makeFullTypeName(type[:-2]) + "Ref pointer"
-        if self.api.isInterfaceReference(type):
-            return self.makeFullTypeName(type[:-1]) + "Ref const ref"
+        descriptor = self.index.getTypeDescriptor(type)
+        if descriptor.isInterfacePointerReference:
+            return self.typeBindings[descriptor.baseName] + "Ref pointer"
+        if descriptor.isInterfaceReference:
+            return self.typeBindings[descriptor.baseName] + "Ref const ref"
         return self.makeFullTypeName(type)
 
     def convertMethodReturnType(self, type, allowError = False):
-        if self.api.isInterfaceReference(type):
-            return self.makeFullTypeName(type[:-1]) + "Ref"
+        descriptor = self.index.getTypeDescriptor(type)
+        if descriptor.isInterfaceReference:
+            return self.typeBindings[descriptor.baseName] + "Ref"
         if type == "error" and not allowError:
             return "Void"
         return self.makeFullTypeName(type)
@@ -447,7 +442,7 @@ class MakeSysmelBindingsVisitor:
         first = True
         for arg in method.arguments:
             name = arg.name
-            selectorName = convertToLowCamelCase(name)
+            selectorName = self.index.lowCamelCaseName(name)
             type = self.convertMethodArgumentType(arg.type)
             if first:
                 first = False
@@ -463,7 +458,7 @@ class MakeSysmelBindingsVisitor:
         if method.returnType == "error" and not method.errorIsNotException:
             self.printString('\t\t:= throwIfError: (')
             hasEnclosingParentheses = True
-        elif self.api.isInterfaceReference(method.returnType):
+        elif self.index.getTypeDescriptor(method.returnType).isInterfaceReference:
             self.printString('\t\t:= $ReturnType for: (', ReturnType=returnType)
             hasEnclosingParentheses = True
         else:
@@ -482,9 +477,10 @@ class MakeSysmelBindingsVisitor:
         for arg in allArguments:
             convertedArgument = ""
             typeString = arg.type
-            if typeString.endswith('**') and self.api.isInterfaceReference(typeString[:-1]):
+            descriptor = self.index.getTypeDescriptor(typeString)
+            if descriptor.isInterfacePointerReference:
                 convertedArgument = self.processText('$Arg reinterpretCastTo: $Type', Arg = arg.name, Type=self.makeFullTypeName(typeString))
-            elif self.api.isInterfaceReference(typeString):
+            elif descriptor.isInterfaceReference:
                 convertedArgument = arg.name + ' getPointer'
             else:
                 convertedArgument = arg.name
@@ -506,6 +502,66 @@ class MakeSysmelBindingsVisitor:
             self.printLine('.')
         self.newline()
 
+    def emitBulkMethodWrapper(self, method):
+        arrayArguments = self.getArrayArguments(method)
+        self.printString('\t\tinline method bulk$Name: ($Count: UInt32)', Name=method.name[0].upper() + method.name[1:], Count=CountArgumentName)
+        for name, type in arrayArguments:
+            self.printString(' $ArgSelectorName: ($ArgName: $ArgType const pointer)', ArgSelectorName=self.index.lowCamelCaseName(name), ArgName=name, ArgType=self.makeFullTypeName(type))
+        self.printLine(' ::=> Void')
+
+        call = self.processText('$FunctionPrefix$FunctionName($Arguments)', FunctionName=getArrayFunctionName(method),
+            Arguments=', '.join([CountArgumentName] + [name for name, type in arrayArguments]))
+        if method.returnType == 'error':
+            self.printLine('\t\t\t:= throwIfError: ($Call).', Call=call)
+        else:
+            self.printLine('\t\t\t:= $Call.', Call=call)
+        self.newline()
+
+    def emitCommandList(self, api):
+        self.printHR()
+        self.printLine("## Command lists.")
+        self.printHR()
+        self.printString(COMMAND_LIST_START)
+        for command in getCommands(api):
+            self.emitCommandRecorder(command)
+        self.printLine("}.")
+        self.newline()
+
+    def emitCommandRecorder(self, command):
+        method = command.method
+        allArguments = [SelfArgument(method.clazz)] + method.arguments
+        selector = self.processText('$Selector: ($Name: $Type)', Selector=command.getSelectorName(), Name=allArguments[0].name, Type=self.makeFullTypeName(allArguments[0].type))
+        for arg in method.arguments:
+            selector += self.processText(' $Name: ($Name: $Type)', Name=arg.name, Type=self.makeFullTypeName(arg.type))
+
+        self.newline()
+        self.printLine("    inline method $Selector ::=> Void := {", Selector=selector)
+        self.printLine("        if: $Size > capacity_ then: {", Size=str(command.size))
+        self.printLine("            self execute.")
+        call = self.processText('$FunctionPrefix$FunctionName($Arguments)', FunctionName=method.cname, Arguments=', '.join(arg.name for arg in allArguments))
+        if method.returnType == 'error':
+            self.printLine("            throwIfError: ($Call).", Call=call)
+        else:
+            self.printLine("            $Call.", Call=call)
+        self.printLine("        } else: {")
+        self.printLine("            let arguments := self beginCommand: $Opcode size: $Size.", Opcode=str(command.opcode), Size=str(command.size))
+        for argumentIndex, (arg, kind) in enumerate(zip(allArguments, command.argumentKinds)):
+            value = arg.name
+            if kind == 'handle':
+                slotType = self.makeFullTypeName(arg.type) + ' pointer'
+            elif kind == 'float':
+                slotType = 'Float32 pointer'
+            elif kind == 'double':
+                slotType = 'Float64 pointer'
+            else:
+                slotType = 'Int64 pointer'
+                if self.index.getTypeDescriptor(arg.type).kind == 'enum':
+                    value += ' value'
+                value += ' castTo: Int64'
+            self.printLine("            ((arguments + $Offset) reinterpretCastTo: $SlotType) _ := $Value.", Offset=str(command.getArgumentOffset(argumentIndex)), SlotType=slotType, Value=value)
+        self.printLine("        }.")
+        self.printLine("    }.")
+
     def emitBindings(self, api):
         self.printString(OUTPUT_HEADER, Namespace=self.namespace)
         self.emitTypeDefs()
@@ -515,6 +571,8 @@ class MakeSysmelBindingsVisitor:
         self.emitCBindings(api)
         self.emitSmartPointers(api)
         self.emitObjectBindings(api)
+        if hasCommandLists(api):
+            self.emitCommandList(api)
         self.printString(OUTPUT_FOOTER, Namespace=self.namespace)
 
 
@@ -531,15 +589,29 @@ class MakeSysmelBindingsVisitor:
         self.newline()
 
 
+def generateSysmelBindings(api, outputFileName, target = None):
+    def emitBindings():
+        visitor = MakeSysmelBindingsVisitor(outputFileName, api, target)
+        api.accept(visitor)
+        return visitor.outputFiles
+
+    outputDirectory = os.path.dirname(outputFileName) or '.'
+    backendName = 'sysmel-' + os.path.basename(outputFileName)
+    return generateOutputsIncrementally(api, outputDirectory, backendName, [__file__], [outputFileName], emitBindings, target)
+
 def main():
-    arguments = sys.argv[1:]
+    profile, arguments = parseProfileArguments(sys.argv[1:])
     if len(arguments) < 2:
-        print("make-headers <definitions> <output dir>")
+        print("make-headers [--stats[=report.json]] [--profile[=dump.prof]] <definitions> <output dir>")
         return
 
-    api = ApiDefinition.loadFromFileNamed(arguments[0])
-    visitor = MakeSysmelBindingsVisitor(arguments[1], api)
-    api.accept(visitor)
+    profile.start()
+    profile.instrumentEmitters(MakeSysmelBindingsVisitor)
+    api = profile.loadApiDefinition(arguments[0])
+    outputFiles = generateSysmelBindings(api, arguments[1])
+    outputFiles.printSummary()
+    profile.recordOutputs(outputFiles)
+    profile.finish()
 
 if __name__ == '__main__':
     main()
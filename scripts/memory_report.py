@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+import sys
+import tracemalloc
+
+from definition import *
+
+
+class ModelMemoryReport:
+    def __init__(self):
+        self.visited = set()
+        self.bytesPerClass = {}
+        self.instancesPerClass = {}
+        self.stringBytes = 0
+        self.stringCount = 0
+        self.containerBytes = 0
+
+    def totalBytes(self):
+        return sum(self.bytesPerClass.values()) + self.stringBytes + self.containerBytes
+
+    def account(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return
+        if id(value) in self.visited:
+            return
+        self.visited.add(id(value))
+
+        if isinstance(value, str):
+            self.stringBytes += sys.getsizeof(value)
+            self.stringCount += 1
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            self.containerBytes += sys.getsizeof(value)
+            for element in value:
+                self.account(element)
+        elif isinstance(value, dict):
+            self.containerBytes += sys.getsizeof(value)
+            for key, element in value.items():
+                self.account(key)
+                self.account(element)
+        else:
+            self.accountObject(value)
+
+    def accountObject(self, node):
+        className = node.__class__.__name__
+        size = sys.getsizeof(node)
+        if hasattr(node, '__dict__'):
+            size += sys.getsizeof(node.__dict__)
+            for key, element in node.__dict__.items():
+                self.account(key)
+                self.account(element)
+
+        for clazz in node.__class__.__mro__:
+            for slot in getattr(clazz, '__slots__', ()):
+                self.account(getattr(node, slot, None))
+
+        self.bytesPerClass[className] = self.bytesPerClass.get(className, 0) + size
+        self.instancesPerClass[className] = self.instancesPerClass.get(className, 0) + 1
+
+    def printOn(self, out, methodCount):
+        out.write('%-16s %10s %12s %10s\n' % ('class', 'instances', 'bytes', 'avg'))
+        for className in sorted(self.bytesPerClass.keys()):
+            count = self.instancesPerClass[className]
+            size = self.bytesPerClass[className]
+            out.write('%-16s %10d %12d %10.1f\n' % (className, count, size, size / count))
+        out.write('%-16s %10d %12d\n' % ('str', self.stringCount, self.stringBytes))
+        out.write('%-16s %10s %12d\n' % ('containers', '', self.containerBytes))
+        out.write('\n')
+
+        total = self.totalBytes()
+        out.write('Model bytes: %d\n' % total)
+        out.write('Methods: %d\n' % methodCount)
+        if methodCount > 0:
+            out.write('Model bytes per method: %.1f\n' % (total / methodCount))
+
+def countMethods(api):
+    count = 0
+    for fragment in list(api.versions.values()) + list(api.extensions.values()):
+        count += len(fragment.globals)
+        for interface in fragment.interfaces:
+            count += len(interface.methods)
+    return count
+
+def main():
+    if len(sys.argv) < 2:
+        print("memory-report <definitions>")
+        return
+
+    tree = etree.parse(sys.argv[1])
+
+    # The lxml tree lives in libxml2 memory, so only the model is traced here.
+    tracemalloc.start()
+    api = ApiDefinition(tree.getroot())
+    tracedBytes, tracedPeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = ModelMemoryReport()
+    report.account(api)
+    methodCount = countMethods(api)
+    report.printOn(sys.stdout, methodCount)
+    print('Traced allocation bytes: %d (peak %d)' % (tracedBytes, tracedPeak))
+    if methodCount > 0:
+        print('Traced allocation bytes per method: %.1f' % (tracedBytes / methodCount))
+
+if __name__ == '__main__':
+    main()
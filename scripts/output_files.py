@@ -0,0 +1,220 @@
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import sys
+import tempfile
+
+# Environment variable for flushing every replaced output file to disk.
+FsyncVariable = 'PHANAPI_FSYNC'
+
+# Threads used for writing the files of backends with many small outputs.
+DefaultWriteJobs = min(8, (os.cpu_count() or 1) + 4)
+
+# Read the process umask once, so that files created through a temporary
+# file get the same permissions as files created with open().
+CurrentUmask = os.umask(0)
+os.umask(CurrentUmask)
+
+def readExistingFile(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
+
+def hashContent(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def syncDirectory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def replaceFileAtomically(path, content, fsync = False):
+    directory = os.path.dirname(path) or '.'
+    fd, temporaryPath = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(temporaryPath, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(temporaryPath, 0o666 & ~CurrentUmask)
+        os.replace(temporaryPath, path)
+    except BaseException:
+        try:
+            os.remove(temporaryPath)
+        except OSError:
+            pass
+        raise
+
+    if fsync:
+        syncDirectory(directory)
+
+def writeFileIfChanged(path, content, fsync = False):
+    if readExistingFile(path) == content:
+        return False
+    replaceFileAtomically(path, content, fsync)
+    return True
+
+class OutputSink:
+    """
+    Collects the text written by an emitter as a list of fragments, which
+    are joined once when the content is requested.
+    """
+    __slots__ = ('fragments',)
+
+    def __init__(self):
+        self.fragments = []
+
+    def write(self, text):
+        self.fragments.append(text)
+
+    def getvalue(self):
+        if len(self.fragments) != 1:
+            self.fragments = [''.join(self.fragments)]
+        return self.fragments[0]
+
+class FileOutputTarget:
+    """
+    Stores the outputs in the file system. Each file is written with a
+    single write into a temporary file that replaces the old one.
+    """
+    def __init__(self, fsync = None):
+        if fsync is None:
+            fsync = os.environ.get(FsyncVariable, '') not in ('', '0')
+        self.fsync = fsync
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read(self, path):
+        return readExistingFile(path)
+
+    def ensureDirectory(self, path):
+        if not os.path.isdir(path):
+            if os.path.exists(path):
+                raise Exception("Cannot create directory " + path)
+            os.mkdir(path)
+
+    def writeIfChanged(self, path, content):
+        return writeFileIfChanged(path, content, self.fsync)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+class MemoryOutputTarget:
+    """
+    Keeps the outputs in the files dictionary, keyed by path, for generating
+    without touching the disk.
+    """
+    def __init__(self):
+        self.files = {}
+
+    def exists(self, path):
+        return path in self.files
+
+    def read(self, path):
+        return self.files.get(path)
+
+    def ensureDirectory(self, path):
+        pass
+
+    def writeIfChanged(self, path, content):
+        if self.files.get(path) == content:
+            return False
+        self.files[path] = content
+        return True
+
+    def remove(self, path):
+        return self.files.pop(path, None) is not None
+
+class OutputFileSet:
+    """
+    Generated files are rendered into memory first. commit() compares each
+    one against the content in the target, and only replaces the files whose
+    content changed, so unchanged outputs keep their modification time.
+    With writeJobs above one, the files are written by a thread pool.
+    """
+    def __init__(self, target = None, writeJobs = 1):
+        if target is None:
+            target = FileOutputTarget()
+        self.target = target
+        self.writeJobs = writeJobs
+        self.files = {}
+        self.changedFiles = []
+        self.unchangedFiles = []
+        self.removedFiles = []
+        self.contentHashes = {}
+        self.byteCount = 0
+        self.lineCount = 0
+
+    def create(self, path):
+        out = OutputSink()
+        self.files[path] = out
+        return out
+
+    def open(self, path):
+        out = self.files.get(path)
+        if out is None:
+            out = self.create(path)
+        return out
+
+    def contains(self, path):
+        return path in self.files
+
+    def ensureDirectory(self, path):
+        self.target.ensureDirectory(path)
+
+    def keepUnchanged(self, paths):
+        self.unchangedFiles += paths
+
+    def removeFile(self, path):
+        if self.target.remove(path):
+            self.removedFiles.append(path)
+
+    def commitFile(self, item):
+        path, out = item
+        content = out.getvalue()
+        encodedContent = content.encode()
+        return path, self.target.writeIfChanged(path, content), len(encodedContent), content.count('\n'), hashlib.sha256(encodedContent).hexdigest()
+
+    def commit(self):
+        items = list(self.files.items())
+        if self.writeJobs > 1 and len(items) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.writeJobs) as executor:
+                results = list(executor.map(self.commitFile, items))
+        else:
+            results = [self.commitFile(item) for item in items]
+
+        for path, changed, byteCount, lineCount, contentHash in results:
+            self.byteCount += byteCount
+            self.lineCount += lineCount
+            self.contentHashes[path] = contentHash
+            if changed:
+                self.changedFiles.append(path)
+            else:
+                self.unchangedFiles.append(path)
+        self.files = {}
+
+    def printSummary(self, out = sys.stdout):
+        for path in self.changedFiles:
+            out.write('Updated %s\n' % path)
+        for path in self.removedFiles:
+            out.write('Removed %s\n' % path)
+        out.write('%d of %d generated files changed\n' % (len(self.changedFiles), len(self.changedFiles) + len(self.unchangedFiles)))
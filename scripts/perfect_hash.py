@@ -0,0 +1,71 @@
+FnvOffsetBasis = 2166136261
+FnvPrime = 16777619
+
+# Seeds tried for each bucket before giving up.
+MaxDisplacement = 1 << 20
+
+def hashName(name, seed):
+    # 32 bits FNV-1a starting from the seed, followed by the murmur3 finalizer,
+    # because the low bits of FNV-1a do not depend on the high bits of the seed.
+    # The generated C++ code must match it.
+    h = FnvOffsetBasis ^ seed
+    for c in name.encode():
+        h = ((h ^ c) * FnvPrime) & 0xffffffff
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+    return h
+
+def powerOfTwoAtLeast(value):
+    result = 1
+    while result < value:
+        result *= 2
+    return result
+
+class PerfectHash:
+    """
+    Hash and displace perfect hash of a set of names. The first level hash
+    selects a bucket, and the seed stored for that bucket is used by the
+    second level hash, which selects the slot:
+
+        slot = hashName(name, displacements[hashName(name, 0) & bucketMask]) & slotMask
+
+    Both table sizes are powers of two, and the slots without a name are None.
+    """
+    def __init__(self, names):
+        self.bucketCount = powerOfTwoAtLeast(max(1, len(names) // 4))
+        self.slotCount = powerOfTwoAtLeast(max(1, len(names)))
+        self.displacements = [0] * self.bucketCount
+        self.slots = [None] * self.slotCount
+        self.build(names)
+
+    def build(self, names):
+        buckets = [[] for i in range(self.bucketCount)]
+        for name in names:
+            buckets[hashName(name, 0) & (self.bucketCount - 1)].append(name)
+
+        # The largest buckets are placed first, while most slots are free.
+        bucketIndices = sorted(range(self.bucketCount), key=lambda index: len(buckets[index]), reverse=True)
+        for bucketIndex in bucketIndices:
+            bucket = buckets[bucketIndex]
+            if len(bucket) == 0:
+                break
+            self.displacements[bucketIndex] = self.placeBucket(bucket)
+
+    def placeBucket(self, bucket):
+        for seed in range(1, MaxDisplacement):
+            slots = set(hashName(name, seed) & (self.slotCount - 1) for name in bucket)
+            if len(slots) == len(bucket) and all(self.slots[slot] is None for slot in slots):
+                for name in bucket:
+                    self.slots[hashName(name, seed) & (self.slotCount - 1)] = name
+                return seed
+        raise Exception("Cannot find a perfect hash displacement for " + ', '.join(bucket))
+
+    def lookup(self, name):
+        seed = self.displacements[hashName(name, 0) & (self.bucketCount - 1)]
+        slot = hashName(name, seed) & (self.slotCount - 1)
+        if self.slots[slot] == name:
+            return slot
+        return None
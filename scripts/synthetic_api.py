@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+import argparse
+import sys
+
+from definition import *
+
+# Default sizes of a synthetic API, roughly a large real world API.
+DefaultParameters = {
+    'versions': 1,
+    'interfaces': 50,
+    'methods': 30,
+    'arguments': 3,
+    'enums': 20,
+    'constants': 16,
+    'structs': 20,
+}
+
+BINDINGS = \
+"""  <bindings>
+    <language name="C">
+      <property key="headerFile" value="synth.h"/>
+      <property key="headerInclude" value="&lt;SYNTH/synth.h&gt;"/>
+      <property key="icdIncludeFile" value="synth_icd.inc"/>
+      <property key="typePrefix" value="synth_"/>
+      <property key="constantPrefix" value="SYNTH_"/>
+      <property key="functionPrefix" value="synth"/>
+    </language>
+    <language name="C++">
+      <property key="headerFile" value="synth.hpp"/>
+    </language>
+    <language name="C++/Impl">
+      <property key="headerFile" value="synth_impl.hpp"/>
+      <property key="dispatchIncludeFile" value="synth_impl_dispatch.inc"/>
+      <property key="namespace" value="Synth"/>
+    </language>
+    <language name="Pharo">
+      <property key="namespacePrefix" value="SYNTH"/>
+      <property key="package" value="Synth-Generated"/>
+    </language>
+    <language name="Squeak">
+      <property key="namespacePrefix" value="SYNTH"/>
+      <property key="package" value="Synth-Generated"/>
+      <property key="externalStructureSuperClass" value="SYNTHExternalStructure"/>
+      <property key="externalUnionSuperClass" value="SYNTHExternalUnion"/>
+    </language>
+    <language name="Sysmel">
+      <property key="namespace" value="SYNTH"/>
+    </language>
+  </bindings>
+"""
+
+ERROR_ENUM = \
+"""      <enum name="error" ctype="int">
+        <constant name="Ok" value="0"/>
+        <constant name="Error" value="-1"/>
+        <constant name="NullPointer" value="-2"/>
+        <constant name="InvalidOperation" value="-3"/>
+      </enum>
+"""
+
+TYPES = \
+"""    <types>
+      <typedef name="byte" ctype="unsigned char"/>
+      <typedef name="int" ctype="signed int" sysmelType="Int32"/>
+      <typedef name="uint" ctype="unsigned int" sysmelType="UInt32"/>
+      <typedef name="pointer" ctype="void*" pharoType="void*" sysmelType="Void pointer"/>
+      <typedef name="size" ctype="unsigned int" sysmelType="UInt32"/>
+      <typedef name="float" ctype="float" sysmelType="Float32"/>
+      <typedef name="double" ctype="double" sysmelType="Float64"/>
+      <typedef name="bool" ctype="int" sysmelType="Int32"/>
+      <typedef name="cstring" ctype="const char*" pharoType="char*" sysmelType="Char8 const pointer"/>
+    </types>
+"""
+
+ScalarTypes = ['int', 'uint', 'float', 'size', 'pointer', 'double', 'bool']
+FieldTypes = ['uint', 'float', 'int', 'pointer', 'double']
+
+class SyntheticApiWriter:
+    """
+    Writes an api document with the requested number of versions, and of
+    interfaces, methods, enums and structs in each version. Methods take
+    scalar, struct pointer and interface arguments, so that every code path
+    of the generators is exercised.
+    """
+    def __init__(self, out, versions, interfaces, methods, arguments, enums, constants, structs):
+        self.out = out
+        self.versionCount = versions
+        self.interfaceCount = interfaces
+        self.methodCount = methods
+        self.argumentCount = arguments
+        self.enumCount = enums
+        self.constantCount = constants
+        self.structCount = structs
+
+    def write(self, text):
+        self.out.write(text)
+
+    def interfaceName(self, version, index):
+        return 'object_v%d_%d' % (version, index)
+
+    def structName(self, version, index):
+        return 'info_v%d_%d' % (version, index)
+
+    def writeApi(self):
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.write('<api name="Synthetic">\n')
+        self.write(BINDINGS)
+        for version in range(self.versionCount):
+            self.writeVersion(version)
+        self.write('</api>\n')
+
+    def writeVersion(self, version):
+        self.write('  <version name="%d.0">\n' % (version + 1))
+        if version == 0:
+            self.write(TYPES)
+        self.writeConstants(version)
+        self.writeStructs(version)
+        self.writeInterfaces(version)
+        self.write('  </version>\n')
+
+    def writeConstants(self, version):
+        self.write('    <constants>\n')
+        if version == 0:
+            self.write(ERROR_ENUM)
+        for enumIndex in range(self.enumCount):
+            self.write('      <enum name="mode_v%d_%d" ctype="int">\n' % (version, enumIndex))
+            for constantIndex in range(self.constantCount):
+                self.write('        <constant name="ModeV%dE%dValue%d" value="%d"/>\n' % (version, enumIndex, constantIndex, constantIndex))
+            self.write('      </enum>\n')
+        self.write('    </constants>\n')
+
+    def writeStructs(self, version):
+        self.write('    <structs>\n')
+        for structIndex in range(self.structCount):
+            self.write('      <struct name="%s">\n' % self.structName(version, structIndex))
+            for fieldIndex in range(4):
+                self.write('        <field name="field%d" type="%s"/>\n' % (fieldIndex, FieldTypes[(structIndex + fieldIndex) % len(FieldTypes)]))
+            self.write('      </struct>\n')
+        self.write('    </structs>\n')
+
+    def writeInterfaces(self, version):
+        self.write('    <interfaces>\n')
+        for interfaceIndex in range(self.interfaceCount):
+            self.writeInterface(version, interfaceIndex)
+        self.write('    </interfaces>\n')
+
+    def writeInterface(self, version, interfaceIndex):
+        name = self.interfaceName(version, interfaceIndex)
+        prefix = convertToCamelCase(name)
+        self.write('      <interface name="%s">\n' % name)
+        self.write('        <method name="addReference" cname="AddReference%s" returnType="error"/>\n' % prefix)
+        self.write('        <method name="release" cname="Release%s" returnType="error"/>\n' % prefix)
+        for methodIndex in range(self.methodCount):
+            returnType = ['error', 'int', self.interfaceName(version, (interfaceIndex + 1) % self.interfaceCount) + '*', 'float'][methodIndex % 4]
+            self.write('        <method name="method%d" cname="%sMethod%d" returnType="%s">\n' % (methodIndex, prefix, methodIndex, returnType))
+            for argumentIndex in range(self.argumentCount):
+                self.write('          <arg name="arg%d" type="%s"/>\n' % (argumentIndex, self.argumentType(version, interfaceIndex, methodIndex, argumentIndex)))
+            self.write('        </method>\n')
+        self.write('      </interface>\n')
+
+    def argumentType(self, version, interfaceIndex, methodIndex, argumentIndex):
+        selector = (methodIndex + argumentIndex) % (len(ScalarTypes) + 2)
+        if selector == len(ScalarTypes) and self.structCount > 0:
+            return self.structName(version, (interfaceIndex + methodIndex) % self.structCount) + '*'
+        elif selector == len(ScalarTypes) + 1:
+            return self.interfaceName(version, (interfaceIndex + argumentIndex) % self.interfaceCount) + '*'
+        return ScalarTypes[selector % len(ScalarTypes)]
+
+def makeSyntheticApi(out, **parameters):
+    arguments = dict(DefaultParameters)
+    arguments.update(parameters)
+    SyntheticApiWriter(out, **arguments).writeApi()
+
+def addSyntheticApiArguments(parser):
+    for name, value in DefaultParameters.items():
+        parser.add_argument('-' + name, type=int, default=value, help='number of %s (default %d)' % (name, value))
+
+def syntheticApiParameters(arguments):
+    return dict((name, getattr(arguments, name)) for name in DefaultParameters.keys())
+
+def main():
+    parser = argparse.ArgumentParser(prog='synthetic-api', description='Writes a synthetic API definition for benchmarking the generators.')
+    parser.add_argument('output', nargs='?', help='output file, standard output by default')
+    addSyntheticApiArguments(parser)
+    arguments = parser.parse_args()
+
+    if arguments.output is None:
+        makeSyntheticApi(sys.stdout, **syntheticApiParameters(arguments))
+    else:
+        with open(arguments.output, 'w') as f:
+            makeSyntheticApi(f, **syntheticApiParameters(arguments))
+
+if __name__ == '__main__':
+    main()
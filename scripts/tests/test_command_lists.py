@@ -0,0 +1,158 @@
+import io
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from definition import *
+from command_lists import getCommands
+from make_headers import generateHeaders
+from make_icdloader import generateIcdLoader
+
+# An API with a command that has an object, an integer and a float argument.
+COMMAND_LIST_API = \
+"""<?xml version="1.0" encoding="UTF-8"?>
+<api name="Rich">
+  <bindings>
+    <language name="C">
+      <property key="headerFile" value="rich.h"/>
+      <property key="headerInclude" value="&lt;RICH/rich.h&gt;"/>
+      <property key="icdIncludeFile" value="rich_icd.inc"/>
+      <property key="typePrefix" value="rich_"/>
+      <property key="constantPrefix" value="RICH_"/>
+      <property key="functionPrefix" value="rich"/>
+      <property key="commandLists" value="true"/>
+    </language>
+  </bindings>
+  <version name="1.0">
+    <types>
+      <typedef name="int" ctype="signed int"/>
+      <typedef name="float" ctype="float"/>
+    </types>
+    <constants>
+      <enum name="error" ctype="int">
+        <constant name="Ok" value="0"/>
+        <constant name="Error" value="-1"/>
+        <constant name="NullPointer" value="-2"/>
+        <constant name="InvalidOperation" value="-3"/>
+      </enum>
+    </constants>
+    <interfaces>
+      <interface name="device">
+        <method name="addReference" cname="AddDeviceReference" returnType="error"/>
+        <method name="release" cname="ReleaseDevice" returnType="error"/>
+        <method name="setValue" cname="SetDeviceValue" returnType="error">
+          <arg name="level" type="int"/>
+          <arg name="scale" type="float"/>
+        </method>
+      </interface>
+    </interfaces>
+  </version>
+</api>
+"""
+
+# Executes each buffer from an allocation of its exact size, so that the
+# address sanitizer reports any read past its end.
+DECODER_TEST_SOURCE = \
+"""#include <RICH/rich.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+static int calls;
+
+static rich_error setDeviceValue(rich_device *device, rich_int level, rich_float scale)
+{
+    ++calls;
+    return level == 7 && scale == 0.5f ? RICH_OK : RICH_ERROR;
+}
+
+static rich_error execute(const uint8_t *data, size_t size)
+{
+    uint8_t *commands = static_cast<uint8_t*> (malloc(size));
+    memcpy(commands, data, size);
+    rich_error error = richExecuteCommandList(unsigned(size), commands);
+    free(commands);
+    return error;
+}
+
+int main()
+{
+    rich_icd_dispatch dispatch = {};
+    dispatch.richSetDeviceValue = setDeviceValue;
+    rich_icd_dispatch *object = &dispatch;
+    rich_device *device = reinterpret_cast<rich_device*> (&object);
+
+    uint8_t command[32] = {};
+    uint32_t opcode = RICH_COMMAND_SET_DEVICE_VALUE;
+    uint32_t commandSize = sizeof(command);
+    int64_t level = 7;
+    float scale = 0.5f;
+    memcpy(command, &opcode, 4);
+    memcpy(command + 4, &commandSize, 4);
+    memcpy(command + 8, &device, sizeof(device));
+    memcpy(command + 16, &level, 8);
+    memcpy(command + 24, &scale, 4);
+
+    uint8_t shortCommand[8];
+    uint32_t shortCommandSize = sizeof(shortCommand);
+    memcpy(shortCommand, &opcode, 4);
+    memcpy(shortCommand + 4, &shortCommandSize, 4);
+
+    uint8_t smallerCommand[32];
+    uint32_t smallerCommandSize = 16;
+    memcpy(smallerCommand, command, sizeof(command));
+    memcpy(smallerCommand + 4, &smallerCommandSize, 4);
+
+    printf("%d ", execute(command, sizeof(command)));
+    printf("%d ", execute(shortCommand, sizeof(shortCommand)));
+    printf("%d ", execute(smallerCommand, sizeof(smallerCommand)));
+    printf("%d ", execute(command, 16));
+    printf("%d ", execute(command, 4));
+    printf("%d\\n", calls);
+    return 0;
+}
+"""
+
+class CommandListTest(unittest.TestCase):
+    def setUp(self):
+        self.temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-test-')
+        self.buildDirectory = self.temporaryDirectory.name
+        self.includeDirectory = os.path.join(self.buildDirectory, 'include', 'RICH')
+        os.makedirs(self.includeDirectory)
+
+        self.api = ApiDefinition.loadFromFileNamed(io.BytesIO(COMMAND_LIST_API.encode()))
+        generateHeaders(self.api, self.includeDirectory)
+        generateIcdLoader(self.api, self.buildDirectory)
+
+    def tearDown(self):
+        self.temporaryDirectory.cleanup()
+
+    def testCommandSizes(self):
+        self.assertEqual([(command.opcode, command.size) for command in getCommands(self.api)], [(1, 16), (2, 16), (3, 32)])
+
+    @unittest.skipIf(shutil.which('c++') is None, 'requires a C++ compiler')
+    def testMalformedCommandsAreRejected(self):
+        sourcePath = os.path.join(self.buildDirectory, 'decoder.cpp')
+        with open(sourcePath, 'w') as f:
+            f.write(DECODER_TEST_SOURCE)
+
+        program = os.path.join(self.buildDirectory, 'decoder')
+        flags = ['-fsanitize=address']
+        if subprocess.run(['c++'] + flags + ['-x', 'c++', '-o', os.devnull, '-'], input=b'int main() {}', stderr=subprocess.DEVNULL).returncode != 0:
+            flags = []
+        subprocess.run(['c++', '-std=c++11', '-DRICH_BUILD', '-I' + os.path.join(self.buildDirectory, 'include')] + flags +
+            ['-o', program, sourcePath, os.path.join(self.buildDirectory, 'redirection.cpp')], check=True)
+
+        # The valid command runs once, and the short and truncated commands are rejected.
+        output = subprocess.run([program], check=True, stdout=subprocess.PIPE).stdout.decode()
+        self.assertEqual(output.split(), ['0', '-3', '-3', '-3', '-3', '1'])
+
+if __name__ == '__main__':
+    unittest.main()
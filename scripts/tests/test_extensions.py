@@ -0,0 +1,136 @@
+import io
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from definition import *
+from make_headers import generateHeaders
+from make_headers_cpp import generateCppHeader
+from make_icdloader import generateIcdLoader
+from make_implementation_stubs_cpp import generateImplementationHeader, generateDispatchInclude
+
+# An API with a version and an extension, both with globals and interfaces.
+EXTENSION_API = \
+"""<?xml version="1.0" encoding="UTF-8"?>
+<api name="Rich">
+  <bindings>
+    <language name="C">
+      <property key="headerFile" value="rich.h"/>
+      <property key="headerInclude" value="&lt;RICH/rich.h&gt;"/>
+      <property key="icdIncludeFile" value="rich_icd.inc"/>
+      <property key="typePrefix" value="rich_"/>
+      <property key="constantPrefix" value="RICH_"/>
+      <property key="functionPrefix" value="rich"/>
+      <property key="directDispatch" value="true"/>
+      <property key="getProcAddress" value="true"/>
+    </language>
+    <language name="C++">
+      <property key="headerFile" value="rich.hpp"/>
+    </language>
+    <language name="C++/Impl">
+      <property key="headerFile" value="rich_impl.hpp"/>
+      <property key="dispatchIncludeFile" value="rich_impl_dispatch.inc"/>
+      <property key="namespace" value="Rich"/>
+    </language>
+  </bindings>
+  <version name="1.0">
+    <types>
+      <typedef name="int" ctype="signed int"/>
+    </types>
+    <constants>
+      <enum name="error" ctype="int">
+        <constant name="Ok" value="0"/>
+        <constant name="Error" value="-1"/>
+        <constant name="NullPointer" value="-2"/>
+        <constant name="InvalidOperation" value="-3"/>
+      </enum>
+    </constants>
+    <globals>
+      <function name="getPlatform" cname="GetPlatform" returnType="platform*"/>
+    </globals>
+    <interfaces>
+      <interface name="platform">
+        <method name="addReference" cname="AddPlatformReference" returnType="error"/>
+        <method name="release" cname="ReleasePlatform" returnType="error"/>
+        <method name="getVersion" cname="GetPlatformVersion" returnType="int"/>
+      </interface>
+    </interfaces>
+  </version>
+  <extensions>
+    <extension name="debug_report">
+      <globals>
+        <function name="getDebugLevel" cname="GetDebugLevel" returnType="int"/>
+      </globals>
+      <interfaces>
+        <interface name="debug_reporter">
+          <method name="addReference" cname="AddDebugReporterReference" returnType="error"/>
+          <method name="release" cname="ReleaseDebugReporter" returnType="error"/>
+          <method name="report" cname="ReportDebug" returnType="error">
+            <arg name="level" type="int"/>
+          </method>
+        </interface>
+      </interfaces>
+    </extension>
+  </extensions>
+</api>
+"""
+
+class ExtensionTest(unittest.TestCase):
+    def setUp(self):
+        self.temporaryDirectory = tempfile.TemporaryDirectory(prefix='phanapi-test-')
+        self.buildDirectory = self.temporaryDirectory.name
+        self.includeDirectory = os.path.join(self.buildDirectory, 'include', 'RICH')
+        os.makedirs(self.includeDirectory)
+
+        self.api = ApiDefinition.loadFromFileNamed(io.BytesIO(EXTENSION_API.encode()))
+        generateHeaders(self.api, self.includeDirectory)
+        generateCppHeader(self.api, self.includeDirectory)
+        generateImplementationHeader(self.api, self.includeDirectory)
+        generateDispatchInclude(self.api, self.includeDirectory)
+        generateIcdLoader(self.api, self.buildDirectory)
+
+    def tearDown(self):
+        self.temporaryDirectory.cleanup()
+
+    def readOutput(self, name):
+        with open(os.path.join(self.includeDirectory, name)) as f:
+            return f.read()
+
+    def testExtensionIsLoaded(self):
+        self.assertEqual(list(self.api.versions.keys()), ['1.0'])
+        self.assertEqual(list(self.api.extensions.keys()), ['debug_report'])
+
+    def testSingleDispatchTable(self):
+        header = self.readOutput('rich.h')
+        self.assertEqual(header.count('typedef struct _rich_icd_dispatch {'), 1)
+        self.assertIn('richGetDebugLevel_FUN richGetDebugLevel;', header)
+        self.assertIn('richReportDebug_FUN richReportDebug;', header)
+        self.assertEqual(self.readOutput('rich_icd.inc'),
+            '10,\nrichGetPlatform,\nrichAddPlatformReference,\nrichReleasePlatform,\nrichGetPlatformVersion,\n'
+            'richGetDebugLevel,\nrichAddDebugReporterReference,\nrichReleaseDebugReporter,\nrichReportDebug')
+
+    @unittest.skipIf(shutil.which('c++') is None, 'requires a C++ compiler')
+    def testOutputsCompile(self):
+        # The C++ header and the implementation header have the same include guard.
+        sources = {
+            'client.cpp': '#include <RICH/rich.hpp>\n',
+            'implementation.cpp': '#include <RICH/rich_impl.hpp>\n#include <RICH/rich_impl_dispatch.inc>\n',
+        }
+        paths = [os.path.join(self.buildDirectory, 'redirection.cpp')]
+        for name, content in sources.items():
+            paths.append(os.path.join(self.buildDirectory, name))
+            with open(paths[-1], 'w') as f:
+                f.write(content)
+
+        includeFlag = '-I' + os.path.join(self.buildDirectory, 'include')
+        for path in paths:
+            subprocess.run(['c++', '-std=c++11', '-fsyntax-only', '-DRICH_BUILD', includeFlag, path], check=True)
+
+if __name__ == '__main__':
+    unittest.main()
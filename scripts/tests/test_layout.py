@@ -0,0 +1,85 @@
+import io
+import os
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from definition import *
+from layout import Abis, computeAbiLayouts
+
+# A structure whose padding differs in each ABI.
+LAYOUT_API = \
+"""<?xml version="1.0" encoding="UTF-8"?>
+<api name="Rich">
+  <bindings>
+    <language name="C">
+      <property key="headerFile" value="rich.h"/>
+      <property key="typePrefix" value="rich_"/>
+      <property key="constantPrefix" value="RICH_"/>
+      <property key="functionPrefix" value="rich"/>
+    </language>
+  </bindings>
+  <version name="1.0">
+    <types>
+      <typedef name="char" ctype="char"/>
+      <typedef name="double" ctype="double"/>
+      <typedef name="int" ctype="signed int"/>
+      <typedef name="long" ctype="long"/>
+      <typedef name="pointer" ctype="void*"/>
+      <typedef name="long_long" ctype="long long"/>
+      <typedef name="size" ctype="size_t"/>
+      <typedef name="intptr" ctype="intptr_t"/>
+      <typedef name="uintptr" ctype="uintptr_t"/>
+      <typedef name="ptrdiff" ctype="ptrdiff_t"/>
+    </types>
+    <structs>
+      <struct name="mixed">
+        <field name="c" type="char"/>
+        <field name="d" type="double"/>
+        <field name="i" type="int"/>
+        <field name="l" type="long"/>
+        <field name="p" type="pointer"/>
+        <field name="q" type="long_long"/>
+        <field name="s" type="size"/>
+      </struct>
+      <struct name="pointer_sized">
+        <field name="size" type="size"/>
+        <field name="intptr" type="intptr"/>
+        <field name="uintptr" type="uintptr"/>
+        <field name="ptrdiff" type="ptrdiff"/>
+      </struct>
+    </structs>
+  </version>
+</api>
+"""
+
+class LayoutTest(unittest.TestCase):
+    def setUp(self):
+        api = ApiDefinition.loadFromFileNamed(io.BytesIO(LAYOUT_API.encode()))
+        self.layouts = computeAbiLayouts(api.getIndex())
+
+    def testAbis(self):
+        self.assertEqual(Abis, ['LP64', 'LLP64', 'ILP32', 'I386'])
+
+    def testStructureLayouts(self):
+        # The size, the alignment and the field offsets of each ABI.
+        expected = {
+            'LP64': (56, 8, [0, 8, 16, 24, 32, 40, 48]),
+            'LLP64': (48, 8, [0, 8, 16, 20, 24, 32, 40]),
+            'ILP32': (48, 8, [0, 8, 16, 20, 24, 32, 40]),
+            'I386': (36, 4, [0, 4, 12, 16, 20, 24, 32]),
+        }
+        for abi in Abis:
+            layout = self.layouts[abi].getTypeLayout('mixed')
+            self.assertEqual((layout.size, layout.alignment, [field.offset for field in layout.fields]), expected[abi], abi)
+
+    def testPointerSizedIntegers(self):
+        for abi, size in [('LP64', 8), ('LLP64', 8), ('ILP32', 4), ('I386', 4)]:
+            layout = self.layouts[abi].getTypeLayout('pointer_sized')
+            self.assertEqual([(field.size, field.kind, field.signed) for field in layout.fields],
+                [(size, 'integer', False), (size, 'integer', True), (size, 'integer', False), (size, 'integer', True)], abi)
+
+if __name__ == '__main__':
+    unittest.main()
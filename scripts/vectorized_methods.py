@@ -0,0 +1,64 @@
+from definition import *
+from command_lists import getCommandArgumentKind
+
+# Arguments of the array entry points, before the arrays of the method arguments.
+CountArgumentName = 'count'
+ObjectsArgumentName = 'objects'
+
+# The sizes of the integer C types that depend on the platform. long has 32
+# bits on Windows and the 32 bits platforms, and the other ones have the size
+# of a pointer.
+LongSize = 'long'
+PointerSize = 'pointer'
+
+# Size in bytes of the integer C types, checked in order.
+IntegerTypeSizes = [('long long', 8), ('int64_t', 8), ('intptr_t', PointerSize), ('size_t', PointerSize), ('ptrdiff_t', PointerSize),
+    ('long', LongSize), ('int32_t', 4), ('int16_t', 2), ('short', 2), ('int8_t', 1), ('char', 1)]
+UnsignedIntegerTypes = ['unsigned', 'uint', 'size_t']
+
+def checkVectorizedMethod(index, method):
+    # A vectorized method gets an array entry point that calls it for each
+    # object, with the arguments taken from parallel arrays.
+    if method.clazz is None:
+        raise Exception("Only interface methods can be vectorized: " + method.name)
+    if method.returnType not in ('void', 'error'):
+        raise Exception("Vectorized method %s must return void or error" % method.cname)
+    for arg in method.arguments:
+        if arg.name in (CountArgumentName, ObjectsArgumentName):
+            raise Exception("Vectorized method %s cannot have an argument named %s" % (method.cname, arg.name))
+        if arg.arrayReturn or arg.pointerList or getCommandArgumentKind(index, arg.type) is None:
+            raise Exception("Vectorized method %s argument %s is not a scalar or an object" % (method.cname, arg.name))
+
+def getVectorizedMethods(index, interface):
+    methods = []
+    for method in interface.methods:
+        if method.vectorize:
+            checkVectorizedMethod(index, method)
+            methods.append(method)
+    return methods
+
+def getArrayFunctionName(method):
+    return method.cname + 'Array'
+
+def getIntegerLayout(ctype):
+    # Returns the size in bytes and the signedness of an integer C type. The
+    # size is LongSize or PointerSize when it depends on the platform.
+    unsigned = any(typeName in ctype for typeName in UnsignedIntegerTypes)
+    for typeName, size in IntegerTypeSizes:
+        if typeName in ctype:
+            return size, not unsigned
+    return 4, not unsigned
+
+def getArrayElementLayout(index, typeString):
+    # Returns the kind of the array elements of an argument, with their size
+    # in bytes and signedness. The size of the objects is the pointer size.
+    kind = getCommandArgumentKind(index, typeString)
+    descriptor = index.getTypeDescriptor(typeString)
+    if kind == 'handle':
+        return kind, None, False
+    if kind == 'float':
+        return kind, 4, True
+    if kind == 'double':
+        return kind, 8, True
+    size, signed = getIntegerLayout(descriptor.definition.ctype or 'int')
+    return kind, size, signed